@@ -11,4 +11,21 @@ from model import Model
 from element_directory import ElementDirectory
 from element_id_generator import ElementIDGenerator
 from element_form import ElementForm
-from scheduler import Scheduler
\ No newline at end of file
+from scheduler import Scheduler
+from network_file import NetworkFile, NetworkWriter, convert_adjacency_csv
+from network_loader import DistributedNetwork, load_edge_list, load_adjacency_list
+from network_generator import generate_network, generate_local_network, write_network_file, write_adjacency_csv, \
+    hash_uniform, zipf_degrees, random_neighbors
+from state_writer import StateWriter, StateReader, merge_state_output
+from output_writer import OutputWriter
+from shared_state_file import SharedStateWriter, SharedStateReader, write_shared_text
+from aggregate import Aggregate, SumAggregate, CountAggregate, MeanAggregate, HistogramAggregate
+from probe import Probe, HistogramProbe, WeightedMeanProbe, BreakdownProbe
+from population import Population, write_population
+from column_store import ColumnStore
+from adaptive_sync import AdaptiveSync
+from state_buffer import StateBuffer
+from worker_pool import WorkerPool, shared_array, split_chunks
+from communicator import HierarchicalComm
+from compression import Compressor, register_codec
+from ensemble import Ensemble
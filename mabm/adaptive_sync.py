@@ -0,0 +1,115 @@
+__author__ = 'jgentile', 'ceharvey'
+
+# Approximate pickled size, beyond the serialized ElementID, of one request and of one
+# element state in the synchronization messages
+REQUEST_OVERHEAD = 8
+STATE_OVERHEAD = 16
+
+
+class AdaptiveSync:
+    """
+    Chooses, for each of a process's own elements, whether other processes request the element
+    or watch it.
+
+    A requested element costs one request per requesting process at each time step it is needed,
+    plus its state whenever it changed since the requester's copy. A watched element costs its
+    state at every change, needed or not. The owner counts the requests, replies and changes of
+    its elements, and every `every` time steps compares the bytes each element cost with the bytes
+    the other protocol would have cost over the same steps. An element switches when the other
+    protocol is cheaper by more than the hysteresis factor. Watched elements are no longer
+    requested, so the request rate observed when an element was switched to watching is used to
+    estimate what requests would cost.
+    """
+    __every = None
+    __hysteresis = None
+    __steps = None
+    __changes = None
+    __requests = None
+    __replies = None
+    __watched = None
+    __statistics = None
+
+    def __init__(self, every=10, hysteresis=0.8):
+        """
+        Decide every `every` time steps, switching an element when the other protocol costs less than
+        hysteresis times as much
+        """
+        self.__every = every
+        self.__hysteresis = hysteresis
+        self.__steps = 0
+        self.__changes = {}
+        self.__requests = {}
+        self.__replies = {}
+        # Watched elements, with the requests per step and the fraction of steps they were requested in
+        self.__watched = {}
+        self.__statistics = {'switches_to_watch': 0, 'switches_to_request': 0, 'estimated_bytes_saved': 0}
+
+    def count_change(self, eid):
+        """Count a change of state of an own element"""
+        self.__changes[eid] = self.__changes.get(eid, 0) + 1
+
+    def count_request(self, eid, requesters):
+        """Count the requests of a number of processes for an own element during a time step"""
+        self.__requests[eid] = self.__requests.get(eid, 0) + requesters
+
+    def count_reply(self, eid):
+        """Count a state sent in reply to requests for an own element"""
+        self.__replies[eid] = self.__replies.get(eid, 0) + 1
+
+    def is_watched(self, eid):
+        """Check if an own element is watched"""
+        return eid in self.__watched
+
+    def step(self):
+        """Count a time step, returns True when a decision is due"""
+        self.__steps += 1
+        return self.__steps >= self.__every
+
+    def decide(self):
+        """
+        Decide which elements switch protocol, returns the lists of elements switching to watches and
+        to requests, and starts counting a new period
+        """
+        to_watch = []
+        to_request = []
+        steps = float(self.__steps)
+
+        for eid in set(self.__requests) | set(self.__watched):
+            request_size = len(eid) + REQUEST_OVERHEAD
+            state_size = len(eid) + STATE_OVERHEAD
+            changes = self.__changes.get(eid, 0)
+            watch_cost = changes * state_size
+
+            if eid in self.__watched:
+                # Estimate the requests from the rate at which the element was requested before
+                per_step, fraction = self.__watched[eid]
+                request_cost = per_step * steps * request_size + min(changes, fraction * steps) * state_size
+                if request_cost < self.__hysteresis * watch_cost:
+                    del self.__watched[eid]
+                    to_request.append(eid)
+                    self.__statistics['switches_to_request'] += 1
+                else:
+                    self.__statistics['estimated_bytes_saved'] += int(request_cost - watch_cost)
+            else:
+                requests = self.__requests[eid]
+                request_cost = requests * request_size + self.__replies.get(eid, 0) * state_size
+                if watch_cost < self.__hysteresis * request_cost:
+                    self.__watched[eid] = (requests / steps, min(requests, steps) / steps)
+                    to_watch.append(eid)
+                    self.__statistics['switches_to_watch'] += 1
+
+        self.__steps = 0
+        self.__changes = {}
+        self.__requests = {}
+        self.__replies = {}
+        return to_watch, to_request
+
+    def get_num_watched(self):
+        """Return the number of own elements that are watched"""
+        return len(self.__watched)
+
+    def get_statistics(self):
+        """Return the number of switches and the estimated bytes saved by watching elements"""
+        statistics = dict(self.__statistics)
+        statistics['watched'] = len(self.__watched)
+        return statistics
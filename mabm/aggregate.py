@@ -0,0 +1,172 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import abc
+import numpy as np
+
+
+def _is_known(state):
+    """Check if a state is counted, that is neither None nor nan"""
+    return state is not None and state == state
+
+
+class Aggregate:
+    """
+    A statistic over the states of one type of element, maintained incrementally.
+
+    Elements report their state when they are created and each time it changes, so keeping the
+    statistic costs O(changes) rather than a scan over all elements. The local values of all
+    aggregates are reduced across processes together, see mabm.Model.reduce_aggregates().
+    States that are None or nan are not counted.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def add(self, state):
+        """Add the state of an element"""
+        pass
+
+    @abc.abstractmethod
+    def remove(self, state):
+        """Remove the state of an element"""
+        pass
+
+    def add_all(self, states):
+        """Add the states of many elements"""
+        for state in states:
+            self.add(state)
+
+    def change(self, old_state, new_state):
+        """Replace the old state of an element with its new state"""
+        self.remove(old_state)
+        self.add(new_state)
+
+    @abc.abstractmethod
+    def get_local(self):
+        """Return the local values to be summed across processes, as a list of floats"""
+        pass
+
+    @abc.abstractmethod
+    def get_value(self, reduced):
+        """Return the value of the statistic from the reduced values"""
+        pass
+
+
+class SumAggregate(Aggregate):
+    """
+    Sum of the states
+    """
+
+    def __init__(self):
+        self.__sum = 0.0
+
+    def add(self, state):
+        if _is_known(state):
+            self.__sum += state
+
+    def remove(self, state):
+        if _is_known(state):
+            self.__sum -= state
+
+    def add_all(self, states):
+        self.__sum += np.nansum(np.asarray(states, dtype=float))
+
+    def get_local(self):
+        return [self.__sum]
+
+    def get_value(self, reduced):
+        return reduced[0]
+
+
+class CountAggregate(Aggregate):
+    """
+    Number of elements whose state satisfies a condition, by default every state that is not None or nan
+    """
+
+    def __init__(self, condition=None):
+        self.__count = 0
+        self.__condition = condition
+
+    def __counts(self, state):
+        """Check if a state is counted"""
+        return _is_known(state) and (self.__condition is None or self.__condition(state))
+
+    def add(self, state):
+        if self.__counts(state):
+            self.__count += 1
+
+    def remove(self, state):
+        if self.__counts(state):
+            self.__count -= 1
+
+    def get_local(self):
+        return [self.__count]
+
+    def get_value(self, reduced):
+        return int(reduced[0])
+
+
+class MeanAggregate(Aggregate):
+    """
+    Mean of the states, the mean is None while no element has a state
+    """
+
+    def __init__(self):
+        self.__sum = 0.0
+        self.__count = 0
+
+    def add(self, state):
+        if _is_known(state):
+            self.__sum += state
+            self.__count += 1
+
+    def remove(self, state):
+        if _is_known(state):
+            self.__sum -= state
+            self.__count -= 1
+
+    def add_all(self, states):
+        states = np.asarray(states, dtype=float)
+        known = ~np.isnan(states)
+        self.__sum += states[known].sum()
+        self.__count += int(known.sum())
+
+    def get_local(self):
+        return [self.__sum, self.__count]
+
+    def get_value(self, reduced):
+        if reduced[1] == 0:
+            return None
+        return reduced[0] / reduced[1]
+
+
+class HistogramAggregate(Aggregate):
+    """
+    Number of states in each bin. Bin i holds the states in [edges[i], edges[i+1]), the last bin
+    also holds states equal to its upper edge. States outside of the edges are not counted.
+    """
+
+    def __init__(self, edges):
+        self.__edges = np.asarray(edges, dtype=float)
+        self.__counts = np.zeros(len(self.__edges) - 1)
+
+    def __bin(self, state):
+        """Return the bin of a state, or None if it is not counted"""
+        if not _is_known(state) or state < self.__edges[0] or state > self.__edges[-1]:
+            return None
+        return min(np.searchsorted(self.__edges, state, side='right') - 1, len(self.__counts) - 1)
+
+    def add(self, state):
+        i = self.__bin(state)
+        if i is not None:
+            self.__counts[i] += 1
+
+    def remove(self, state):
+        i = self.__bin(state)
+        if i is not None:
+            self.__counts[i] -= 1
+
+    def get_local(self):
+        return list(self.__counts)
+
+    def get_value(self, reduced):
+        return np.asarray(reduced, dtype=int)
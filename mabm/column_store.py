@@ -0,0 +1,121 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import os
+from collections import OrderedDict
+import numpy as np
+
+
+class ColumnStore:
+    """
+    Out-of-core storage for columns of element attributes, one value per slot.
+
+    Each column is a np.memmap file on (local scratch) disk, so the attributes take disk rather than
+    memory. The elements themselves, if the model keeps objects for them, are not stored. A resident
+    set of at most resident_blocks blocks of block_size slots sits in front of the files: values are
+    read and written in the resident copies, and changed blocks are written back when they are
+    evicted (least recently used first) or flushed. Visiting elements in slot order keeps both the
+    resident set and the disk access sequential.
+    """
+    __directory = None
+    __prefix = None
+    __num_slots = None
+    __block_size = None
+    __resident_blocks = None
+    __columns = None
+    __blocks = None
+    __dirty = None
+
+    def __init__(self, directory, prefix, num_slots, resident_blocks=64, block_size=65536):
+        """Create an empty store for num_slots elements, its files are named <directory>/<prefix>_<column>.col"""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.__directory = directory
+        self.__prefix = prefix
+        self.__num_slots = num_slots
+        self.__block_size = block_size
+        self.__resident_blocks = max(resident_blocks, 1)
+        self.__columns = {}
+        self.__blocks = OrderedDict()
+        self.__dirty = set()
+
+    def add_column(self, name, dtype, values=None):
+        """Create a column, filled with values if given and with zeros otherwise"""
+        path = self.get_path(name)
+        column = np.memmap(path, dtype=dtype, mode='w+', shape=(max(self.__num_slots, 1),))[:self.__num_slots]
+        if values is not None:
+            for start in xrange(0, self.__num_slots, self.__block_size):
+                column[start:start+self.__block_size] = values[start:start+self.__block_size]
+        self.__columns[name] = column
+
+    def get_path(self, name):
+        """Return the path of a column's file"""
+        return os.path.join(self.__directory, self.__prefix + '_' + name + '.col')
+
+    def get_num_slots(self):
+        """Return the number of slots"""
+        return self.__num_slots
+
+    def get(self, name, slot):
+        """Return the value of a column at a slot"""
+        return self.__block(name, slot // self.__block_size)[slot % self.__block_size].item()
+
+    def set(self, name, slot, value):
+        """Set the value of a column at a slot"""
+        block = slot // self.__block_size
+        self.__block(name, block)[slot % self.__block_size] = value
+        self.__dirty.add((name, block))
+
+    def get_column(self, name):
+        """Return a whole column as a read-only memory-mapped array, after writing back changed blocks"""
+        self.__write_back(name)
+        return self.__columns[name]
+
+    def flush(self):
+        """Write changed blocks back to the files and flush them to disk"""
+        for name in self.__columns:
+            self.__write_back(name)
+            self.__columns[name].flush()
+
+    def close(self, remove=True):
+        """Flush the columns and close them, removing their files unless remove is False"""
+        if self.__columns is None:
+            return
+        self.flush()
+        names = list(self.__columns)
+        self.__columns = None
+        self.__blocks = None
+        if remove:
+            for name in names:
+                os.remove(self.get_path(name))
+
+    def __block(self, name, block):
+        """Return the resident copy of a block, reading it and evicting another block if needed"""
+        key = (name, block)
+        # Consecutive slots are usually in the most recently used block
+        if self.__blocks and next(reversed(self.__blocks)) == key:
+            return self.__blocks[key]
+        values = self.__blocks.pop(key, None)
+        if values is None:
+            if len(self.__blocks) >= self.__resident_blocks:
+                self.__evict()
+            start = block * self.__block_size
+            values = np.array(self.__columns[name][start:start+self.__block_size])
+        # The most recently used block is last
+        self.__blocks[key] = values
+        return values
+
+    def __evict(self):
+        """Evict the least recently used block, writing it back if it changed"""
+        key, values = self.__blocks.popitem(last=False)
+        if key in self.__dirty:
+            self.__dirty.discard(key)
+            start = key[1] * self.__block_size
+            self.__columns[key[0]][start:start+len(values)] = values
+
+    def __write_back(self, name):
+        """Write the changed resident blocks of a column back to its file"""
+        for key in [key for key in self.__dirty if key[0] == name]:
+            self.__dirty.discard(key)
+            start = key[1] * self.__block_size
+            values = self.__blocks[key]
+            self.__columns[name][start:start+len(values)] = values
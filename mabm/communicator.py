@@ -0,0 +1,117 @@
+__author__ = 'jgentile', 'ceharvey'
+
+from mpi4py import MPI
+
+
+class HierarchicalComm:
+    """
+    Two-level communication over an MPI communicator: the processes of each node exchange messages
+    through shared memory with their node leader, the lowest rank of the node, and only the leaders
+    communicate between nodes.
+
+    Values are combined on the node before they are sent to the other nodes, so an element requested
+    or watched by every process of a node crosses the network once, and a broadcast crosses the
+    network once per node rather than once per process. Rank 0 of the communicator is the leader of
+    the first node and the root of the collectives.
+
+    Nodes are found with Split_type(COMM_TYPE_SHARED). With ranks_per_node, consecutive ranks are
+    grouped instead, which simulates nodes on a single machine.
+    """
+    __comm = None
+    __rank = None
+    __size = None
+    __node_comm = None
+    __leader_comm = None
+    __locations = None
+
+    def __init__(self, comm, ranks_per_node=None):
+        """Split comm into nodes, collective over comm"""
+        self.__comm = comm
+        self.__rank = comm.Get_rank()
+        self.__size = comm.Get_size()
+        if ranks_per_node:
+            self.__node_comm = comm.Split(self.__rank // ranks_per_node, self.__rank)
+        else:
+            self.__node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, self.__rank)
+
+        # The leaders have a communicator of their own, the other processes get none
+        leader = self.__node_comm.Get_rank() == 0
+        leader_comm = comm.Split(0 if leader else MPI.UNDEFINED, self.__rank)
+        self.__leader_comm = leader_comm if leader else None
+
+        # Node number and rank on the node of every process, to route point-to-point messages
+        node = self.__node_comm.bcast(self.__leader_comm.Get_rank() if leader else None, root=0)
+        self.__locations = comm.allgather((node, self.__node_comm.Get_rank()))
+
+    def Get_rank(self):
+        """Return the rank in the whole communicator"""
+        return self.__rank
+
+    def Get_size(self):
+        """Return the size of the whole communicator"""
+        return self.__size
+
+    def is_leader(self):
+        """Check if this process is the leader of its node"""
+        return self.__leader_comm is not None
+
+    def get_node(self):
+        """Return the number of this process's node"""
+        return self.__locations[self.__rank][0]
+
+    def get_num_nodes(self):
+        """Return the number of nodes"""
+        # Ranks need not be placed on the nodes in order
+        return max(node for node, local in self.__locations) + 1
+
+    def get_node_comm(self):
+        """Return the communicator of the processes of this node"""
+        return self.__node_comm
+
+    def get_leader_comm(self):
+        """Return the communicator of the node leaders, None on the other processes"""
+        return self.__leader_comm
+
+    def reduce(self, value, merge):
+        """
+        Combine the values of all processes with merge(a, b), first on each node and then across nodes,
+        returns the result on rank 0 and None elsewhere. merge may modify and return its first argument.
+        """
+        values = self.__node_comm.gather(value, root=0)
+        if self.__leader_comm is None:
+            return None
+        values = self.__leader_comm.gather(reduce(merge, values), root=0)
+        if self.__rank != 0:
+            return None
+        return reduce(merge, values)
+
+    def bcast(self, value):
+        """Broadcast a value from rank 0, to the leaders and then from each leader to its node"""
+        if self.__leader_comm is not None:
+            value = self.__leader_comm.bcast(value, root=0)
+        return self.__node_comm.bcast(value, root=0)
+
+    def allreduce(self, value, merge):
+        """Combine the values of all processes with merge(a, b) and return the result on every process"""
+        return self.bcast(self.reduce(value, merge))
+
+    def alltoall(self, values):
+        """
+        Send values[i] to process i and return the values received from every process, like
+        mpi4py's alltoall(). The values of a node bound to another node are sent in a single message
+        between their leaders.
+        """
+        gathered = self.__node_comm.gather((self.__rank, values), root=0)
+        received = None
+        if self.__leader_comm is not None:
+            locations = self.__locations
+            outgoing = [[] for i in range(self.__leader_comm.Get_size())]
+            for source, source_values in gathered:
+                for destination, value in enumerate(source_values):
+                    node, local = locations[destination]
+                    outgoing[node].append((local, source, value))
+            received = [[None] * self.__size for i in range(self.__node_comm.Get_size())]
+            for messages in self.__leader_comm.alltoall(outgoing):
+                for local, source, value in messages:
+                    received[local][source] = value
+        return self.__node_comm.scatter(received, root=0)
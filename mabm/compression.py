@@ -0,0 +1,189 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import cPickle
+import time
+import zlib
+import numpy as np
+
+
+def varint_encode(values):
+    """Encode an array of integers as zigzag varints, 7 bits per byte, returns a string"""
+    values = np.asarray(values, dtype=np.int64)
+    # Zigzag maps small negative numbers to small unsigned numbers
+    zigzag = ((values << 1) ^ (values >> 63)).astype(np.uint64)
+    lengths = np.ones(len(zigzag), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += zigzag >= np.uint64(1 << (7 * k))
+    starts = np.cumsum(lengths) - lengths
+    encoded = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        selected = lengths > k
+        low = (zigzag[selected] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        # The high bit is set on every byte but the last of a value
+        more = (lengths[selected] > k + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[selected] + k] = low | more
+    return encoded.tostring()
+
+
+def varint_decode(encoded):
+    """Decode a string of zigzag varints, returns an array of integers"""
+    encoded = np.frombuffer(encoded, dtype=np.uint8)
+    ends = np.flatnonzero(encoded < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+    lengths = ends - starts + 1
+    zigzag = np.zeros(len(ends), dtype=np.uint64)
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        selected = lengths > k
+        low = encoded[starts[selected] + k].astype(np.uint64) & np.uint64(0x7f)
+        zigzag[selected] |= low << np.uint64(7 * k)
+    return (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+
+
+class ZlibCodec:
+    """Pickles a message and compresses it with zlib"""
+    __level = None
+
+    def __init__(self, level=1):
+        """Compress at the zlib level, 1 is the fastest"""
+        self.__level = level
+
+    def encode(self, message, pickled):
+        """Return the message encoded as a string, pickled is its pickle"""
+        return zlib.compress(pickled, self.__level)
+
+    def decode(self, encoded):
+        """Return the message of an encoded string"""
+        return cPickle.loads(zlib.decompress(encoded))
+
+
+class ElementIDCodec:
+    """
+    Encodes the serialized ElementIDs ('type|number|process|birth') keying the dictionaries of a message
+    as four columns of varints rather than as strings, and pickles everything else. The dictionaries are
+    the message itself or the items of a message that is a tuple, as in the requests and states of
+    mabm.Model.resolve_element_request().
+
+    With delta, the IDs are sorted and each column holds the differences between consecutive IDs, which
+    are small for the runs of consecutive numbers found in synchronization messages. With level, the
+    result is compressed with zlib at that level.
+    """
+    __delta = None
+    __level = None
+
+    def __init__(self, delta=False, level=None):
+        """Sort and delta-encode the IDs if delta, and compress the result at a zlib level if given"""
+        self.__delta = delta
+        self.__level = level
+
+    def encode(self, message, pickled):
+        """Return the message encoded as a string, pickled is its pickle"""
+        if isinstance(message, tuple):
+            parts = [self.__encode_part(part) for part in message]
+        else:
+            parts = self.__encode_part(message)
+        encoded = cPickle.dumps(parts, cPickle.HIGHEST_PROTOCOL)
+        if self.__level is not None:
+            encoded = zlib.compress(encoded, self.__level)
+        return encoded
+
+    def decode(self, encoded):
+        """Return the message of an encoded string"""
+        if self.__level is not None:
+            encoded = zlib.decompress(encoded)
+        parts = cPickle.loads(encoded)
+        if isinstance(parts, list):
+            return tuple(self.__decode_part(part) for part in parts)
+        return self.__decode_part(parts)
+
+    def __encode_part(self, part):
+        """Return (ids, values) for a dictionary keyed by ElementIDs, and (None, part) for anything else"""
+        if not isinstance(part, dict) or not part:
+            return None, part
+        keys = part.keys()
+        try:
+            ids = np.array([key.split('|') for key in keys], dtype=np.int64)
+        except (AttributeError, ValueError):
+            return None, part
+        if ids.ndim != 2 or ids.shape[1] != 4:
+            return None, part
+        if self.__delta:
+            # Sort by type, process and birth process, then by number
+            order = np.lexsort((ids[:, 1], ids[:, 3], ids[:, 2], ids[:, 0]))
+            ids = ids[order]
+            keys = [keys[i] for i in order]
+            ids = np.concatenate((ids[:1], ids[1:] - ids[:-1]))
+        return varint_encode(ids.T.ravel()), [part[key] for key in keys]
+
+    def __decode_part(self, part):
+        """Return the part encoded by __encode_part()"""
+        ids, values = part
+        if ids is None:
+            return values
+        ids = varint_decode(ids).reshape(4, -1).T
+        if self.__delta:
+            ids = np.cumsum(ids, axis=0)
+        keys = ['|'.join(row) for row in ids.astype(str).tolist()]
+        return dict(zip(keys, values))
+
+
+# Codecs by name, see register_codec()
+_codecs = {'zlib': ZlibCodec(), 'varint': ElementIDCodec(), 'delta': ElementIDCodec(delta=True),
+           'delta-zlib': ElementIDCodec(delta=True, level=1)}
+
+
+def register_codec(name, codec):
+    """
+    Register a codec under a name for Compressor. A codec has encode(message, pickled), which returns
+    a string given the message and its pickle, and decode(string), which returns the message.
+    """
+    _codecs[name] = codec
+
+
+class Compressor:
+    """
+    Compresses the messages larger than a threshold with a codec, see register_codec(): 'zlib' deflates
+    the pickled message, 'varint' and 'delta' encode the ElementIDs keying its dictionaries as integers
+    and 'delta-zlib' deflates the result of 'delta'.
+    Smaller messages are sent pickled.
+
+    Counts the messages compressed, their bytes before and after and the time spent encoding and
+    decoding them, see get_statistics().
+    """
+    __codec = None
+    __threshold = None
+    __statistics = None
+
+    def __init__(self, codec='zlib', threshold=4096):
+        """Compress the messages of at least threshold pickled bytes with a codec, given by name or itself"""
+        self.__codec = _codecs[codec] if isinstance(codec, str) else codec
+        self.__threshold = threshold
+        self.__statistics = {'compressed_messages': 0, 'raw_bytes': 0, 'compressed_bytes': 0,
+                             'encode_seconds': 0.0, 'decode_seconds': 0.0}
+
+    def pack(self, message):
+        """Return a message as (compressed, string), to send in its place"""
+        pickled = cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL)
+        if len(pickled) < self.__threshold:
+            return False, pickled
+        start = time.time()
+        encoded = self.__codec.encode(message, pickled)
+        statistics = self.__statistics
+        statistics['encode_seconds'] += time.time() - start
+        statistics['compressed_messages'] += 1
+        statistics['raw_bytes'] += len(pickled)
+        statistics['compressed_bytes'] += len(encoded)
+        return True, encoded
+
+    def unpack(self, packed):
+        """Return the message of a pair returned by pack()"""
+        compressed, encoded = packed
+        if not compressed:
+            return cPickle.loads(encoded)
+        start = time.time()
+        message = self.__codec.decode(encoded)
+        self.__statistics['decode_seconds'] += time.time() - start
+        return message
+
+    def get_statistics(self):
+        """Return the bytes of the compressed messages before and after, and the seconds spent encoding and decoding"""
+        return dict(self.__statistics)
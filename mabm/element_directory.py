@@ -15,6 +15,20 @@ class ElementDirectory:
         """
         self.__dict[element.get_element_id().serialize()] = element
 
+    def add_elements(self, elements):
+        """Add a list of elements to the directory,
+        using the serialized elements as the keys
+        """
+        self.__dict.update((element.get_element_id().serialize(), element) for element in elements)
+
+    def remove_element(self, eid):
+        """Remove an element from the directory,
+        using the serialized element_id or a string
+        """
+        if isinstance(eid, mabm.ElementID):
+            eid = eid.serialize()
+        del self.__dict[eid]
+
     def get_element(self, eid):
         """Return an element from the dictionary,
         using the serialized element_id or a string
@@ -36,6 +36,18 @@ class ElementIDGenerator:
         else:
             print 'Error in ElementIDGenerator.get_element_id, type',type,'not in __type_dictionary.'
 
+    def get_new_element_ids(self, type, n):
+        """Get the element_ids for n new elements, numbered from one reserved contiguous range"""
+        if type in self.__type_number:
+            first = self.__type_number[type]
+            self.__type_number[type] += n
+            type_number = self.__type_dict[type]
+            process = self.__process
+            return [mabm.ElementID(type_number, number, process) for number in xrange(first, first + n)]
+
+        else:
+            print 'Error in ElementIDGenerator.get_element_ids, type',type,'not in __type_dictionary.'
+
     def get_form_from_type(self,type):
         """Get the enum_form from the element type"""
         return self.__enum_form_dict[type]
@@ -0,0 +1,72 @@
+__author__ = 'jgentile', 'ceharvey'
+
+from mpi4py import MPI
+
+
+class Ensemble:
+    """
+    Runs many independent replications of a model in one MPI job.
+
+    The processes are split into groups of group_size consecutive ranks, each with a communicator of its
+    own, and the groups run the replications side by side: group g runs replications g, g + groups,
+    g + 2 * groups, ... one after the other, each on a model initialized with the group's communicator
+    (see mabm.Model.initialize_model()). Whatever a group loads once, such as the network, can be
+    reused by all of its replications. The results of the replications are gathered on rank 0.
+    """
+    __comm = None
+    __group_size = None
+    __group = None
+    __num_groups = None
+    __group_comm = None
+
+    def __init__(self, group_size, comm=None):
+        """Split comm, MPI.COMM_WORLD by default, into groups of group_size processes. Collective over comm."""
+        self.__comm = comm if comm is not None else MPI.COMM_WORLD
+        size = self.__comm.Get_size()
+        if group_size < 1 or size % group_size != 0:
+            raise ValueError('The ' + str(size) + ' processes can not be split into groups of ' + str(group_size) +
+                             '.')
+        rank = self.__comm.Get_rank()
+        self.__group_size = group_size
+        self.__group = rank // group_size
+        self.__num_groups = size // group_size
+        self.__group_comm = self.__comm.Split(self.__group, rank)
+
+    def get_group(self):
+        """Return the number of this process's group"""
+        return self.__group
+
+    def get_num_groups(self):
+        """Return the number of groups"""
+        return self.__num_groups
+
+    def get_group_comm(self):
+        """Return the communicator of this process's group"""
+        return self.__group_comm
+
+    def get_replications(self, replications):
+        """Return the indices of a list of replications run by this process's group"""
+        return range(self.__group, len(replications), self.__num_groups)
+
+    def run(self, replications, run_replication):
+        """
+        Run each of a list of replications with run_replication(group_comm, replication) on the processes of
+        one group. Returns the list of the results of the replications on rank 0, in the order of the
+        replications, and None on the other processes. The result of a replication is the value
+        run_replication returns on the group's rank 0.
+        """
+        results = []
+        for index in self.get_replications(replications):
+            result = run_replication(self.__group_comm, replications[index])
+            if self.__group_comm.Get_rank() == 0:
+                results.append((index, result))
+
+        # Collect the results of all groups
+        all_results = self.__comm.gather(results, root=0)
+        if self.__comm.Get_rank() != 0:
+            return None
+        ordered = [None] * len(replications)
+        for group_results in all_results:
+            for index, result in group_results:
+                ordered[index] = result
+        return ordered
@@ -3,8 +3,15 @@ __mabm_author__mabm_ = 'jgentile', 'ceharvey'
 import mabm
 from mpi4py import MPI
 import abc
+import cPickle
+import gc
+import numpy as np
 import numpy.random as npr
 import sys
+import heapq
+
+# Default for the state passed to Model.element_state_change(), None is a valid state
+_NO_STATE = object()
 
 class Model:
     __metaclass__ = abc.ABCMeta
@@ -13,34 +20,90 @@ class Model:
     __mabm_rank = None
     __mabm_world_size = None
     __mabm_comm = None
+    __mabm_hierarchy = None
+    __mabm_compressor = None
 
     __mabm_element_requests = None
     __mabm_element_watches = None
     __mabm_watching = None
+    __mabm_subscribers = None
+    __mabm_ghost_references = None
+    __mabm_unwatches = None
+    __mabm_new_watches = None
+    __mabm_edge_changes = None
+    __mabm_replicated = None
+    __mabm_replicated_changed = None
+    __mabm_sync_every = 1
+    __mabm_sync_threshold = None
+    __mabm_window_changes = None
+    __mabm_last_sync = None
+    __mabm_request_checked = None
+    __mabm_window_statistics = None
+    __mabm_lookaheads = None
+    __mabm_conservative_statistics = None
+    __mabm_state_buffers = None
     __mabm_element_changed_and_watched = None
     __mabm_element_id_generator = None
     __mabm_element_forms = None
     __mabm_new_connections = None
+    __mabm_element_versions = None
+    __mabm_seen_versions = None
+    __mabm_request_cache = None
+    __mabm_request_cache_elements = None
+    __mabm_adaptive = None
+    __mabm_sync_bytes = None
+    __mabm_tolerances = None
+    __mabm_published = None
+    __mabm_suppressed = None
 
     __mabm_scheduler = None
+    __mabm_output_writer = None
+
+    __mabm_aggregates = None
+    __mabm_aggregates_by_type = None
+    __mabm_report_every = 1
+
+    __mabm_probes = None
+    __mabm_probe_values = None
+    __mabm_probe_file = None
 
     __mabm_time = 0
     __mabm_next_time = None
 
-    def initialize_model(self, watches):
+    def initialize_model(self, watches, adaptive=False, adapt_every=10, hierarchical=False, ranks_per_node=None,
+                         comm=None):
         """
         This method should be called during the instantiation of a concrete mabm.Model
         as it sets up the Scheduler and structures used for process communication and
         element synchronization.
+
+        If adaptive, elements start out requested and each process switches its own elements between
+        requests and watches every adapt_every time steps, whichever costs fewer bytes (see
+        mabm.AdaptiveSync). The watches argument is then ignored.
+
+        If hierarchical, the synchronization messages are combined on each node before they are exchanged
+        between nodes (see mabm.HierarchicalComm). Nodes are the processes sharing memory, or groups of
+        ranks_per_node consecutive ranks if given, to simulate nodes on one machine.
+
+        The model runs on the processes of comm, MPI.COMM_WORLD by default. Several models can run side by
+        side on sub-communicators of one MPI job, see mabm.Ensemble.
         """
 
-        # Specify the model to use watches or requests only
-        self.__watches = watches
+        # Specify the model to use watches or requests only, or to choose per element
+        self.__watches = watches and not adaptive
+        self.__mabm_adaptive = mabm.AdaptiveSync(adapt_every) if adaptive else None
+        # Bytes sent in synchronization messages, counted once instrumentation is turned on
+        self.__mabm_sync_bytes = None
 
         # Initialize MPI communicator, get rank and world size.
-        self.__mabm_comm = MPI.COMM_WORLD
+        self.__mabm_comm = comm if comm is not None else MPI.COMM_WORLD
         self.__mabm_rank = self.__mabm_comm.Get_rank()
         self.__mabm_world_size = self.__mabm_comm.Get_size()
+        # Two-level communication through node leaders, if any, and compression of the synchronization messages
+        self.__mabm_hierarchy = None
+        self.__mabm_compressor = None
+        if hierarchical or ranks_per_node:
+            self.__mabm_hierarchy = mabm.HierarchicalComm(self.__mabm_comm, ranks_per_node)
 
         # Instantiate the structures used for element synchronization
         self.__mabm_element_requests = {}
@@ -48,15 +111,68 @@ class Model:
         self.__mabm_element_watches = set()     # Mutual Watching
         # Set of elements that the processor is watching
         self.__mabm_watching = set()            # One way watching
+        # Processors watching each of the OWN elements in __mabm_element_watches, if known
+        self.__mabm_subscribers = {}
+        # Number of references to each FOREIGN element, and the elements no longer watched whose owners
+        # are told to stop sending their states during the next synchronization
+        self.__mabm_ghost_references = {}
+        self.__mabm_unwatches = set()
+        # FOREIGN elements to watch whose owners are told during the next synchronize_network_changes()
+        self.__mabm_new_watches = set()
+        # Pending edge additions and removals, by the process owning the element gaining or losing a neighbor
+        self.__mabm_edge_changes = None
+        # Elements replicated on every process, such as network hubs, and the OWN ones among them that changed
+        self.__mabm_replicated = set()
+        self.__mabm_replicated_changed = set()
+        # Synchronization window: elements are synchronized every __mabm_sync_every time steps, or once the
+        # changes published since the last synchronization reach __mabm_sync_threshold. See set_sync_window().
+        self.__mabm_sync_every = 1
+        self.__mabm_sync_threshold = None
+        self.__mabm_window_changes = 0
+        self.__mabm_last_sync = None
+        self.__mabm_request_checked = {}
+        self.__mabm_window_statistics = {'sync_rounds': 0, 'skipped_rounds': 0, 'staleness_sum': 0,
+                                         'max_staleness': 0}
+        # Minimum delay of the effects of each element type's state changes on other processes, and the
+        # messages sent by run_conservative()
+        self.__mabm_lookaheads = {}
+        self.__mabm_conservative_statistics = None
+        # Double-buffered states swapped at the end of every time step
+        self.__mabm_state_buffers = []
         self.__mabm_element_changed_and_watched = set()
         self.__mabm_element_directory = mabm.ElementDirectory()
         self.__mabm_element_forms = {}
         # List of new connections that cross processors
         self.__mabm_new_connections = []
+        # Version of each own element that changed state, and the last version received of each
+        # foreign element. Elements that never changed are at version 0.
+        self.__mabm_element_versions = {}
+        self.__mabm_seen_versions = {}
+        # Change tolerances of each element type, the last published state of elements of those types and
+        # the elements of each type whose changes were within tolerance and not published
+        self.__mabm_tolerances = {}
+        self.__mabm_published = {}
+        self.__mabm_suppressed = {}
+        # Requests of the scheduled elements, kept until an element outside of the cached set is scheduled
+        self.__mabm_request_cache = None
+        self.__mabm_request_cache_elements = None
 
         # Initialize the scheduler
         self.__mabm_scheduler = mabm.Scheduler()
 
+        # The output writer is started when first requested
+        self.__mabm_output_writer = None
+
+        # Aggregates by name, and the aggregates of each element type
+        self.__mabm_aggregates = {}
+        self.__mabm_aggregates_by_type = {}
+        self.__mabm_report_every = 1
+
+        # Registered probes, and the latest reported values of each on the root process
+        self.__mabm_probes = []
+        self.__mabm_probe_values = {}
+        self.__mabm_probe_file = None
+
     def add_element_to_directory(self, element):
         """
         Adds an element to the model's directory. This should be called each time an agent
@@ -67,6 +183,49 @@ class Model:
         """
         self.__mabm_element_directory.add_element(element)
 
+    def create_agents(self, element_class, n, schedule=True, **attribute_arrays):
+        """
+        Creates n agents of element_class on this process and returns them as a list. This is the batch
+        version of creating each agent and adding it with add_element_to_directory() and add_event().
+
+        The agents' ElementIDs are numbered from one reserved range. Each keyword argument is an array
+        (or a single value shared by all agents) of the constructor argument of that name, agent i is
+        created as element_class(eid, model=self, schedule=False, name=array[i], ...). If schedule is
+        True, all agents are scheduled for the current time in one batch. The agents still have to be
+        added to the model's containers.
+
+        Cyclic garbage collection is suspended while the agents are created, as it would otherwise
+        rescan all of the new objects many times.
+        """
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            eids = self.__mabm_element_id_generator.get_new_element_ids(element_class, n)
+
+            # Python values are faster to pass around than numpy scalars
+            columns = []
+            for name, values in attribute_arrays.iteritems():
+                if np.ndim(values) == 0:
+                    columns.append((name, [values]*n))
+                else:
+                    columns.append((name, np.asarray(values).tolist()))
+                    if len(columns[-1][1]) != n:
+                        raise ValueError('Attribute ' + name + ' has ' + str(len(values)) + ' values, expected ' +
+                                         str(n) + '.')
+
+            agents = []
+            for i in xrange(n):
+                attributes = dict((name, column[i]) for name, column in columns)
+                agents.append(element_class(eids[i], model=self, schedule=False, **attributes))
+
+            self.__mabm_element_directory.add_elements(agents)
+            if schedule:
+                self.__mabm_scheduler.add_events(self.__mabm_time, agents)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return agents
+
     def update_model(self):
         """
         This method is called before element updates are called from the scheduler. The stub
@@ -81,6 +240,13 @@ class Model:
         """
         pass
 
+    def finalize_model(self):
+        """
+        This method is called once the run is finished, to close output files and report results. It is
+        meant to be overridden if a model implementation demands this functionality.
+        """
+        pass
+
     def add_watching(self, eid):
         """
         Add an element (using the eid) to the set of elements that the processor is watching.
@@ -92,28 +258,93 @@ class Model:
         else:
             self.__mabm_watching.add(eid.serialize())
 
-    def add_watch(self, eid):
+    def add_watch(self, eid, rank=None):
         """
         Requests a watch on an element give an element_id (eid). A watched-element's status
         will be synchronized each time its state changes.
 
-        This is the list of a processor's OWN elements that are being watched.
+        This is the list of a processor's OWN elements that are being watched. If given, rank
+        is added to the processors subscribed to the element.
         """
-        if isinstance(eid, str):
-            self.__mabm_element_watches.add(eid)
-        else:
-            self.__mabm_element_watches.add(eid.serialize())
+        if not isinstance(eid, str):
+            eid = eid.serialize()
+        self.__mabm_element_watches.add(eid)
+        if rank is not None:
+            self.__mabm_subscribers.setdefault(eid, set()).add(rank)
 
-    def remove_watch(self, eid):
+    def remove_watch(self, eid, rank=None):
         """
         Removes a watch on an element.
 
-        This is only for the processor's OWN elements.
+        This is only for the processor's OWN elements. If rank is given, only that processor's
+        subscription is removed, and the watch is removed once no processor is subscribed.
         """
-        if isinstance(eid, str):
+        if not isinstance(eid, str):
+            eid = eid.serialize()
+        if rank is None:
             self.__mabm_element_watches.discard(eid)
-        else:
-            self.__mabm_element_watches.discard(eid.serialize())
+            self.__mabm_subscribers.pop(eid, None)
+            return
+
+        subscribers = self.__mabm_subscribers.get(eid)
+        if subscribers is not None:
+            subscribers.discard(rank)
+            if not subscribers:
+                del self.__mabm_subscribers[eid]
+                self.__mabm_element_watches.discard(eid)
+
+    def get_subscribers(self, eid):
+        """
+        Returns the set of processors subscribed to an OWN element's changes.
+        """
+        if not isinstance(eid, str):
+            eid = eid.serialize()
+        return set(self.__mabm_subscribers.get(eid, ()))
+
+    def add_ghost_reference(self, eid):
+        """
+        Counts a reference to a FOREIGN element, usually from an element's list of neighbors.
+        References to own elements are ignored.
+
+        Elements call this when they add a neighbor, and remove_ghost_reference() when they remove one.
+        """
+        if eid.get_process() != self.__mabm_rank:
+            serialized = eid.serialize()
+            self.__mabm_ghost_references[serialized] = self.__mabm_ghost_references.get(serialized, 0) + 1
+
+    def remove_ghost_reference(self, eid):
+        """
+        Removes a reference to a FOREIGN element counted by add_ghost_reference(). When no references
+        are left, the element's form is evicted and, if the element was watched, its owner is told to
+        stop sending its state during the next synchronization. Watching it again is up to the model,
+        see request_element_watch().
+        """
+        if eid.get_process() == self.__mabm_rank:
+            return
+        serialized = eid.serialize()
+        references = self.__mabm_ghost_references.get(serialized, 0) - 1
+        if references > 0:
+            self.__mabm_ghost_references[serialized] = references
+            return
+
+        # Evict the ghost, replicated elements are kept on every process
+        self.__mabm_ghost_references.pop(serialized, None)
+        if serialized in self.__mabm_replicated:
+            return
+        if self.__mabm_element_forms.pop(serialized, None) is not None:
+            self.__mabm_element_directory.remove_element(serialized)
+        self.__mabm_seen_versions.pop(serialized, None)
+        if serialized in self.__mabm_watching:
+            self.__mabm_watching.discard(serialized)
+            self.__mabm_new_watches.discard(serialized)
+            self.__mabm_unwatches.add(serialized)
+        self.invalidate_element_requests()
+
+    def get_num_ghosts(self):
+        """
+        Returns the number of forms of FOREIGN elements held by this processor.
+        """
+        return len(self.__mabm_element_forms)
 
     def element_is_watched(self,eid):
         """
@@ -134,17 +365,219 @@ class Model:
             else:
                 return False
 
-    def element_state_change(self, eid):
+    def element_state_change(self, eid, state=_NO_STATE):
         """
         If an element is being watched, add this element to the list of changed
         and watched elements.
 
-        This method is only called when an element has experienced a change in state.
+        This method is only called when an element has experienced a change in state. It advances the
+        element's version, so requesting processes know their copy is out of date.
+
+        If the new state is given and a change tolerance is set for the element's type, the change is only
+        published when the state differs from the last published state by more than the tolerance, see
+        set_change_tolerance().
+        """
+        serialized = eid.serialize()
+        if state is not _NO_STATE and eid.get_type() in self.__mabm_tolerances:
+            published = self.__mabm_published.get(serialized, _NO_STATE)
+            if published is not _NO_STATE and \
+                    _within_tolerance(published, state, self.__mabm_tolerances[eid.get_type()]):
+                self.__mabm_suppressed[eid.get_type()].add(serialized)
+                return
+            self.__mabm_published[serialized] = state
+            self.__mabm_suppressed[eid.get_type()].discard(serialized)
+        self.__publish_state_change(eid, serialized)
+
+    def __publish_state_change(self, eid, serialized):
         """
+        Advances an element's version and marks it to be sent if it is watched.
+        """
+        self.__mabm_element_versions[serialized] = self.__mabm_element_versions.get(serialized, 0) + 1
+        self.__mabm_window_changes += 1
+
+        # Replicated elements are sent to every process, see synchronize_replicated_elements()
+        if serialized in self.__mabm_replicated:
+            self.__mabm_replicated_changed.add(serialized)
+            return
+
+        if self.__mabm_adaptive is not None:
+            self.__mabm_adaptive.count_change(serialized)
+
         # Check if being watched
-        if self.element_is_watched(eid):
+        if self.element_is_watched(eid) or self.__mabm_adaptive is not None and \
+                self.__mabm_adaptive.is_watched(serialized):
             # Add to structure to notify element has been change
-            self.__mabm_element_changed_and_watched.add(eid.serialize())
+            self.__mabm_element_changed_and_watched.add(serialized)
+
+    def set_change_tolerance(self, element_type, absolute=0.0, relative=0.0, refresh_every=None):
+        """
+        Sets the change detection of elements of element_type. A changed state given to element_state_change()
+        is only published when it differs from the last published state of the element by more than
+        absolute + relative * |published state|. If refresh_every is set, elements with unpublished changes
+        are published every refresh_every time steps, which bounds how stale the copies of other processes
+        can be.
+        """
+        self.__mabm_tolerances[element_type] = (absolute, relative, refresh_every)
+        self.__mabm_suppressed.setdefault(element_type, set())
+
+    def refresh_suppressed_changes(self):
+        """
+        Publishes the elements with unpublished changes of the types whose refresh is due at the current
+        time step, see set_change_tolerance().
+        """
+        for element_type, (absolute, relative, refresh_every) in self.__mabm_tolerances.iteritems():
+            if not refresh_every or self.__mabm_time % refresh_every != 0:
+                continue
+            for serialized in self.__mabm_suppressed[element_type]:
+                element = self.__mabm_element_directory.get_element(serialized)
+                self.__mabm_published[serialized] = element.serialize()
+                self.__publish_state_change(element.get_element_id(), serialized)
+            self.__mabm_suppressed[element_type] = set()
+
+    def get_element_version(self, eid):
+        """
+        Returns the number of state changes of an element on this process, or the version of the last
+        state received for a foreign element (-1 if none was received).
+        """
+        if not isinstance(eid, str):
+            eid = eid.serialize()
+        if int(eid.split('|')[2]) == self.__mabm_rank:
+            return self.__mabm_element_versions.get(eid, 0)
+        return self.__mabm_seen_versions.get(eid, -1)
+
+    def register_aggregate(self, element_type, name, aggregate):
+        """
+        Registers a mabm.Aggregate under a name for the elements of element_type. Elements keep the
+        aggregate up to date by calling add_to_aggregates() when they are created and
+        update_aggregates() when their state changes.
+        """
+        self.__mabm_aggregates[name] = aggregate
+        self.__mabm_aggregates_by_type.setdefault(element_type, []).append(aggregate)
+
+    def add_to_aggregates(self, eid, state):
+        """
+        Adds the state of a new element on this process to the aggregates of its type.
+        """
+        for aggregate in self.__mabm_aggregates_by_type.get(eid.get_type(), ()):
+            aggregate.add(state)
+
+    def remove_from_aggregates(self, eid, state):
+        """
+        Removes the state of an element leaving this process from the aggregates of its type.
+        """
+        for aggregate in self.__mabm_aggregates_by_type.get(eid.get_type(), ()):
+            aggregate.remove(state)
+
+    def add_states_to_aggregates(self, element_type, states):
+        """
+        Adds the states of many new elements of element_type on this process to the aggregates of the type.
+        States that are None or nan are not counted.
+        """
+        for aggregate in self.__mabm_aggregates_by_type.get(element_type, ()):
+            aggregate.add_all(states)
+
+    def update_aggregates(self, eid, old_state, new_state):
+        """
+        Applies the change of an element's state to the aggregates of its type. This costs O(1) per
+        aggregate, so the aggregates never need a scan over all elements.
+        """
+        if old_state == new_state:
+            return
+        for aggregate in self.__mabm_aggregates_by_type.get(eid.get_type(), ()):
+            aggregate.change(old_state, new_state)
+
+    def set_report_interval(self, every):
+        """
+        Sets the number of time steps between reports, see is_report_due().
+        """
+        self.__mabm_report_every = every
+
+    def is_report_due(self):
+        """
+        Returns True if global statistics are reported at the current time step.
+        """
+        return self.__mabm_time % self.__mabm_report_every == 0
+
+    def reduce_aggregates(self, root=0):
+        """
+        Reduces all registered aggregates across processes in a single message. Returns a dictionary
+        of the global value of each aggregate on the root process and None on the others. Collective,
+        so every process must call it at the same time steps.
+        """
+        # Every process packs the local values in the same order
+        names = sorted(self.__mabm_aggregates)
+        local = []
+        sizes = []
+        for name in names:
+            values = self.__mabm_aggregates[name].get_local()
+            local += values
+            sizes.append(len(values))
+
+        reduced = self.__mabm_comm.reduce(np.array(local, dtype=float), op=MPI.SUM, root=root)
+        if self.__mabm_rank != root:
+            return None
+
+        values = {}
+        start = 0
+        for name, size in zip(names, sizes):
+            values[name] = self.__mabm_aggregates[name].get_value(reduced[start:start+size])
+            start += size
+        return values
+
+    def add_probe(self, probe):
+        """
+        Registers a mabm.Probe. The due probes are evaluated after post_update_model() at each time step.
+        """
+        self.__mabm_probes.append(probe)
+
+    def set_probe_file(self, path):
+        """
+        Streams the values of the probes to a CSV time series at path, one 'time, probe, values' row per
+        evaluated probe. The root process writes the file on the output writer thread.
+        """
+        if self.__mabm_rank == 0:
+            self.__mabm_probe_file = open(path, 'w')
+            self.get_output_writer().write(self.__mabm_probe_file, 'Time, Probe, Values\n')
+
+    def run_probes(self, final=False):
+        """
+        Evaluates the probes due at the current time step, or the probes evaluated at the end of the run
+        if final. The local values of all due probes are summed to the root process in one reduction.
+        Collective, every process must register the same probes.
+        """
+        due = [probe for probe in self.__mabm_probes if probe.is_due(self.__mabm_time, final)]
+        if not due:
+            return
+
+        local = [probe.evaluate(self) for probe in due]
+        reduced = self.__mabm_comm.reduce(np.concatenate(local), op=MPI.SUM, root=0)
+        if self.__mabm_rank != 0:
+            return
+
+        rows = []
+        start = 0
+        for probe, values in zip(due, local):
+            value = probe.finish(reduced[start:start+len(values)])
+            start += len(values)
+            self.__mabm_probe_values[probe.get_name()] = value
+            rows.append(str(self.__mabm_time) + ',' + probe.get_name() + ''.join(',' + str(v) for v in value) + '\n')
+        if self.__mabm_probe_file is not None:
+            self.get_output_writer().write(self.__mabm_probe_file, ''.join(rows))
+
+    def finalize_probes(self):
+        """
+        Evaluates the probes reported at the end of the run and closes the probe file.
+        """
+        self.run_probes(True)
+        if self.__mabm_probe_file is not None:
+            self.get_output_writer().call(self.__mabm_probe_file.close)
+            self.__mabm_probe_file = None
+
+    def get_probe_value(self, name):
+        """
+        Returns the latest reported values of a probe. Only available on the root process.
+        """
+        return self.__mabm_probe_values.get(name)
 
     def request_element(self, eid):
         """
@@ -154,10 +587,44 @@ class Model:
         # Check if the element is on the current processor
         if not eid.get_process() == self.__mabm_rank:
             serialized = eid.serialize()
-            # If the element is not in the list of element requests, then add the element.
-            if not serialized in self.__mabm_element_requests:
+            # If the element is not in the list of element requests or replicated, then add the element.
+            if not serialized in self.__mabm_element_requests and not serialized in self.__mabm_replicated:
                 self.__mabm_element_requests[serialized] = 0
 
+    def collect_element_requests(self):
+        """
+        Collects the element requests of the elements scheduled at the current time.
+
+        The requests are cached: as long as every scheduled element was scheduled when the cache was
+        built, the cached requests are reused instead of calling each element's get_element_requests().
+        The cache is rebuilt once fewer than half of the elements it was built from are scheduled, so the
+        requests of elements that left the schedule are not sent for long. Call invalidate_element_requests()
+        when the elements' neighbors change.
+        """
+        scheduled = self.__mabm_scheduler.get_events(self.__mabm_time)
+        cached = self.__mabm_request_cache_elements
+        if cached is None or 2 * len(scheduled) < len(cached) or not all(element in cached for element in scheduled):
+            # Rebuild the cache from the scheduled elements' own requests
+            pending = self.__mabm_element_requests
+            self.__mabm_element_requests = {}
+            for element in scheduled:
+                element.get_element_requests()
+            self.__mabm_request_cache = list(self.__mabm_element_requests)
+            self.__mabm_request_cache_elements = set(scheduled)
+            self.__mabm_element_requests = pending
+
+        for eid in self.__mabm_request_cache:
+            if not eid in self.__mabm_element_requests:
+                self.__mabm_element_requests[eid] = 0
+
+    def invalidate_element_requests(self):
+        """
+        Discards the cached element requests, see collect_element_requests(). Models call this when the
+        neighbors of their elements change.
+        """
+        self.__mabm_request_cache = None
+        self.__mabm_request_cache_elements = None
+
     def add_foreign_network_connection(self, original_eid, connection_eid):
         """
         Add a network connection between elements on foreign procssors.
@@ -174,50 +641,213 @@ class Model:
 
         This method synchronizes the networks between the different processors.  When there is
         a connection between agents on separate processors, the add_foreign_network_connection() method
-        is called to add the connection to the list.  This method synchronized those lists and has each
-        of the processors add the requested connections.
+        is called to add the connection to the list.  The connections are added as edges, see
+        synchronize_network_changes().
         """
+        for connection in self.__mabm_new_connections:
+            # connection[0] is the element doing the watching
+            self.add_edge(connection[0], connection[1])
+        self.__mabm_new_connections = []
+        self.synchronize_network_changes()
 
-        all_connections = None
-
-        # Root node populates a list of all connections and fills it with own connections
-        if self.__mabm_rank == 0:
-            all_connections = list(self.__mabm_new_connections)
+    def add_edge(self, source, target):
+        """
+        Adds target to the neighbors of the element source, both given as ElementIDs or serialized.
+        The source may be on any processor. The edge is added by the source's owner during the next
+        synchronize_network_changes(), by calling the source's add_neighbor(target).
+        """
+        self.__queue_edge_change(True, source, target)
 
-            # Receive information from all other processors
-            for i in range(1, self.__mabm_world_size):
-                connections = self.__mabm_comm.recv(source=i, tag=1)
-                # Append connection from other processors to the all_connections list
-                all_connections += connections
-        else:
-            self.__mabm_comm.send(self.__mabm_new_connections, dest=0, tag=1)
+    def remove_edge(self, source, target):
+        """
+        Removes target from the neighbors of the element source, see add_edge(). The edge is removed
+        by calling the source's remove_neighbor(target).
+        """
+        self.__queue_edge_change(False, source, target)
+
+    def __queue_edge_change(self, add, source, target):
+        """Queues an edge change for the process owning the source"""
+        if isinstance(source, mabm.ElementID):
+            source = source.serialize()
+        if isinstance(target, mabm.ElementID):
+            target = target.serialize()
+        if self.__mabm_edge_changes is None:
+            self.__mabm_edge_changes = [[] for i in range(self.__mabm_world_size)]
+        self.__mabm_edge_changes[int(source.split('|')[2])].append((add, source, target))
+
+    def synchronize_network_changes(self):
+        """
+        Applies the edges added and removed since the last call, see add_edge() and remove_edge(). Collective,
+        the cost is proportional to the number of edges changed.
+
+        Edge changes are sent directly to the owners of their sources, which update the sources' neighbors.
+        Neighbors count their references to foreign elements, so the copies of elements no longer referenced
+        are evicted (see remove_ghost_reference()). With watches, the owners of the foreign neighbors gained
+        and lost are then told directly which processors subscribe to them, and the newly watched elements'
+        states are sent during the next synchronization. With hierarchical communication the messages are
+        routed through the node leaders.
+        """
+        size = self.__mabm_world_size
+
+        # Send the edge changes to the owners of their sources
+        changes = self.__mabm_edge_changes or [[] for i in range(size)]
+        self.__mabm_edge_changes = None
+        received = self.__alltoall(changes)
+
+        for edges in received:
+            for add, source, target in edges:
+                element = self.__mabm_element_directory.get_element(source)
+                eid = mabm.ElementID(target)
+                if add:
+                    element.add_neighbor(eid)
+                    # Watch foreign neighbors that are not watched yet
+                    if self.__watches and eid.get_process() != self.__mabm_rank and \
+                            target not in self.__mabm_watching and target not in self.__mabm_replicated:
+                        self.__mabm_watching.add(target)
+                        self.__mabm_unwatches.discard(target)
+                        self.__mabm_new_watches.add(target)
+                else:
+                    element.remove_neighbor(eid)
+            if edges:
+                self.invalidate_element_requests()
+
+        # Send the subscriptions and unsubscriptions to the owners of the watched elements
+        subscriptions = [[] for i in range(size)]
+        for eid in self.__mabm_new_watches:
+            subscriptions[int(eid.split('|')[2])].append((eid, True))
+        for eid in self.__mabm_unwatches:
+            subscriptions[int(eid.split('|')[2])].append((eid, False))
+        self.__mabm_new_watches = set()
+        self.__mabm_unwatches = set()
+        received = self.__alltoall(subscriptions)
+
+        for rank in range(size):
+            for eid, watch in received[rank]:
+                if watch:
+                    # The new subscriber needs the element's state
+                    self.add_watch(eid, rank)
+                    self.__mabm_element_changed_and_watched.add(eid)
+                else:
+                    self.remove_watch(eid, rank)
 
-        # Broadcast the list of all_connections to all processors
-        all_connections = self.__mabm_comm.bcast(all_connections, root=0)
+    def add_network_watches(self, element_type, network):
+        """
+        Registers the watches described by a mabm.DistributedNetwork. Elements of element_type are
+        numbered as in the network, node n is element number n % nodes_per_rank on process
+        n / nodes_per_rank.
+
+        The network already holds both sides of every watch, so this replaces the root-centralized
+        request_element_watch() exchange for the initial network. The watched elements are marked as
+        changed so their states are sent during the first synchronization. Replicated elements are not
+        watched, call add_network_hubs() first.
+        """
+        nodes_per_rank = network.get_nodes_per_rank()
+        replicated = self.__mabm_replicated
+
+        # Foreign elements this processor is watching, replicated elements are not watched
+        for node in network.get_ghosts():
+            eid = mabm.ElementID(element_type, int(node % nodes_per_rank), int(node // nodes_per_rank))
+            if eid.serialize() not in replicated:
+                self.add_watching(eid)
+
+        # Own elements watched by other processors
+        for rank in network.get_watchers():
+            for node in network.get_watchers()[rank]:
+                serialized = mabm.ElementID(element_type, int(node % nodes_per_rank), self.__mabm_rank).serialize()
+                if serialized in replicated:
+                    continue
+                self.add_watch(serialized, rank)
+                self.__mabm_element_changed_and_watched.add(serialized)
+
+    def add_network_hubs(self, element_type, network, threshold):
+        """
+        Replicates the elements of element_type that are nodes with at least threshold neighbors in a
+        mabm.DistributedNetwork, see replicate_elements(). Collective, call it before add_network_watches().
+        """
+        nodes_per_rank = network.get_nodes_per_rank()
+        hubs = network.find_hubs(self.__mabm_comm, threshold)
+        self.replicate_elements([mabm.ElementID(element_type, int(node % nodes_per_rank), int(node // nodes_per_rank))
+                                 for node in hubs.tolist()])
+        return len(hubs)
 
-        # Cycle through all of the connections to pull out element
-        for connection in all_connections:
-            # Check if the connection processor is the current processor
-            # connection[0] is the element doing the watching
-            if int(str(connection[0]).split('|')[2]) == self.__mabm_rank:
-                # Get the element from the directory
-                element = self.__mabm_element_directory.get_element(str(connection[0]))
+    def replicate_elements(self, eids):
+        """
+        Replicates elements on every process, must be called with the same elements on every process.
+
+        A few hub elements of skewed networks are neighbors of elements on nearly every process. Instead of
+        being watched or requested by each of them, a read-only copy of every replicated element is kept on
+        every process. The states of changed replicated elements are exchanged with one allgather per time
+        step, see synchronize_replicated_elements(), which MPI distributes along a tree. Own replicated
+        elements are marked as changed so every process receives their states during the first
+        synchronization.
+        """
+        for eid in eids:
+            if isinstance(eid, mabm.ElementID):
+                eid = eid.serialize()
+            self.__mabm_replicated.add(eid)
+            if int(eid.split('|')[2]) == self.__mabm_rank:
+                self.__mabm_replicated_changed.add(eid)
+                # Stop watching it, every process holds a copy
+                self.remove_watch(eid)
+            else:
+                self.__mabm_watching.discard(eid)
+        self.invalidate_element_requests()
 
-                # Add neighbor to the agent's network
-                element.add_to_network(connection[1])
+    def is_replicated(self, eid):
+        """
+        Returns True if an element is replicated on every process, see replicate_elements().
+        """
+        if isinstance(eid, mabm.ElementID):
+            eid = eid.serialize()
+        return eid in self.__mabm_replicated
 
-                # Request that the connection node be added to the watched list.
-                self.request_element_watch(connection[1])
+    def synchronize_replicated_elements(self):
+        """
+        Sends the states of the own replicated elements that changed to every process, and updates or creates
+        the copies of the other processes' replicated elements. Collective, does nothing if no elements are
+        replicated.
+        """
+        if not self.__mabm_replicated:
+            return
+
+        versions = self.__mabm_element_versions
+        changed = dict((eid, (versions.get(eid, 0), self.__mabm_element_directory.get_element(eid).serialize()))
+                       for eid in self.__mabm_replicated_changed)
+        self.__mabm_replicated_changed = set()
+        if self.__mabm_sync_bytes is not None:
+            self.__mabm_sync_bytes['replica_bytes'] += len(cPickle.dumps(changed, cPickle.HIGHEST_PROTOCOL))
+
+        for rank, states in enumerate(self.__mabm_comm.allgather(changed)):
+            if rank == self.__mabm_rank:
+                continue
+            for eid in states:
+                version, state = states[eid]
+                self.__receive_element_state(eid, version, state)
+
+    def __receive_element_state(self, eid, version, state):
+        """Updates the copy of a FOREIGN element with a state received, creating the copy if needed"""
+        self.__mabm_seen_versions[eid] = version
+        if self.__mabm_element_directory.has_id(eid):
+            self.__mabm_element_directory.get_element(eid).update(state)
+        else:
+            e = mabm.ElementID(eid)
+            form = self.__mabm_element_id_generator.get_form_from_type(e.get_type())(e, state)
+            self.__mabm_element_directory.add_element(form)
+            self.__mabm_element_forms[eid] = form
 
     def request_element_watch(self, eid):
         """
         This requests an element watch given an Element ID. If an element is watched, its state is synchronized across
         processes. Note that the element update function should contain the model.element_state_change(eid) method.
         """
-        if isinstance(eid, str):
-            self.__mabm_element_requests[eid] = 1
         if isinstance(eid, mabm.ElementID):
-            self.__mabm_element_requests[eid.serialize()] = 1
+            eid = eid.serialize()
+        if eid in self.__mabm_replicated:
+            return
+        self.__mabm_element_requests[eid] = 1
+        # The states sent once the watch is registered are for this processor
+        if int(eid.split('|')[2]) != self.__mabm_rank:
+            self.__mabm_watching.add(eid)
 
     def resolve_element_request(self):
         """
@@ -229,35 +859,83 @@ class Model:
         (requested_element_information).
 
         Finally, processes receive information for their requested elements and generate or update element forms.
+
+        Requests carry the version of the requested element's state last received, and elements are only sent
+        if their version has advanced since, see element_state_change().
+
+        Requests carry the processors asking to watch the element, so its owner knows its subscribers, and
+        the elements this processor stopped watching are sent along with them, see remove_ghost_reference().
+
+        States are sent as (version, state, switch). In adaptive mode switch is True when the receivers should
+        watch the element from now on and False when they should request it again, otherwise it is None.
+
+        With hierarchical communication (see initialize_model()) the requests and states are merged on each node
+        and exchanged between the node leaders instead of gathered by the root process. Large messages are
+        compressed if set_compression() was called.
         """
 
         all_requests = None
-
-        # Root node populates list of all requests, fill it with own requests
-        if self.__mabm_rank == 0:
-            all_requests = self.__mabm_element_requests.copy()
-            # Receive information from all other processors
-            for i in range(1, self.__mabm_world_size):
-                request = self.__mabm_comm.recv(source=i, tag=1)
-                for eid in request:
-                    if not eid in all_requests:
-                        all_requests[eid] = 0
-                    if request[eid] == 1:  # if this is a watch
-                        all_requests[eid] = 1
+        adaptive = self.__mabm_adaptive
+
+        # Each request is (processors asking to watch, version of the last state received, number of requesting
+        # processes). In adaptive mode, elements that are watched are not requested.
+        seen = self.__mabm_seen_versions
+        rank = (self.__mabm_rank,)
+        requests = dict((eid, (rank if watch == 1 else (), seen.get(eid, -1), 1))
+                        for eid, watch in self.__mabm_element_requests.iteritems()
+                        if adaptive is None or watch == 1 or eid not in self.__mabm_watching)
+        unwatches = self.__mabm_unwatches
+        self.__mabm_unwatches = set()
+        if self.__mabm_sync_bytes is not None:
+            self.__mabm_sync_bytes['request_bytes'] += len(cPickle.dumps((requests, unwatches),
+                                                                         cPickle.HIGHEST_PROTOCOL))
+
+        if self.__mabm_hierarchy is not None:
+            # The requests of a node are merged by its leader, so an element requested by several processors of
+            # the node is requested once between nodes
+            all_requests = self.__mabm_hierarchy.reduce((requests, [(eid, self.__mabm_rank) for eid in unwatches]),
+                                                        _merge_requests)
+            all_requests = self.__mabm_hierarchy.bcast(self.__pack(all_requests) if self.__mabm_rank == 0 else None)
         else:
-            self.__mabm_comm.send(self.__mabm_element_requests, dest=0, tag=1)
+            # Root node populates list of all requests, fill it with own requests
+            if self.__mabm_rank == 0:
+                all_requests = (requests, [(eid, 0) for eid in unwatches])
+                # Receive information from all other processors
+                for i in range(1, self.__mabm_world_size):
+                    request, unwatched = self.__unpack(self.__mabm_comm.recv(source=i, tag=1))
+                    _merge_requests(all_requests, (request, [(eid, i) for eid in unwatched]))
+                all_requests = self.__pack(all_requests)
+            else:
+                self.__mabm_comm.send(self.__pack((requests, unwatches)), dest=0, tag=1)
+
+            all_requests = self.__mabm_comm.bcast(all_requests, root=0)
+        all_requests, all_unwatches = self.__unpack(all_requests)
 
-        all_requests = self.__mabm_comm.bcast(all_requests, root=0)
+        # Processors that stopped watching an own element are no longer subscribed to it
+        for eid, watcher in all_unwatches:
+            if int(eid.split('|')[2]) == self.__mabm_rank:
+                self.remove_watch(eid, watcher)
 
         my_requests = {}
+        versions = self.__mabm_element_versions
 
         for eid in all_requests:
             if int(eid.split('|')[2]) == self.__mabm_rank:
-                element = self.__mabm_element_directory.get_element(eid)
-                # If the element is on this process, serialize it
-                my_requests[eid] = element.serialize()
-                if all_requests[eid] == 1:
-                    self.add_watch(eid)
+                watchers, version, requesters = all_requests[eid]
+                if adaptive is not None and adaptive.is_watched(eid):
+                    # The requester missed the switch to watching, tell it again
+                    element = self.__mabm_element_directory.get_element(eid)
+                    my_requests[eid] = (versions.get(eid, 0), element.serialize(), True)
+                # If the element is on this process and changed since the version requested, serialize it
+                elif versions.get(eid, 0) > version:
+                    element = self.__mabm_element_directory.get_element(eid)
+                    my_requests[eid] = (versions.get(eid, 0), element.serialize(), None)
+                    if adaptive is not None:
+                        adaptive.count_reply(eid)
+                if adaptive is not None:
+                    adaptive.count_request(eid, requesters)
+                for watcher in watchers:
+                    self.add_watch(eid, watcher)
                 #if all_requests[eid] == 2:
                 #    self.add_mutual_watch(eid)
 
@@ -267,37 +945,69 @@ class Model:
         # Adds in the changed and watched elements
         for eid in self.__mabm_element_changed_and_watched:
             element = self.__mabm_element_directory.get_element(eid)
-            my_requests[eid] = element.serialize()
+            my_requests[eid] = (versions.get(eid, 0), element.serialize(),
+                                True if adaptive is not None and adaptive.is_watched(eid) else None)
+
+        # Switch elements between requests and watches, the receivers learn of it from the states sent
+        if adaptive is not None and adaptive.step():
+            to_watch, to_request = adaptive.decide()
+            for eid in to_watch:
+                my_requests[eid] = (versions.get(eid, 0), self.__mabm_element_directory.get_element(eid).serialize(),
+                                    True)
+            for eid in to_request:
+                my_requests[eid] = (versions.get(eid, 0), self.__mabm_element_directory.get_element(eid).serialize(),
+                                    False)
+
+        if self.__mabm_sync_bytes is not None:
+            self.__mabm_sync_bytes['state_bytes'] += len(cPickle.dumps(my_requests, cPickle.HIGHEST_PROTOCOL))
 
         requested_element_information = {}
 
-        # Root node makes a master list
-        if self.__mabm_rank == 0:
-            requested_element_information = my_requests.copy()
-            for i in range(1, self.__mabm_world_size):
-                element_info = self.__mabm_comm.recv(source=i, tag=2)
-                for eid in element_info:
-                    requested_element_information[eid] = element_info[eid]
+        if self.__mabm_hierarchy is not None:
+            # The states are broadcast once to each node leader, which shares them with its node
+            requested_element_information = self.__mabm_hierarchy.reduce(my_requests.copy(), _merge_states)
+            requested_element_information = self.__mabm_hierarchy.bcast(
+                self.__pack(requested_element_information) if self.__mabm_rank == 0 else None)
         else:
-            self.__mabm_comm.send(my_requests, dest=0, tag=2)
+            # Root node makes a master list
+            if self.__mabm_rank == 0:
+                requested_element_information = my_requests.copy()
+                for i in range(1, self.__mabm_world_size):
+                    element_info = self.__unpack(self.__mabm_comm.recv(source=i, tag=2))
+                    for eid in element_info:
+                        requested_element_information[eid] = element_info[eid]
+                requested_element_information = self.__pack(requested_element_information)
+            else:
+                self.__mabm_comm.send(self.__pack(my_requests), dest=0, tag=2)
 
-        # Broadcast master list of requested agent states
-        requested_element_information = self.__mabm_comm.bcast(requested_element_information, root=0)
+            # Broadcast master list of requested agent states
+            requested_element_information = self.__mabm_comm.bcast(requested_element_information, root=0)
+        requested_element_information = self.__unpack(requested_element_information)
 
         # Resolve element requests by getting the state of the element if in the list or
         # add the element and it's state to the list if not already available.
         for element in requested_element_information:
             requested_id = str(element)
 
+            version, state, switch = requested_element_information[element]
+
+            # Adaptive switches apply to every processor holding or requesting a copy of the element
+            if switch is not None and (requested_id in self.__mabm_element_forms or
+                                       element in self.__mabm_element_requests):
+                if switch:
+                    self.__mabm_watching.add(requested_id)
+                else:
+                    self.__mabm_watching.discard(requested_id)
+
             if requested_id in self.__mabm_watching or element in self.__mabm_element_requests:
                 e = mabm.ElementID(requested_id)
-                state = requested_element_information[element]
+                seen[requested_id] = version
                 if self.__mabm_element_directory.has_id(requested_id):
                     self.__mabm_element_directory.get_element(requested_id).update(state)
                 # Create a new, local copy of the element
                 else:
                     form_constructor = self.__mabm_element_id_generator.get_form_from_type(e.get_type())
-                    form = form_constructor(e, requested_element_information[requested_id])
+                    form = form_constructor(e, state)
                     #form.set_element_id(e)
                     #form.update(requested_element_information[requested_id])
                     self.__mabm_element_directory.add_element(form)
@@ -306,6 +1016,291 @@ class Model:
         self.__mabm_element_requests = {}
         self.__mabm_element_changed_and_watched = set()
 
+    def set_sync_instrumentation(self, enabled=True):
+        """
+        Turns on counting the bytes of the synchronization messages this process sends, see
+        get_sync_statistics(). Counting pickles the messages a second time.
+        """
+        if enabled and self.__mabm_sync_bytes is None:
+            self.__mabm_sync_bytes = {'request_bytes': 0, 'state_bytes': 0, 'replica_bytes': 0}
+        elif not enabled:
+            self.__mabm_sync_bytes = None
+
+    def get_sync_statistics(self):
+        """
+        Returns this process's synchronization statistics: the bytes of request and state messages sent if
+        instrumentation is on, and in adaptive mode the number of switches, the number of watched elements
+        and the estimated bytes saved by watching them. With compression, the bytes of the compressed messages
+        before and after compression and the seconds spent encoding and decoding them.
+        """
+        statistics = {}
+        if self.__mabm_sync_bytes is not None:
+            statistics.update(self.__mabm_sync_bytes)
+        if self.__mabm_adaptive is not None:
+            statistics.update(self.__mabm_adaptive.get_statistics())
+        if self.__mabm_conservative_statistics is not None:
+            statistics.update(self.__mabm_conservative_statistics)
+        if self.__mabm_compressor is not None:
+            statistics.update(self.__mabm_compressor.get_statistics())
+        return statistics
+
+    def reduce_sync_statistics(self, root=0):
+        """
+        Returns the synchronization statistics summed over all processes on the root process, and None
+        on the others. Collective.
+        """
+        all_statistics = self.__mabm_comm.gather(self.get_sync_statistics(), root=root)
+        if self.__mabm_rank != root:
+            return None
+        total = {}
+        for statistics in all_statistics:
+            for key in statistics:
+                total[key] = total.get(key, 0) + statistics[key]
+        return total
+
+    def set_compression(self, codec='zlib', threshold=4096):
+        """
+        Compresses the request and state messages of resolve_element_request() of at least threshold bytes
+        pickled, with a codec of mabm.Compressor: 'zlib', 'varint', 'delta' or 'delta-zlib', or one added
+        with mabm.register_codec(). A codec of None turns compression off. All processes must use the same
+        codec. The compression ratio and time are reported in get_sync_statistics().
+        """
+        self.__mabm_compressor = mabm.Compressor(codec, threshold) if codec is not None else None
+
+    def __pack(self, message):
+        """
+        Returns a synchronization message to send in place of the message, compressed if large enough
+        """
+        if self.__mabm_compressor is None:
+            return message
+        return self.__mabm_compressor.pack(message)
+
+    def __unpack(self, message):
+        """
+        Returns the synchronization message of one returned by __pack()
+        """
+        if self.__mabm_compressor is None:
+            return message
+        return self.__mabm_compressor.unpack(message)
+
+    def set_sync_window(self, every=1, threshold=None):
+        """
+        Synchronizes the copies of foreign elements only every `every` time steps, or earlier once the
+        number of state changes published on all processes since the last synchronization reaches threshold.
+        In between, each process advances its own elements one time step at a time using the copies of
+        the last synchronization, which are at most as stale as get_staleness() reports. Own elements are
+        always current, so elements with only local neighbors are not affected.
+
+        This is meant for models with integer time steps where the influence of neighbors is averaged and
+        slightly stale states are acceptable. It replaces the collectives of every time step but one in a
+        window (one allreduce per step if threshold is set) at the cost of exactness. The next time step is
+        only agreed on at synchronizations, so a run may continue up to every - 1 empty time steps.
+        """
+        self.__mabm_sync_every = max(int(every), 1)
+        self.__mabm_sync_threshold = threshold
+
+    def is_sync_due(self):
+        """
+        Returns True if the copies of foreign elements are synchronized at the current time step, see
+        set_sync_window(). Collective if a change threshold is set.
+        """
+        if self.__mabm_sync_every == 1 and self.__mabm_sync_threshold is None:
+            return True
+        if self.__mabm_last_sync is None or self.__mabm_time - self.__mabm_last_sync >= self.__mabm_sync_every:
+            return True
+        if self.__mabm_sync_threshold is not None:
+            changes = self.__mabm_comm.allreduce(self.__mabm_window_changes, op=MPI.SUM)
+            return changes >= self.__mabm_sync_threshold
+        return False
+
+    def get_staleness(self, eid=None):
+        """
+        Returns the number of time steps since the copy of a foreign element was last brought up to date,
+        or since the last synchronization if eid is not given. Watched and replicated elements are brought
+        up to date at every synchronization, requested elements when they were last requested. Returns 0
+        for own elements and None for elements never requested.
+        """
+        if self.__mabm_last_sync is None:
+            return None
+        if eid is None:
+            return self.__mabm_time - self.__mabm_last_sync
+        if not isinstance(eid, str):
+            eid = eid.serialize()
+        if int(eid.split('|')[2]) == self.__mabm_rank:
+            return 0
+        if eid in self.__mabm_watching or eid in self.__mabm_replicated:
+            return self.__mabm_time - self.__mabm_last_sync
+        if self.__mabm_sync_every == 1 and self.__mabm_sync_threshold is None:
+            # Requests are only recorded with a synchronization window
+            return None
+        checked = self.__mabm_request_checked.get(eid)
+        return None if checked is None else self.__mabm_time - checked
+
+    def get_window_statistics(self):
+        """
+        Returns the number of time steps with and without synchronization, and the mean and maximum number of
+        time steps since the last synchronization over all time steps. The same on every process.
+        """
+        statistics = self.__mabm_window_statistics
+        rounds = statistics['sync_rounds'] + statistics['skipped_rounds']
+        return {'sync_rounds': statistics['sync_rounds'], 'skipped_rounds': statistics['skipped_rounds'],
+                'mean_staleness': statistics['staleness_sum'] / float(rounds) if rounds else 0.0,
+                'max_staleness': statistics['max_staleness']}
+
+    def add_state_buffer(self, buffer):
+        """
+        Registers a mabm.StateBuffer, swapped at the end of every time step once all elements scheduled
+        at the time step are updated. Elements that read the previous states and write the next ones from
+        the buffer can be updated in any order with the same results, and local neighbors are seen as
+        of the previous time step like the copies of foreign neighbors.
+        """
+        self.__mabm_state_buffers.append(buffer)
+
+    def swap_state_buffers(self):
+        """
+        Makes the states written to the registered state buffers during the time step current.
+        """
+        for buffer in self.__mabm_state_buffers:
+            buffer.swap()
+
+    def set_lookahead(self, element_type, lookahead):
+        """
+        Declares that a state change of an element of element_type at time t affects the elements on other
+        processes no earlier than at time t + lookahead, see run_conservative(). The lookahead must be positive,
+        a lookahead of 1 gives the same results as the synchronous update().
+        """
+        if lookahead <= 0:
+            raise ValueError('The lookahead of element type ' + str(element_type) + ' must be positive.')
+        self.__mabm_lookaheads[element_type] = lookahead
+
+    def run_conservative(self, until=sys.maxint):
+        """
+        Runs the model up to (but not including) time until as a conservative parallel discrete-event
+        simulation, in the manner of Chandy, Misra and Bryant, instead of in global lockstep.
+
+        Each process only exchanges messages with the processes it shares watches with. After processing
+        the events of a time t, it sends the subscribers of its changed elements their new states, which
+        become visible at t + lookahead (see set_lookahead()). Every message carries a promise: no later
+        message on the channel holds states visible before the time of the next local event plus the
+        lookahead. Messages without states are the null messages. A process only processes the events of
+        a time once every channel it receives on has promised a later time, so processes with events at
+        unrelated times advance independently, without global reductions.
+
+        Requires watches. The elements' changes reach the other processes through element_state_change(),
+        and elements must not be replicated. post_update_model() and the probes are only called once at the
+        end of the run, at the last time step processed by any process, since they may be collective.
+        """
+        if not self.__watches:
+            raise ValueError('The conservative mode requires watches.')
+        if self.__mabm_replicated:
+            raise ValueError('Replicated elements are synchronized collectively, they can not be used in the '
+                             'conservative mode.')
+        if not self.__mabm_lookaheads:
+            raise ValueError('No lookahead is set, see set_lookahead().')
+
+        comm = self.__mabm_comm
+        rank = self.__mabm_rank
+        scheduler = self.__mabm_scheduler
+        infinity = float('inf')
+        lookahead = min(self.__mabm_lookaheads.itervalues())
+        statistics = self.__mabm_conservative_statistics = {'null_messages': 0, 'state_messages': 0,
+                                                             'states_sent': 0, 'blocking_receives': 0}
+
+        # Send the pending watches and the initial states collectively, once
+        self.resolve_element_request()
+
+        # Channels to the processes subscribed to own elements, and from the processes whose elements are watched
+        destinations = sorted(set(subscriber for subscribers in self.__mabm_subscribers.itervalues()
+                                  for subscriber in subscribers if subscriber != rank))
+        incoming = comm.alltoall([process in destinations for process in range(self.__mabm_world_size)])
+        clocks = dict((process, -1) for process in range(self.__mabm_world_size) if incoming[process])
+
+        # States received that are not visible yet, by the time they become visible
+        pending = []
+        sequence = 0
+        requests = []
+
+        def send(time, promise):
+            """Sends the subscribers the states changed at time and the promise"""
+            messages = dict((process, []) for process in destinations)
+            for eid in self.__mabm_element_changed_and_watched:
+                element = self.__mabm_element_directory.get_element(eid)
+                visible = time + self.__mabm_lookaheads[element.get_element_id().get_type()]
+                state = (eid, self.__mabm_element_versions.get(eid, 0), element.serialize(), visible)
+                for subscriber in self.__mabm_subscribers.get(eid, ()):
+                    if subscriber != rank:
+                        messages[subscriber].append(state)
+            self.__mabm_element_changed_and_watched = set()
+
+            for process in destinations:
+                statistics['state_messages' if messages[process] else 'null_messages'] += 1
+                statistics['states_sent'] += len(messages[process])
+                requests.append(comm.isend((promise, messages[process]), dest=process, tag=4))
+
+        def next_promise():
+            """Returns the earliest time the next local event could make a change visible"""
+            following = scheduler.get_next_event_time()
+            return following + lookahead if following < until and following != sys.maxint else infinity
+
+        promise = next_promise()
+        send(self.__mabm_time, promise)
+        last = self.__mabm_time
+
+        while True:
+            time = scheduler.get_next_event_time()
+            if time >= until or time == sys.maxint:
+                break
+
+            # Wait until every channel has promised a time after this one
+            while clocks and time >= min(clocks.itervalues()):
+                source = min(clocks, key=clocks.get)
+                statistics['blocking_receives'] += 1
+                clocks[source], states = comm.recv(source=source, tag=4)
+                for eid, version, state, visible in states:
+                    heapq.heappush(pending, (visible, sequence, eid, version, state))
+                    sequence += 1
+
+            # Apply the states that are visible at this time
+            while pending and pending[0][0] <= time:
+                visible, number, eid, version, state = heapq.heappop(pending)
+                self.__receive_element_state(eid, version, state)
+
+            self.__mabm_time = time
+            self.refresh_suppressed_changes()
+            scheduler.update(time)
+            self.swap_state_buffers()
+            last = time
+
+            promise = next_promise()
+            send(time, promise)
+
+            # Forget the completed sends
+            if len(requests) > 1024:
+                requests = [request for request in requests if not request.test()[0]]
+
+        # Promise nothing more, then receive the remaining messages until every channel has done the same
+        if promise != infinity:
+            send(last, infinity)
+        while clocks and min(clocks.itervalues()) != infinity:
+            source = min(clocks, key=clocks.get)
+            clocks[source], states = comm.recv(source=source, tag=4)
+            for eid, version, state, visible in states:
+                heapq.heappush(pending, (visible, sequence, eid, version, state))
+                sequence += 1
+        while pending and pending[0][0] < until:
+            visible, number, eid, version, state = heapq.heappop(pending)
+            self.__receive_element_state(eid, version, state)
+        for request in requests:
+            request.wait()
+
+        # Report at the last time step processed by any process
+        self.__mabm_time = comm.allreduce(last, op=MPI.MAX)
+        self.__mabm_next_time = None
+        self.post_update_model()
+        self.finalize_probes()
+        self.finalize_model()
+        self.flush_output()
+
     def get_next_timestep(self):
         """
         Returns the next event's time.
@@ -314,6 +1309,9 @@ class Model:
         scheduled events.
         """
         next_timestep = self.__mabm_scheduler.get_next_event_time()
+        if self.__mabm_hierarchy is not None:
+            self.__mabm_next_time = self.__mabm_hierarchy.allreduce(next_timestep, min)
+            return self.__mabm_next_time
         if self.__mabm_rank == 0:
             for i in range(1, self.get_world_size()):
                 t = self.__mabm_comm.recv(source=i, tag=3)
@@ -329,21 +1327,46 @@ class Model:
         Update the model for a time step.
 
         1. Update the time to mabm_next_time
-        2. If Requests Version: Get element requests
-        3. Resolve element requests
-        4. Update the scheduler
-        5. Get the next time step
+        2. Publish changes that are due for refresh
+        3. If a synchronization is due (see set_sync_window()): get element requests in the requests
+           version, synchronize the replicated elements and resolve element requests
+        4. Update the scheduler and swap the state buffers
+        5. Get the next time step, or advance to the next integer time step between synchronizations
         6. Complete post_update_model()
+        7. Evaluate the due probes
         """
         if self.__mabm_next_time:
             self.__mabm_time = self.__mabm_next_time
 
-        if not self.__watches:
-            self.__mabm_scheduler.get_element_requests(self.__mabm_time)
-        self.resolve_element_request()
+        self.refresh_suppressed_changes()
+        synchronize = self.is_sync_due()
+        statistics = self.__mabm_window_statistics
+        if synchronize:
+            if not self.__watches:
+                self.collect_element_requests()
+                if self.__mabm_sync_every > 1 or self.__mabm_sync_threshold is not None:
+                    for eid in self.__mabm_element_requests:
+                        self.__mabm_request_checked[eid] = self.__mabm_time
+            self.synchronize_replicated_elements()
+            self.resolve_element_request()
+            self.__mabm_last_sync = self.__mabm_time
+            self.__mabm_window_changes = 0
+            statistics['sync_rounds'] += 1
+        else:
+            statistics['skipped_rounds'] += 1
+            staleness = self.__mabm_time - self.__mabm_last_sync
+            statistics['staleness_sum'] += staleness
+            statistics['max_staleness'] = max(statistics['max_staleness'], staleness)
+
         self.__mabm_scheduler.update(self.__mabm_time)
-        self.get_next_timestep()
+        self.swap_state_buffers()
+        if synchronize:
+            self.get_next_timestep()
+        else:
+            # Advance locally, the next time step is agreed on at the next synchronization
+            self.__mabm_next_time = self.__mabm_time + 1
         self.post_update_model()
+        self.run_probes()
 
     def run(self):
         """
@@ -352,6 +1375,25 @@ class Model:
         """
         while self.__mabm_time != sys.maxint:
             self.update()
+        self.finalize_probes()
+        self.finalize_model()
+        self.flush_output()
+
+    def get_output_writer(self):
+        """
+        Returns the model's mabm.OutputWriter, which writes output on a background thread so the
+        simulation can continue while output is written. It is started on first use.
+        """
+        if self.__mabm_output_writer is None:
+            self.__mabm_output_writer = mabm.OutputWriter()
+        return self.__mabm_output_writer
+
+    def flush_output(self):
+        """
+        Waits until all output queued on the output writer has been written.
+        """
+        if self.__mabm_output_writer is not None:
+            self.__mabm_output_writer.flush()
 
     def set_element_id_generator(self,dict):
         """
@@ -372,6 +1414,28 @@ class Model:
         """
         self.__mabm_scheduler.add_event(time, element)
 
+    def add_events(self, time, elements):
+        """
+        Adds an event at the same time for each element in a list, see add_event().
+        """
+        self.__mabm_scheduler.add_events(time, elements)
+
+    def set_bucket_update(self, function):
+        """
+        Updates the elements scheduled at a time step with function(time, elements) instead of each element's
+        update(), see mabm.Scheduler.set_bucket_update(). With synchronous updates (see add_state_buffer()) the
+        function can update the elements in chunks in a mabm.WorkerPool, the changes must be merged back into
+        the model before it returns.
+        """
+        self.__mabm_scheduler.set_bucket_update(function)
+
+    def set_activation_order(self, key):
+        """
+        Activates the scheduled elements of each time step in the order of key(element) rather than in
+        random order, see Scheduler.set_order(). A key of None restores random activation.
+        """
+        self.__mabm_scheduler.set_order(key)
+
     def get_time(self):
         """
         Gets the current simulation time
@@ -397,5 +1461,54 @@ class Model:
 
         return self.__mabm_world_size
 
+    def get_comm(self):
+        """
+        Returns the MPI communicator of the model's processes
+        """
+        return self.__mabm_comm
+
+    def get_hierarchical_comm(self):
+        """
+        Returns the mabm.HierarchicalComm used for synchronization, None if communication is flat
+        """
+        return self.__mabm_hierarchy
+
+    def __alltoall(self, values):
+        """
+        Sends values[i] to processor i and returns the values received from every processor, through the node
+        leaders with hierarchical communication
+        """
+        if self.__mabm_hierarchy is not None:
+            return self.__mabm_hierarchy.alltoall(values)
+        return self.__mabm_comm.alltoall(values)
+
     def get_element(self,eid):
         return self.__mabm_element_directory.get_element(eid)
+
+
+def _merge_requests(merged, other):
+    """Merge (requests, unwatches) into merged, in resolve_element_request()"""
+    requests, unwatches = merged
+    for eid, request in other[0].iteritems():
+        if not eid in requests:
+            requests[eid] = request
+        else:
+            # Keep the watchers, and send the state if any processor's version is out of date
+            watchers, version, requesters = requests[eid]
+            requests[eid] = (watchers + request[0], min(version, request[1]), requesters + request[2])
+    unwatches.extend(other[1])
+    return merged
+
+
+def _merge_states(merged, other):
+    """Merge the element states sent by a processor into merged, in resolve_element_request()"""
+    merged.update(other)
+    return merged
+
+
+def _within_tolerance(published, state, tolerance):
+    """Check if a state is within the (absolute, relative, refresh_every) tolerance of the published state"""
+    if published is None or state is None:
+        return published is state
+    absolute, relative = tolerance[0], tolerance[1]
+    return abs(state - published) <= absolute + relative * abs(published)
@@ -0,0 +1,222 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import os
+import struct
+import numpy as np
+
+# Layout of a binary network file:
+#
+#   header      64 bytes, see HEADER_FORMAT
+#   neighbors   num_edges integers of the index dtype (int32 or int64)
+#   offsets     num_nodes+1 int64 values, neighbors of node i are
+#               neighbors[offsets[i]:offsets[i+1]]
+#
+# The header stores the byte offset of both sections so readers never need to
+# scan the file. Neighbors are written before the offsets so a writer can
+# stream node adjacency lists without knowing the number of edges up front.
+MAGIC = 'MABMCSR\0'
+VERSION = 1
+HEADER_FORMAT = '<8sIIQQQQ16x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Number of offsets copied at a time when the writer assembles the file
+COPY_CHUNK = 1 << 20
+
+
+class NetworkFile:
+    """
+    Read-only, memory-mapped view of a binary network (CSR adjacency) file.
+
+    Only the pages holding the requested nodes are read from disk, so each process
+    touches only the slice of the network that belongs to its own agents.
+    """
+    __path = None
+    __num_nodes = None
+    __num_edges = None
+    __offsets = None
+    __neighbors = None
+
+    def __init__(self, path):
+        """Open a binary network file and map its offsets and neighbors"""
+        self.__path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE:
+            raise IOError('File ' + path + ' is not a MABM network file.')
+        magic, version, itemsize, num_nodes, num_edges, neighbors_at, offsets_at = \
+            struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC:
+            raise IOError('File ' + path + ' is not a MABM network file.')
+        if version != VERSION:
+            raise IOError('Unsupported network file version ' + str(version) + ' in ' + path)
+
+        self.__num_nodes = num_nodes
+        self.__num_edges = num_edges
+        self.__offsets = np.memmap(path, dtype='<i8', mode='r', offset=offsets_at, shape=(num_nodes+1,))
+        if num_edges > 0:
+            self.__neighbors = np.memmap(path, dtype=_index_dtype(itemsize), mode='r', offset=neighbors_at,
+                                         shape=(num_edges,))
+        else:
+            self.__neighbors = np.zeros(0, dtype=_index_dtype(itemsize))
+
+    @staticmethod
+    def is_network_file(path):
+        """Check if the file at path is a binary network file"""
+        try:
+            with open(path, 'rb') as f:
+                return f.read(len(MAGIC)) == MAGIC
+        except IOError:
+            return False
+
+    def get_num_nodes(self):
+        """Return the number of nodes in the network"""
+        return self.__num_nodes
+
+    def get_num_edges(self):
+        """Return the number of directed edges (adjacency entries) in the network"""
+        return self.__num_edges
+
+    def get_degree(self, node):
+        """Return the number of neighbors of a node"""
+        return int(self.__offsets[node+1] - self.__offsets[node])
+
+    def get_neighbors(self, node):
+        """Return the neighbors of a node as a read-only array view"""
+        return self.__neighbors[self.__offsets[node]:self.__offsets[node+1]]
+
+    def get_slice(self, start, stop):
+        """
+        Return the CSR structure for the nodes in [start, stop).
+
+        The returned offsets are rebased so they index the returned neighbors, which
+        are a view into the mapped file. Neighbors keep their global node numbers.
+        """
+        offsets = np.array(self.__offsets[start:stop+1], dtype=np.int64)
+        neighbors = self.__neighbors[offsets[0]:offsets[-1]]
+        offsets -= offsets[0]
+        return offsets, neighbors
+
+    def get_path(self):
+        """Return the path of the mapped file"""
+        return self.__path
+
+
+class NetworkWriter:
+    """
+    Streams node adjacency lists to a binary network file.
+
+    Nodes must be written in order. Only the current chunk is held in memory; the
+    offsets are spooled to a temporary file and appended when the writer is closed.
+    """
+    __path = None
+    __file = None
+    __offsets_file = None
+    __dtype = None
+    __num_nodes = None
+    __num_edges = None
+
+    def __init__(self, path, dtype=np.int32):
+        """Create a writer for a new network file, neighbors are stored as dtype"""
+        self.__dtype = np.dtype(dtype).newbyteorder('<')
+        if self.__dtype.itemsize not in (4, 8) or self.__dtype.kind != 'i':
+            raise ValueError('Network index dtype must be int32 or int64.')
+        self.__path = path
+        self.__file = open(path, 'wb')
+        self.__file.write('\0' * HEADER_SIZE)
+        self.__offsets_file = open(path + '.offsets', 'w+b')
+        np.zeros(1, dtype='<i8').tofile(self.__offsets_file)
+        self.__num_nodes = 0
+        self.__num_edges = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_node(self, neighbors):
+        """Write the neighbors of the next node"""
+        neighbors = np.asarray(neighbors, dtype=self.__dtype)
+        self.add_nodes([len(neighbors)], neighbors)
+
+    def add_nodes(self, degrees, neighbors):
+        """
+        Write a chunk of consecutive nodes. degrees holds the number of neighbors of each
+        node in the chunk and neighbors holds their concatenated adjacency lists.
+        """
+        degrees = np.asarray(degrees, dtype=np.int64)
+        neighbors = np.asarray(neighbors, dtype=self.__dtype)
+        if degrees.sum() != len(neighbors):
+            raise ValueError('Sum of degrees does not match the number of neighbors.')
+        neighbors.tofile(self.__file)
+        (self.__num_edges + np.cumsum(degrees)).astype('<i8').tofile(self.__offsets_file)
+        self.__num_nodes += len(degrees)
+        self.__num_edges += len(neighbors)
+
+    def get_num_nodes(self):
+        """Return the number of nodes written so far"""
+        return self.__num_nodes
+
+    def close(self):
+        """Append the offsets and the header, then close the file"""
+        if self.__file is None:
+            return
+        offsets_at = HEADER_SIZE + self.__num_edges * self.__dtype.itemsize
+        self.__offsets_file.seek(0)
+        while True:
+            data = self.__offsets_file.read(COPY_CHUNK * 8)
+            if not data:
+                break
+            self.__file.write(data)
+        self.__file.seek(0)
+        self.__file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.__dtype.itemsize,
+                                      self.__num_nodes, self.__num_edges, HEADER_SIZE, offsets_at))
+        self.__file.close()
+        self.__offsets_file.close()
+        os.remove(self.__path + '.offsets')
+        self.__file = None
+
+
+def convert_adjacency_csv(csv_path, network_path, dtype=None, chunk_nodes=100000):
+    """
+    Convert a CSV adjacency list (line i holds the comma separated neighbors of node i,
+    as written by network_generation.py) to a binary network file.
+
+    If dtype is None, int32 is used unless the number of nodes requires int64.
+    """
+    if dtype is None:
+        # Count the lines first so the narrowest index type can be chosen
+        num_nodes = 0
+        with open(csv_path, 'r') as f:
+            for line in f:
+                num_nodes += 1
+        dtype = np.int32 if num_nodes < 2**31 else np.int64
+
+    with NetworkWriter(network_path, dtype) as writer:
+        degrees = []
+        neighbors = []
+        with open(csv_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    values = np.fromstring(line, dtype=np.int64, sep=',')
+                else:
+                    values = np.zeros(0, dtype=np.int64)
+                degrees.append(len(values))
+                neighbors.append(values)
+                # Write out the nodes in chunks to bound memory use
+                if len(degrees) == chunk_nodes:
+                    writer.add_nodes(degrees, np.concatenate(neighbors))
+                    degrees = []
+                    neighbors = []
+        if degrees:
+            writer.add_nodes(degrees, np.concatenate(neighbors))
+
+
+def _index_dtype(itemsize):
+    """Return the neighbor dtype for the given item size"""
+    if itemsize == 4:
+        return np.dtype('<i4')
+    if itemsize == 8:
+        return np.dtype('<i8')
+    raise IOError('Unsupported network index size ' + str(itemsize))
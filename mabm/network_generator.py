@@ -0,0 +1,404 @@
+__author__ = 'smichel', 'ceharvey'
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import mabm
+
+# Default number of edges generated and held in memory at a time
+CHUNK_EDGES = 1 << 22
+
+# Lattice offsets (dx, dy) for each neighborhood
+VON_NEUMANN_OFFSETS = [(0, -1), (-1, 0), (1, 0), (0, 1)]
+MOORE_OFFSETS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+# Network structures understood by generate_network()
+NETWORK_TYPES = ["none", "powerlaw", "preferential", "random", "ringworld", "smallworld", "vonneumann", "moore"]
+
+
+def generate_network(structure, num_nodes, num_edges=0, prob_edges=0, nei=1, exponent=3.0, seed=None,
+                     chunk_edges=CHUNK_EDGES):
+    """
+    Return an iterator over the adjacency of a generated network. Each item is a chunk
+    (degrees, neighbors) for consecutive nodes, see NetworkWriter.add_nodes().
+
+    All networks are undirected: every edge appears in the adjacency of both of its ends.
+    Only one chunk is in memory at a time. Random structures are spooled through
+    temporary files on disk so memory use does not grow with the size of the network.
+    """
+    structure = structure.lower()
+    random_state = np.random.RandomState(seed)
+
+    if structure == "none":
+        return _no_network(num_nodes, chunk_edges)
+    if structure in ("moore", "vonneumann"):
+        if lattice_side(num_nodes) ** 2 != num_nodes:
+            raise ValueError('Lattice networks need a square number of nodes, not ' + str(num_nodes))
+        return _lattice(num_nodes, MOORE_OFFSETS if structure == "moore" else VON_NEUMANN_OFFSETS, chunk_edges)
+    if structure == "ringworld":
+        return _ring(num_nodes, 1, chunk_edges)
+    if structure == "smallworld":
+        if prob_edges > 0:
+            return _watts_strogatz(num_nodes, nei, prob_edges, random_state, chunk_edges)
+        return _ring(num_nodes, nei, chunk_edges)
+    if structure == "random":
+        return _erdos_renyi(num_nodes, num_edges, prob_edges, random_state, chunk_edges)
+    if structure == "preferential":
+        return _barabasi_albert(num_nodes, max(num_edges // num_nodes, 1), random_state, chunk_edges)
+    if structure == "powerlaw":
+        return _power_law(num_nodes, num_edges, exponent, random_state, chunk_edges)
+    raise ValueError('Unknown network structure ' + structure + ', use one of: ' + ', '.join(NETWORK_TYPES))
+
+
+def write_network_file(path, chunks, dtype=np.int32):
+    """Stream generated chunks to a binary network file, return the number of nodes written"""
+    with mabm.NetworkWriter(path, dtype) as writer:
+        for degrees, neighbors in chunks:
+            writer.add_nodes(degrees, neighbors)
+        return writer.get_num_nodes()
+
+
+def write_adjacency_csv(path, chunks):
+    """Stream generated chunks to a CSV adjacency list, return the number of nodes written"""
+    num_nodes = 0
+    with open(path, 'w') as f:
+        for degrees, neighbors in chunks:
+            offsets = np.concatenate(([0], np.cumsum(degrees)))
+            neighbors = neighbors.astype(str)
+            f.write(''.join(','.join(neighbors[offsets[i]:offsets[i+1]]) + '\n' for i in range(len(degrees))))
+            num_nodes += len(degrees)
+    return num_nodes
+
+
+def lattice_side(num_nodes):
+    """Return the side of the square lattice used for num_nodes, the lattice holds side**2 nodes"""
+    return int(round(num_nodes ** 0.5))
+
+
+def lattice_neighbors(start, stop, side, offsets):
+    """
+    Return (degrees, neighbors) of the nodes [start, stop) of a periodic side x side lattice,
+    nodes are numbered row by row. Each node's neighbors are computed independently.
+    """
+    nodes = np.arange(start, stop, dtype=np.int64)
+    x = nodes % side
+    y = nodes // side
+    neighbors = np.empty((len(nodes), len(offsets)), dtype=np.int64)
+    for i, (dx, dy) in enumerate(offsets):
+        neighbors[:, i] = ((y + dy) % side) * side + (x + dx) % side
+    # Small lattices wrap onto themselves, drop self-loops and repeated neighbors
+    if side < 3:
+        rows = [np.unique(row[row != node]) for node, row in zip(nodes, neighbors)]
+        return np.array([len(r) for r in rows], dtype=np.int64), np.concatenate(rows)
+    return np.repeat(len(offsets), len(nodes)), neighbors.ravel()
+
+
+def ring_neighbors(start, stop, num_nodes, nei):
+    """
+    Return (degrees, neighbors) of the nodes [start, stop) of a ring where each node is
+    connected to the nei nodes on either side.
+    """
+    nodes = np.arange(start, stop, dtype=np.int64)
+    nei = min(nei, (num_nodes - 1) // 2)
+    steps = np.concatenate((np.arange(-nei, 0), np.arange(1, nei + 1)))
+    neighbors = (nodes[:, np.newaxis] + steps) % num_nodes
+    return np.repeat(len(steps), len(nodes)), neighbors.ravel()
+
+
+def generate_local_network(structure, first, stop, num_nodes, seed=0, degree=2, zipf_param=None, nei=1):
+    """
+    Return (degrees, neighbors) of the nodes [first, stop) of a network of num_nodes nodes.
+
+    Each process calls this for its own block of nodes without any communication. Lattice and ring
+    structures are undirected and computed from the node numbers alone. For "random" each node draws
+    its own neighbors (out-edges) from a stream seeded by (seed, node), with degree neighbors each or
+    with degrees from a Zipf distribution if zipf_param is given. The global network is the same for
+    any number of processes.
+    """
+    structure = structure.lower()
+    if structure == "none":
+        return np.zeros(stop - first, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if structure in ("moore", "vonneumann"):
+        side = lattice_side(num_nodes)
+        if side * side != num_nodes:
+            raise ValueError('Lattice networks need a square number of nodes, not ' + str(num_nodes))
+        return lattice_neighbors(first, stop, side, MOORE_OFFSETS if structure == "moore" else VON_NEUMANN_OFFSETS)
+    if structure == "ringworld":
+        return ring_neighbors(first, stop, num_nodes, 1)
+    if structure == "smallworld":
+        return ring_neighbors(first, stop, num_nodes, nei)
+    if structure == "random":
+        nodes = np.arange(first, stop, dtype=np.int64)
+        if zipf_param:
+            # Degrees of at most half of the nodes keep the redraws of repeated neighbors few
+            degrees = zipf_degrees(seed, nodes, zipf_param, max((num_nodes - 1) // 2, min(1, num_nodes - 1)))
+        else:
+            degrees = np.repeat(min(degree, num_nodes - 1), len(nodes))
+        return degrees, random_neighbors(seed, nodes, degrees, num_nodes)
+    raise ValueError('Structure ' + structure + ' can not be generated locally.')
+
+
+def hash_uniform(seed, keys, *streams):
+    """
+    Return a uniform [0, 1) value for each key. The value depends only on the seed, the key and the
+    optional stream numbers (scalars or arrays), so any process can draw the number for any key.
+    """
+    h = _splitmix64(np.asarray(keys, dtype=np.uint64) + _splitmix64(np.asarray([seed], dtype=np.uint64))[0])
+    for stream in streams:
+        h = _splitmix64(h + np.asarray(stream, dtype=np.uint64))
+    return (h >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+def zipf_degrees(seed, nodes, zipf_param, max_degree):
+    """
+    Return a degree for each node from a Zipf distribution with parameter zipf_param > 1,
+    P(degree >= k) = k**(1 - zipf_param), capped at max_degree.
+    """
+    if zipf_param <= 1:
+        raise ValueError('The Zipf parameter must be greater than 1.')
+    u = 1.0 - hash_uniform(seed, nodes, 1)
+    degrees = np.floor(u ** (-1.0 / (zipf_param - 1.0)))
+    return np.minimum(degrees, max_degree).astype(np.int64)
+
+
+def random_neighbors(seed, nodes, degrees, num_nodes, draw=None, max_attempts=1000):
+    """
+    Return the concatenated neighbors of each node, degrees[i] distinct nodes other than nodes[i]
+    drawn uniformly from the num_nodes nodes. Draws are seeded by (seed, node, slot), repeated
+    neighbors are drawn again until every node's neighbors are distinct. Raises ValueError if
+    repeated neighbors remain after max_attempts draws, when a node has more neighbors than
+    draw can reach or nearly as many.
+
+    A model can choose neighbors differently by passing draw(owners, slots, attempt), which must
+    return one neighbor per owner using only the hash_uniform() streams of its arguments.
+    """
+    if draw is None:
+        draw = lambda owners, slots, attempt: _draw_other(seed, owners, slots, attempt, num_nodes)
+    owners = np.repeat(np.asarray(nodes, dtype=np.int64), degrees)
+    slots = np.arange(len(owners)) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+    targets = draw(owners, slots, 0)
+
+    # Only the neighbors of nodes that had neighbors drawn again can be repeated
+    checked = np.arange(len(owners))
+    attempt = 0
+    while len(checked):
+        # A repeated neighbor keeps the lowest slot, the others are drawn again
+        order = checked[np.lexsort((slots[checked], targets[checked], owners[checked]))]
+        repeated = (owners[order][1:] == owners[order][:-1]) & (targets[order][1:] == targets[order][:-1])
+        redraw = order[1:][repeated]
+        if not len(redraw):
+            break
+        if attempt >= max_attempts:
+            raise ValueError('Could not draw distinct neighbors for ' + str(len(np.unique(owners[redraw]))) +
+                             ' nodes in ' + str(max_attempts) + ' attempts, their degrees are too close to the '
+                             'number of nodes they can be connected to.')
+        attempt += 1
+        targets[redraw] = draw(owners[redraw], slots[redraw], attempt)
+        checked = checked[np.in1d(owners[checked], owners[redraw])]
+    return targets
+
+
+def _draw_other(seed, owners, slots, attempt, num_nodes):
+    """Draw a node other than each owner from the (seed, owner, slot, attempt) stream"""
+    targets = (hash_uniform(seed, owners, 2, slots, attempt) * (num_nodes - 1)).astype(np.int64)
+    targets[targets >= owners] += 1
+    return targets
+
+
+def _splitmix64(x):
+    """SplitMix64 finalizer, mixes each 64 bit value of x"""
+    with np.errstate(over='ignore'):
+        z = x + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def _node_chunks(num_nodes, degree, chunk_edges):
+    """Yield (start, stop) node ranges holding about chunk_edges adjacency entries"""
+    step = max(chunk_edges // max(degree, 1), 1)
+    for start in xrange(0, num_nodes, step):
+        yield start, min(start + step, num_nodes)
+
+
+def _no_network(num_nodes, chunk_edges):
+    """Nodes without edges"""
+    for start, stop in _node_chunks(num_nodes, 1, chunk_edges):
+        yield np.zeros(stop - start, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+
+def _lattice(num_nodes, offsets, chunk_edges):
+    """Square lattice with the given neighborhood, the number of nodes is a square"""
+    side = lattice_side(num_nodes)
+    for start, stop in _node_chunks(num_nodes, len(offsets), chunk_edges):
+        yield lattice_neighbors(start, stop, side, offsets)
+
+
+def _ring(num_nodes, nei, chunk_edges):
+    """Ring lattice, each node is connected to nei nodes on either side"""
+    for start, stop in _node_chunks(num_nodes, 2 * nei, chunk_edges):
+        yield ring_neighbors(start, stop, num_nodes, nei)
+
+
+def _watts_strogatz(num_nodes, nei, prob_edges, random_state, chunk_edges):
+    """Ring lattice where each edge is rewired to a random target with probability prob_edges"""
+    buckets = _EdgeBuckets(num_nodes, 2 * nei, chunk_edges)
+    try:
+        for start, stop in _node_chunks(num_nodes, nei, chunk_edges):
+            # Edges from each node to the nei nodes after it
+            sources = np.repeat(np.arange(start, stop, dtype=np.int64), nei)
+            targets = (sources + np.tile(np.arange(1, nei + 1), stop - start)) % num_nodes
+            rewire = random_state.random_sample(len(targets)) < prob_edges
+            targets[rewire] = _random_other(sources[rewire], num_nodes, random_state)
+            buckets.add_edges(sources, targets)
+        for chunk in buckets:
+            yield chunk
+    finally:
+        buckets.close()
+
+
+def _erdos_renyi(num_nodes, num_edges, prob_edges, random_state, chunk_edges):
+    """
+    Uniform random graph with num_edges edges, or with each pair of nodes connected with
+    probability prob_edges. Repeated edges are merged.
+    """
+    if num_edges <= 0:
+        num_edges = random_state.binomial(num_nodes * (num_nodes - 1) // 2, prob_edges)
+    buckets = _EdgeBuckets(num_nodes, 2.0 * num_edges / max(num_nodes, 1), chunk_edges)
+    try:
+        for start in xrange(0, num_edges, chunk_edges):
+            count = min(chunk_edges, num_edges - start)
+            sources = random_state.randint(0, num_nodes, count).astype(np.int64)
+            buckets.add_edges(sources, _random_other(sources, num_nodes, random_state))
+        for chunk in buckets:
+            yield chunk
+    finally:
+        buckets.close()
+
+
+def _barabasi_albert(num_nodes, m, random_state, chunk_edges):
+    """
+    Preferential attachment, each node attaches m edges to earlier nodes chosen with probability
+    proportional to their degree.
+
+    Uses the Batagelj-Brandes edge list method: the target of edge e is an endpoint drawn uniformly
+    from the 2e+1 endpoints written before it. Chunks are processed in order, so targets from earlier
+    chunks are final and targets within a chunk are resolved by pointer jumping. The targets are kept
+    in a memory-mapped scratch file.
+    """
+    total = num_nodes * m
+    buckets = _EdgeBuckets(num_nodes, 2 * m, chunk_edges)
+    scratch = tempfile.mkdtemp(prefix='mabm_ba_')
+    try:
+        resolved = np.memmap(os.path.join(scratch, 'targets'), dtype=np.int64, mode='w+', shape=(max(total, 1),))
+        for start in xrange(0, total, chunk_edges):
+            stop = min(start + chunk_edges, total)
+            edges = np.arange(start, stop, dtype=np.int64)
+            sources = edges // m
+            # Endpoint 2e is the source of edge e, endpoint 2e+1 is its target
+            draws = (random_state.random_sample(len(edges)) * (2 * edges + 1)).astype(np.int64)
+            targets = np.where(draws % 2 == 0, draws // 2 // m, -1)
+
+            # Targets copied from edges of earlier chunks
+            earlier = (draws % 2 == 1) & (draws // 2 < start)
+            targets[earlier] = resolved[draws[earlier] // 2]
+
+            # Targets copied from edges in this chunk point strictly backwards
+            pointers = np.where(targets < 0, draws // 2 - start, -1)
+            pending = np.flatnonzero(targets < 0)
+            while len(pending):
+                copied = targets[pointers[pending]]
+                done = copied >= 0
+                targets[pending[done]] = copied[done]
+                pending = pending[~done]
+                pointers[pending] = pointers[pointers[pending]]
+
+            resolved[start:stop] = targets
+            buckets.add_edges(sources, targets)
+        del resolved
+        for chunk in buckets:
+            yield chunk
+    finally:
+        buckets.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _power_law(num_nodes, num_edges, exponent, random_state, chunk_edges):
+    """
+    Static power-law graph (Chung-Lu): node i has weight (i+1)**(-1/(exponent-1)) and both ends of
+    each edge are drawn proportionally to weight, so the expected degrees follow a power law with
+    the given exponent. Repeated edges and self-loops are dropped.
+    """
+    if exponent <= 2:
+        raise ValueError('Power-law exponent must be greater than 2.')
+    alpha = 1.0 / (exponent - 1.0)
+    buckets = _EdgeBuckets(num_nodes, 2.0 * num_edges / max(num_nodes, 1), chunk_edges)
+    try:
+        for start in xrange(0, num_edges, chunk_edges):
+            count = min(chunk_edges, num_edges - start)
+            # Inverse transform of the continuous weight distribution
+            ends = num_nodes * random_state.random_sample((2, count)) ** (1.0 / (1.0 - alpha))
+            ends = np.minimum(ends.astype(np.int64), num_nodes - 1)
+            buckets.add_edges(ends[0], ends[1])
+        for chunk in buckets:
+            yield chunk
+    finally:
+        buckets.close()
+
+
+def _random_other(sources, num_nodes, random_state):
+    """Return a uniformly random node different from each source"""
+    targets = random_state.randint(0, num_nodes - 1, len(sources)).astype(np.int64)
+    targets[targets >= sources] += 1
+    return targets
+
+
+class _EdgeBuckets:
+    """
+    External bucket sort of undirected edges by source node.
+
+    Both directions of every edge are appended to the temporary file of the bucket holding
+    the source. Iterating yields the (degrees, neighbors) chunks of the buckets in node order,
+    with self-loops and repeated edges removed.
+    """
+
+    def __init__(self, num_nodes, mean_degree, chunk_edges):
+        self.__num_nodes = num_nodes
+        self.__nodes_per_bucket = max(int(chunk_edges / max(mean_degree, 1)), 1)
+        self.__num_buckets = (num_nodes + self.__nodes_per_bucket - 1) // self.__nodes_per_bucket
+        self.__directory = tempfile.mkdtemp(prefix='mabm_edges_')
+        self.__files = [open(os.path.join(self.__directory, str(i)), 'w+b') for i in range(self.__num_buckets)]
+
+    def add_edges(self, sources, targets):
+        """Append the edges (sources[i], targets[i]) in both directions"""
+        sources, targets = np.concatenate((sources, targets)), np.concatenate((targets, sources))
+        bucket = sources // self.__nodes_per_bucket
+        order = np.argsort(bucket, kind='mergesort')
+        pairs = np.empty((len(order), 2), dtype=np.int64)
+        pairs[:, 0] = sources[order]
+        pairs[:, 1] = targets[order]
+        bounds = np.searchsorted(bucket[order], np.arange(self.__num_buckets + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            pairs[bounds[i]:bounds[i+1]].tofile(self.__files[i])
+
+    def __iter__(self):
+        for i in range(self.__num_buckets):
+            first = i * self.__nodes_per_bucket
+            count = min(self.__nodes_per_bucket, self.__num_nodes - first)
+            f = self.__files[i]
+            f.seek(0)
+            pairs = np.fromfile(f, dtype=np.int64).reshape(-1, 2)
+            f.close()
+            os.remove(f.name)
+
+            # Sort by source then target, and drop self-loops and repeated edges
+            pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+            keys = np.unique((pairs[:, 0] - first) * self.__num_nodes + pairs[:, 1])
+            yield np.bincount(keys // self.__num_nodes, minlength=count), keys % self.__num_nodes
+
+    def close(self):
+        """Remove the temporary files"""
+        for f in self.__files:
+            f.close()
+        shutil.rmtree(self.__directory, ignore_errors=True)
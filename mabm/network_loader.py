@@ -0,0 +1,210 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import os
+import numpy as np
+
+# Bytes read at a time while looking for the end of a line that crosses a range boundary
+LINE_SEARCH_CHUNK = 1 << 16
+
+
+class DistributedNetwork:
+    """
+    The part of a network owned by one process.
+
+    Nodes are numbered globally and partitioned into consecutive blocks of nodes_per_rank,
+    so node n is owned by process n / nodes_per_rank. The owner keeps the adjacency of its
+    own nodes in CSR form along with the watch lists used for element synchronization:
+        ghosts: foreign nodes that are neighbors of this process's nodes
+        watchers: dictionary of process -> own nodes that are neighbors of that process's nodes
+    """
+    __first = None
+    __nodes_per_rank = None
+    __offsets = None
+    __neighbors = None
+    __ghosts = None
+    __watchers = None
+
+    def __init__(self, comm, nodes_per_rank, offsets, neighbors):
+        """
+        Create the distributed network from this process's CSR slice and exchange the
+        watch lists with the owners of the foreign neighbors. Collective over comm.
+        """
+        rank = comm.Get_rank()
+        size = comm.Get_size()
+        self.__first = rank * nodes_per_rank
+        self.__nodes_per_rank = nodes_per_rank
+        self.__offsets = offsets
+        self.__neighbors = neighbors
+
+        # Foreign neighbors, grouped by their owning process
+        owners = np.asarray(neighbors, dtype=np.int64) // nodes_per_rank
+        self.__ghosts = np.unique(np.asarray(neighbors, dtype=np.int64)[owners != rank])
+        ghost_owners = self.__ghosts // nodes_per_rank
+        bounds = np.searchsorted(ghost_owners, np.arange(size + 1))
+        outgoing = [self.__ghosts[bounds[i]:bounds[i+1]] for i in range(size)]
+
+        # Tell every owner which of its nodes this process watches
+        incoming = comm.alltoall(outgoing)
+        self.__watchers = {}
+        for i in range(size):
+            if len(incoming[i]) > 0:
+                self.__watchers[i] = incoming[i]
+
+    def get_first(self):
+        """Return the global number of the first node on this process"""
+        return self.__first
+
+    def get_nodes_per_rank(self):
+        """Return the number of nodes owned by each process"""
+        return self.__nodes_per_rank
+
+    def get_num_local_nodes(self):
+        """Return the number of nodes owned by this process"""
+        return len(self.__offsets) - 1
+
+    def get_neighbors(self, local_node):
+        """Return the global numbers of the neighbors of a node on this process"""
+        return self.__neighbors[self.__offsets[local_node]:self.__offsets[local_node+1]]
+
+    def get_csr(self):
+        """Return the local offsets and neighbors arrays"""
+        return self.__offsets, self.__neighbors
+
+    def get_ghosts(self):
+        """Return the sorted foreign nodes that neighbor this process's nodes"""
+        return self.__ghosts
+
+    def get_watchers(self):
+        """Return the dictionary of process -> own nodes watched by that process"""
+        return self.__watchers
+
+    def find_hubs(self, comm, threshold):
+        """
+        Return the sorted global numbers of all nodes with at least threshold neighbors, the same on
+        every process. Collective over comm.
+        """
+        degrees = np.diff(np.asarray(self.__offsets, dtype=np.int64))
+        hubs = self.__first + np.flatnonzero(degrees >= threshold)
+        return np.concatenate(comm.allgather(hubs.astype(np.int64)))
+
+    def get_owner(self, node):
+        """Return the process owning a global node number"""
+        return node // self.__nodes_per_rank
+
+
+def load_edge_list(comm, path, nodes_per_rank, symmetric=False):
+    """
+    Load an edge list (one "source target" or "source,target" pair per line) in parallel.
+
+    Each process parses a disjoint byte range of the file and routes every edge to the
+    owner of its source. If symmetric is set, each edge is also added in reverse.
+    Collective over comm.
+    """
+    text = _read_line_range(comm, path)
+    values = _parse_integers(text)
+    if len(values) % 2 != 0:
+        raise ValueError('Edge list ' + path + ' has a line without a target.')
+    sources = values[0::2]
+    targets = values[1::2]
+    if symmetric:
+        sources, targets = np.concatenate((sources, targets)), np.concatenate((targets, sources))
+    return _shuffle_to_owner(comm, nodes_per_rank, sources, targets)
+
+
+def load_adjacency_list(comm, path, nodes_per_rank):
+    """
+    Load an adjacency list (line i holds the comma separated neighbors of node i, as
+    written by network_generation.py) in parallel. Collective over comm.
+    """
+    text = _read_line_range(comm, path)
+
+    # Global line number of this process's first line
+    first_line = comm.exscan(text.count('\n'))
+    if first_line is None:
+        first_line = 0
+
+    buf = np.frombuffer(text, dtype=np.uint8)
+    digits = (buf >= ord('0')) & (buf <= ord('9'))
+    token_starts = np.flatnonzero(digits & ~np.concatenate(([False], digits[:-1])))
+    # The line of a token is the number of newlines before it
+    sources = first_line + np.searchsorted(np.flatnonzero(buf == ord('\n')), token_starts)
+    targets = _parse_integers(text)
+    return _shuffle_to_owner(comm, nodes_per_rank, sources.astype(np.int64), targets)
+
+
+def _read_line_range(comm, path):
+    """
+    Return the complete lines of a file that start within this process's byte range.
+    The returned text always ends with a newline unless it is empty.
+    """
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    file_size = os.path.getsize(path)
+    start = file_size * rank // size
+    end = file_size * (rank + 1) // size
+
+    with open(path, 'rb') as f:
+        if start == 0:
+            text = f.read(end)
+        else:
+            # Skip the line that started before this range, it belongs to a previous process
+            f.seek(start - 1)
+            text = f.read(end - start + 1)
+            cut = text.find('\n')
+            if cut < 0:
+                return ''
+            text = text[cut+1:]
+            if cut + 1 > end - start:
+                return ''
+        # Finish the line that crosses the end of the range
+        if text and not text.endswith('\n'):
+            pieces = [text]
+            while True:
+                chunk = f.read(LINE_SEARCH_CHUNK)
+                if not chunk:
+                    pieces.append('\n')
+                    break
+                newline = chunk.find('\n')
+                if newline >= 0:
+                    pieces.append(chunk[:newline+1])
+                    break
+                pieces.append(chunk)
+            text = ''.join(pieces)
+    return text
+
+
+def _parse_integers(text):
+    """Parse all non-negative integers in text, any other character separates values"""
+    buf = np.frombuffer(text, dtype=np.uint8).copy()
+    buf[(buf < ord('0')) | (buf > ord('9'))] = ord(' ')
+    return np.fromstring(buf.tostring(), dtype=np.int64, sep=' ')
+
+
+def _shuffle_to_owner(comm, nodes_per_rank, sources, targets):
+    """
+    Route edges to the owner of their source and build the owner's DistributedNetwork.
+    Collective over comm.
+    """
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    # Group the edges by owner, keeping the file order within each owner
+    owners = sources // nodes_per_rank
+    if len(owners) and owners.max() >= size:
+        raise ValueError('Node ' + str(sources[owners.argmax()]) + ' is outside of the ' +
+                         str(nodes_per_rank * size) + ' nodes in the model.')
+    order = np.argsort(owners, kind='mergesort')
+    sources = sources[order]
+    targets = targets[order]
+    bounds = np.searchsorted(owners[order], np.arange(size + 1))
+    outgoing = [(sources[bounds[i]:bounds[i+1]], targets[bounds[i]:bounds[i+1]]) for i in range(size)]
+    incoming = comm.alltoall(outgoing)
+
+    # Received pieces are in process order, which is file order, so a stable sort keeps
+    # each adjacency list in the order it was written
+    local = np.concatenate([s for s, t in incoming]) - rank * nodes_per_rank
+    targets = np.concatenate([t for s, t in incoming])
+    order = np.argsort(local, kind='mergesort')
+    offsets = np.zeros(nodes_per_rank + 1, dtype=np.int64)
+    np.cumsum(np.bincount(local, minlength=nodes_per_rank), out=offsets[1:])
+    return DistributedNetwork(comm, nodes_per_rank, offsets, targets[order])
@@ -0,0 +1,120 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import Queue
+import threading
+
+# Largest number of queued items handled in one batch by the writer thread
+BATCH_SIZE = 256
+
+
+class OutputWriter:
+    """
+    Writes simulation output on a background thread so the simulation does not wait on disk.
+
+    Output is queued as immutable data (strings, or arrays the caller no longer modifies) along
+    with the function that writes it. The queue is bounded: when the writer thread falls behind,
+    the simulation blocks until there is room again. Consecutive writes to the same file are
+    joined and written together.
+    """
+    __queue = None
+    __thread = None
+    __error = None
+
+    def __init__(self, max_pending=64):
+        """Start the writer thread, at most max_pending items are queued at a time"""
+        self.__queue = Queue.Queue(max_pending)
+        self.__thread = threading.Thread(target=self.__run, name='mabm-output-writer')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def write(self, f, data):
+        """Write the string data to the open file f"""
+        self.__put((f, data))
+
+    def append(self, path, data):
+        """Append the string data to the file at path"""
+        self.call(_append, path, data)
+
+    def call(self, function, *args):
+        """Call function(*args) on the writer thread, after all previously queued output"""
+        self.__put((function, args))
+
+    def flush(self):
+        """Wait until all queued output has been written"""
+        self.__queue.join()
+        self.__check()
+
+    def close(self):
+        """Write all queued output and stop the writer thread"""
+        if self.__thread is not None:
+            self.__queue.put(None)
+            self.__thread.join()
+            self.__thread = None
+            self.__check()
+
+    def __put(self, item):
+        """Queue an item, blocking while the queue is full"""
+        self.__check()
+        if self.__thread is None:
+            raise IOError('OutputWriter is closed.')
+        self.__queue.put(item)
+
+    def __check(self):
+        """Raise the first error that happened on the writer thread"""
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error
+
+    def __run(self):
+        """Writer thread: take batches of queued items and write them"""
+        while True:
+            batch = [self.__queue.get()]
+            while len(batch) < BATCH_SIZE and batch[-1] is not None:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            # Group consecutive writes to the same file
+            pending_file = None
+            pending = []
+            for item in batch:
+                if item is not None and not callable(item[0]) and item[0] is pending_file:
+                    pending.append(item[1])
+                    continue
+                self.__handle(_write, pending_file, pending)
+                pending_file = None
+                pending = []
+                if item is None:
+                    continue
+                if callable(item[0]):
+                    self.__handle(item[0], *item[1])
+                else:
+                    pending_file = item[0]
+                    pending = [item[1]]
+            self.__handle(_write, pending_file, pending)
+
+            for item in batch:
+                self.__queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def __handle(self, function, *args):
+        """Run one output function, keeping the first error for the simulation thread"""
+        try:
+            function(*args)
+        except Exception as e:
+            if self.__error is None:
+                self.__error = e
+
+
+def _write(f, pieces):
+    """Write the joined pieces to the open file f"""
+    if pieces:
+        f.write(''.join(pieces))
+
+
+def _append(path, data):
+    """Append data to the file at path"""
+    with open(path, 'a') as f:
+        f.write(data)
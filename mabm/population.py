@@ -0,0 +1,108 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import os
+import struct
+import zipfile
+import numpy as np
+
+# A population is a set of equally long columns of agent attributes, one value per agent
+# in global agent order. It is stored either as a directory of .npy files, one per column
+# and named after it, or as an uncompressed .npz archive (numpy.savez) of the columns.
+# Both are memory-mapped, so a process only reads the pages of its own agents.
+
+
+class Population:
+    """
+    Memory-mapped columns of agent attributes, see mabm.Model.create_agents().
+    """
+    __path = None
+    __columns = None
+    __num_agents = None
+
+    def __init__(self, path):
+        """Open a population directory of .npy files or an uncompressed .npz file"""
+        self.__path = path
+        self.__columns = {}
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.npy'):
+                    self.__columns[name[:-4]] = np.load(os.path.join(path, name), mmap_mode='r')
+        else:
+            self.__columns = _map_npz(path)
+
+        if not self.__columns:
+            raise IOError('Population ' + path + ' has no columns.')
+        lengths = set(len(column) for column in self.__columns.itervalues())
+        if len(lengths) != 1:
+            raise IOError('Columns of population ' + path + ' have different lengths.')
+        self.__num_agents = lengths.pop()
+
+    def get_num_agents(self):
+        """Return the number of agents in the population"""
+        return self.__num_agents
+
+    def get_column_names(self):
+        """Return the names of the columns"""
+        return sorted(self.__columns)
+
+    def has_column(self, name):
+        """Check if the population has a column"""
+        return name in self.__columns
+
+    def get_column(self, name):
+        """Return a column for all agents"""
+        return self.__columns[name]
+
+    def get_slice(self, start, stop):
+        """Return the columns of agents start to stop as a dictionary of memory-mapped views"""
+        if start < 0 or stop > self.__num_agents or start > stop:
+            raise ValueError('Agents ' + str(start) + ' to ' + str(stop) + ' are not in population ' +
+                             self.__path + ' of ' + str(self.__num_agents) + ' agents.')
+        return dict((name, column[start:stop]) for name, column in self.__columns.iteritems())
+
+    def get_path(self):
+        """Return the path of the population"""
+        return self.__path
+
+
+def write_population(path, **columns):
+    """
+    Write the columns of a population to an uncompressed .npz file that Population can memory-map
+    """
+    with open(path, 'wb') as f:
+        np.savez(f, **columns)
+
+
+def _map_npz(path):
+    """Memory-map each array stored in an uncompressed .npz file"""
+    columns = {}
+    with zipfile.ZipFile(path) as archive:
+        members = archive.infolist()
+    with open(path, 'rb') as f:
+        for member in members:
+            if not member.filename.endswith('.npy'):
+                continue
+            if member.compress_type != zipfile.ZIP_STORED:
+                raise IOError('Population ' + path + ' is compressed and can not be memory-mapped, '
+                              'save it with numpy.savez.')
+
+            # The array follows the member's local header, whose name and extra field lengths
+            # may differ from those in the central directory
+            f.seek(member.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(member.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise IOError('Column ' + member.filename[:-4] + ' of population ' + path + ' holds objects.')
+
+            order = 'F' if fortran_order else 'C'
+            if np.prod(shape) == 0:
+                columns[member.filename[:-4]] = np.zeros(shape, dtype=dtype, order=order)
+            else:
+                columns[member.filename[:-4]] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(),
+                                                          shape=shape, order=order)
+    return columns
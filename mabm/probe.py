@@ -0,0 +1,111 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import numpy as np
+
+
+class Probe:
+    """
+    A named observer of the model, evaluated every k time steps or once at the end of the run.
+
+    evaluate(model) returns a 1-d array of local values computed from this process's elements,
+    usually with vectorized operations over columns of element attributes. The arrays of all due
+    probes are summed across processes in one reduction (see mabm.Model.run_probes()), so every
+    process must return an array of the same length. finish(reduced) turns the summed array into
+    the values that are reported, it is only called on the root process.
+    """
+    __name = None
+    __evaluate = None
+    __finish = None
+    __every = None
+
+    def __init__(self, name, evaluate, finish=None, every=1):
+        """
+        Create a probe evaluated every `every` time steps. If every is None, the probe is only
+        evaluated once the run has finished, when the model has converged or run out of time steps.
+        """
+        self.__name = name
+        self.__evaluate = evaluate
+        self.__finish = finish
+        self.__every = every
+
+    def get_name(self):
+        """Return the name of the probe"""
+        return self.__name
+
+    def is_due(self, time, final=False):
+        """Check if the probe is evaluated at a time step, or at the end of the run if final"""
+        if self.__every is None:
+            return final
+        return not final and time % self.__every == 0
+
+    def evaluate(self, model):
+        """Return the local values of this process"""
+        return np.asarray(self.__evaluate(model), dtype=float).ravel()
+
+    def finish(self, reduced):
+        """Return the reported values from the values summed across processes"""
+        if self.__finish is None:
+            return reduced
+        return self.__finish(reduced)
+
+
+class HistogramProbe(Probe):
+    """
+    Number of values in each bin, see numpy.histogram. values(model) returns the local values,
+    values that are nan are not counted.
+    """
+
+    def __init__(self, name, values, edges, every=1):
+        edges = np.asarray(edges, dtype=float)
+
+        def evaluate(model):
+            v = values(model)
+            return np.histogram(v[~np.isnan(v)], edges)[0]
+
+        Probe.__init__(self, name, evaluate, lambda reduced: reduced.astype(int), every)
+
+
+class WeightedMeanProbe(Probe):
+    """
+    Weighted mean of values, such as the degree-weighted mean of the states. values(model) and
+    weights(model) return the local values and their weights, values that are nan are left out.
+    """
+
+    def __init__(self, name, values, weights, every=1):
+
+        def evaluate(model):
+            v = values(model)
+            w = np.asarray(weights(model), dtype=float)
+            known = ~np.isnan(v)
+            return [np.dot(v[known], w[known]), w[known].sum()]
+
+        def finish(reduced):
+            return [reduced[0] / reduced[1] if reduced[1] else np.nan]
+
+        Probe.__init__(self, name, evaluate, finish, every)
+
+
+class BreakdownProbe(Probe):
+    """
+    Mean of values for each of num_groups groups, such as the mean state of each personality.
+    values(model) returns the local values and groups(model) the group of each, numbered from 0.
+    Values that are nan are left out, the mean of an empty group is nan.
+    """
+
+    def __init__(self, name, values, groups, num_groups, every=1):
+
+        def evaluate(model):
+            v = values(model)
+            g = np.asarray(groups(model), dtype=np.int64)
+            known = ~np.isnan(v)
+            return np.concatenate([np.bincount(g[known], v[known], num_groups),
+                                   np.bincount(g[known], minlength=num_groups)])
+
+        def finish(reduced):
+            sums, counts = reduced[:num_groups], reduced[num_groups:]
+            means = np.empty(num_groups)
+            means.fill(np.nan)
+            np.divide(sums, counts, out=means, where=counts > 0)
+            return means
+
+        Probe.__init__(self, name, evaluate, finish, every)
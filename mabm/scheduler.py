@@ -7,12 +7,32 @@ import random
 
 class Scheduler:
     __time_series = None
+    __order = None
+    __bucket_update = None
 
     def __init__(self):
         """"
         Initialize a scheduler for the MABM module
         """
         self.__time_series = OrderedDict()
+        self.__order = None
+        self.__bucket_update = None
+
+    def set_order(self, key):
+        """
+        Activate the elements of a time step in the order of key(element) instead of in random order,
+        for example in storage slot order so memory-mapped element data is read sequentially.
+        A key of None restores random activation.
+        """
+        self.__order = key
+
+    def set_bucket_update(self, function):
+        """
+        Update the elements of a time step with function(time, elements) instead of calling each
+        element's update(), for example to update them in chunks in a mabm.WorkerPool. A function
+        of None restores the elements' own updates.
+        """
+        self.__bucket_update = function
 
     def add_event(self, time, element):
         """
@@ -23,6 +43,15 @@ class Scheduler:
         except KeyError:
             self.__time_series[time] = [element]
 
+    def add_events(self, time, elements):
+        """
+        Add an event at the same time for each element in a list.
+        """
+        try:
+            self.__time_series[time].extend(elements)
+        except KeyError:
+            self.__time_series[time] = list(elements)
+
     def get_next_event_time(self):
         """
         Find the next event time.
@@ -40,12 +69,24 @@ class Scheduler:
         the list of items to be updated.
         """
         if time in self.__time_series:
-            # Shuffle the list in place, for random activation
-            random.shuffle(self.__time_series[time])
-            for e in self.__time_series[time]:
-                e.update()
+            # Shuffle the list in place, for random activation, or sort it by the activation key
+            if self.__order is None:
+                random.shuffle(self.__time_series[time])
+            else:
+                self.__time_series[time].sort(key=self.__order)
+            if self.__bucket_update is not None:
+                self.__bucket_update(time, self.__time_series[time])
+            else:
+                for e in self.__time_series[time]:
+                    e.update()
             self.__time_series.popitem(last=False)
 
+    def get_events(self, time):
+        """
+        Return the elements scheduled at a time.
+        """
+        return self.__time_series.get(time, [])
+
     def get_element_requests(self, time):
         """
         Complete the element requests for each element in the time series.
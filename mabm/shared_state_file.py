@@ -0,0 +1,144 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import struct
+import numpy as np
+from mpi4py import MPI
+
+# Layout of a shared state file:
+#
+#   header      64 bytes, see HEADER_FORMAT
+#   counts      num_processes int64 values, the number of agents written by each process
+#   columns     one column of total_agents states per written step; each process
+#               writes its block of agents at the offset given by an exclusive scan
+#               of the counts, so agents are ordered by process and then by index
+#   steps       num_steps int64 values, the step of each column, written at close
+#
+# All processes write into the one file with collective MPI-IO calls, so no
+# per-process files are created and no merge pass is needed afterwards.
+MAGIC = 'MABMSSF\0'
+VERSION = 1
+HEADER_FORMAT = '<8sIIQQ8sQ16x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+class SharedStateWriter:
+    """
+    Appends one column of agent states per step to a state file shared by all processes.
+
+    Has the same interface as StateWriter. Every method is collective over comm.
+    """
+    __comm = None
+    __file = None
+    __dtype = None
+    __every = None
+    __offset = None
+    __total = None
+    __columns_at = None
+    __steps = None
+
+    def __init__(self, comm, path, num_agents, dtype=np.float64, every=1):
+        """Create the shared state file, num_agents is the number of agents on this process"""
+        self.__comm = comm
+        self.__dtype = np.dtype(dtype).newbyteorder('<')
+        self.__every = every
+        self.__steps = []
+
+        # This process's agents follow those of all lower ranked processes
+        self.__offset = comm.exscan(num_agents)
+        if self.__offset is None:
+            self.__offset = 0
+        counts = np.array(comm.allgather(num_agents), dtype='<i8')
+        self.__total = int(counts.sum())
+        self.__columns_at = HEADER_SIZE + counts.nbytes
+
+        self.__file = MPI.File.Open(comm, path, MPI.MODE_WRONLY | MPI.MODE_CREATE)
+        self.__file.Set_size(0)
+        if comm.Get_rank() == 0:
+            self.__file.Write_at(HEADER_SIZE, counts)
+
+    def is_due(self, step):
+        """Check if a column is written for this step"""
+        return step % self.__every == 0
+
+    def append(self, step, states):
+        """Write this process's block of the column for a step"""
+        if not self.is_due(step):
+            return
+        states = np.ascontiguousarray(states, dtype=self.__dtype)
+        column_at = self.__columns_at + len(self.__steps) * self.__total * self.__dtype.itemsize
+        self.__file.Write_at_all(column_at + self.__offset * self.__dtype.itemsize, states)
+        self.__steps.append(step)
+
+    def flush(self):
+        """Flush the written columns to disk"""
+        self.__file.Sync()
+
+    def close(self):
+        """Write the steps and the header, then close the file"""
+        if self.__file is None:
+            return
+        if self.__comm.Get_rank() == 0:
+            steps_at = self.__columns_at + len(self.__steps) * self.__total * self.__dtype.itemsize
+            self.__file.Write_at(steps_at, np.array(self.__steps, dtype='<i8'))
+            header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.__comm.Get_size(), self.__total,
+                                 len(self.__steps), self.__dtype.str, steps_at)
+            self.__file.Write_at(0, np.frombuffer(header, dtype=np.uint8))
+        self.__file.Close()
+        self.__file = None
+
+
+class SharedStateReader:
+    """
+    Memory-mapped reader for a state file written by SharedStateWriter. Does not need MPI.
+    """
+    __counts = None
+    __steps = None
+    __states = None
+
+    def __init__(self, path):
+        """Open a shared state file"""
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                raise IOError('File ' + path + ' is not a MABM shared state file.')
+            magic, version, size, total, num_steps, dtype, steps_at = struct.unpack(HEADER_FORMAT, header)
+            if magic != MAGIC:
+                raise IOError('File ' + path + ' is not a MABM shared state file.')
+            if version != VERSION:
+                raise IOError('Unsupported shared state file version ' + str(version) + ' in ' + path)
+            self.__counts = np.fromfile(f, dtype='<i8', count=size)
+            f.seek(steps_at)
+            self.__steps = np.fromfile(f, dtype='<i8', count=num_steps)
+
+        if num_steps > 0 and total > 0:
+            self.__states = np.memmap(path, dtype=np.dtype(dtype.rstrip('\0')), mode='r',
+                                      offset=HEADER_SIZE + 8 * size, shape=(num_steps, total))
+        else:
+            self.__states = np.zeros((num_steps, total), dtype=np.dtype(dtype.rstrip('\0')))
+
+    def get_counts(self):
+        """Return the number of agents written by each process"""
+        return self.__counts
+
+    def get_steps(self):
+        """Return the steps that were written"""
+        return self.__steps
+
+    def get_states(self):
+        """Return the states as a (steps, agents) array, agents are ordered by process then index"""
+        return self.__states
+
+
+def write_shared_text(comm, path, text):
+    """
+    Write the text of every process into one file, ordered by rank, with a collective MPI-IO
+    write. Collective over comm.
+    """
+    data = np.frombuffer(text, dtype=np.uint8) if text else np.zeros(0, dtype=np.uint8)
+    offset = comm.exscan(len(data))
+    if offset is None:
+        offset = 0
+    f = MPI.File.Open(comm, path, MPI.MODE_WRONLY | MPI.MODE_CREATE)
+    f.Set_size(0)
+    f.Write_at_all(offset, data)
+    f.Close()
@@ -0,0 +1,89 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import mabm
+import numpy as np
+
+
+class StateBuffer:
+    """
+    Double-buffered columns of element states, one value per slot, for synchronous updates.
+
+    During a time step get() returns the states of the previous time step and set() writes the
+    states of the next one, so no element sees another's new state before the step is over and
+    the elements of a time step can be updated in any order, or in parallel, with the same result.
+    swap() makes the written states current at the end of the step, see mabm.Model.add_state_buffer().
+    Only the slots written during the step are copied. The interface is that of mabm.ColumnStore.
+
+    With shared, the columns are in shared memory, so the workers of a mabm.WorkerPool read the
+    current states.
+    """
+    __num_slots = None
+    __current = None
+    __next = None
+    __written = None
+    __shared = None
+
+    def __init__(self, num_slots, shared=False):
+        """Create an empty buffer for num_slots elements, in shared memory if shared"""
+        self.__num_slots = num_slots
+        self.__shared = shared
+        self.__current = {}
+        self.__next = {}
+        self.__written = {}
+
+    def add_column(self, name, dtype, values=None):
+        """Create a column, filled with values if given and with zeros otherwise"""
+        if self.__shared:
+            column = mabm.shared_array(self.__num_slots, dtype)
+            self.__next[name] = mabm.shared_array(self.__num_slots, dtype)
+        else:
+            column = np.zeros(self.__num_slots, dtype=dtype)
+            self.__next[name] = np.zeros(self.__num_slots, dtype=dtype)
+        if values is not None:
+            column[:] = values
+        self.__next[name][:] = column
+        self.__current[name] = column
+        self.__written[name] = []
+
+    def get_num_slots(self):
+        """Return the number of slots"""
+        return self.__num_slots
+
+    def get(self, name, slot):
+        """Return the value of a column at a slot at the previous time step"""
+        return self.__current[name][slot].item()
+
+    def get_next(self, name, slot):
+        """Return the value of a column at a slot at the next time step, as written so far"""
+        return self.__next[name][slot].item()
+
+    def set(self, name, slot, value):
+        """Set the value of a column at a slot at the next time step"""
+        self.__next[name][slot] = value
+        self.__written[name].append(slot)
+
+    def set_many(self, name, slots, values):
+        """Set the values of a column at an array of slots at the next time step"""
+        self.__next[name][slots] = values
+        self.__written[name].extend(np.asarray(slots).tolist())
+
+    def get_column(self, name):
+        """Return a whole column at the previous time step, read-only"""
+        return self.__current[name]
+
+    def swap(self):
+        """Make the values written during the time step current"""
+        for name, written in self.__written.iteritems():
+            if written:
+                self.__current[name][written] = self.__next[name][written]
+                self.__written[name] = []
+
+    def flush(self):
+        """Nothing to write back, for the interface of mabm.ColumnStore"""
+        pass
+
+    def close(self, remove=True):
+        """Release the columns"""
+        self.__current = {}
+        self.__next = {}
+        self.__written = {}
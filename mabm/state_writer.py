@@ -0,0 +1,176 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import os
+import struct
+import numpy as np
+
+# Layout of a state file:
+#
+#   header      64 bytes, see HEADER_FORMAT
+#   agents      num_agents int64 indices of the agents recorded in each column
+#   records     one record per written step: the step as int64 followed by the
+#               states of the recorded agents
+#
+# Records have a fixed size, so appending a step never touches earlier data and
+# the whole file can be read back as one memory-mapped structured array.
+MAGIC = 'MABMSTS\0'
+VERSION = 1
+HEADER_FORMAT = '<8sIQQ8s28x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+class StateWriter:
+    """
+    Appends one column of agent states per step to a per-process binary state file.
+
+    Columns can be written every k steps, and for a sampled subset of the agents. The cost of
+    a step is proportional to the number of recorded agents, earlier steps are never rewritten.
+    If an OutputWriter is given, columns are copied and written on its background thread.
+    """
+    __file = None
+    __dtype = None
+    __every = None
+    __sample = None
+    __output_writer = None
+
+    def __init__(self, path, num_agents, dtype=np.float64, every=1, sample=None, output_writer=None):
+        """
+        Create a state file for num_agents agents. If sample is given, only the states of the
+        agents at those indices are recorded.
+        """
+        self.__dtype = np.dtype(dtype).newbyteorder('<')
+        self.__every = every
+        self.__output_writer = output_writer
+        if sample is None:
+            agents = np.arange(num_agents, dtype=np.int64)
+        else:
+            agents = np.unique(np.asarray(sample, dtype=np.int64))
+            self.__sample = agents
+        self.__file = open(path, 'wb')
+        self.__file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(agents), num_agents,
+                                      self.__dtype.str))
+        agents.astype('<i8').tofile(self.__file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_due(self, step):
+        """Check if a column is written for this step"""
+        return step % self.__every == 0
+
+    def append(self, step, states):
+        """Append the states of all agents, ordered by agent index, for a step"""
+        if not self.is_due(step):
+            return
+        # Copy the states, the caller may change them while the column is being written
+        states = np.array(states, dtype=self.__dtype)
+        if self.__sample is not None:
+            states = states[self.__sample]
+        record = struct.pack('<q', step) + states.tostring()
+        if self.__output_writer is not None:
+            self.__output_writer.write(self.__file, record)
+        else:
+            self.__file.write(record)
+
+    def flush(self):
+        """Flush the written columns to disk"""
+        if self.__output_writer is not None:
+            self.__output_writer.call(self.__file.flush)
+            self.__output_writer.flush()
+        else:
+            self.__file.flush()
+
+    def close(self):
+        """Close the state file once all of its columns are written"""
+        if self.__file is not None:
+            if self.__output_writer is not None:
+                self.__output_writer.call(self.__file.close)
+                self.__output_writer.flush()
+            else:
+                self.__file.close()
+            self.__file = None
+
+
+class StateReader:
+    """
+    Memory-mapped reader for a state file written by StateWriter.
+    """
+    __agents = None
+    __records = None
+    __num_agents = None
+
+    def __init__(self, path):
+        """Open a state file"""
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                raise IOError('File ' + path + ' is not a MABM state file.')
+            magic, version, recorded, num_agents, dtype = struct.unpack(HEADER_FORMAT, header)
+            if magic != MAGIC:
+                raise IOError('File ' + path + ' is not a MABM state file.')
+            if version != VERSION:
+                raise IOError('Unsupported state file version ' + str(version) + ' in ' + path)
+            self.__agents = np.fromfile(f, dtype='<i8', count=recorded)
+
+        self.__num_agents = num_agents
+        record = np.dtype([('step', '<i8'), ('states', np.dtype(dtype.rstrip('\0')), (recorded,))])
+        records_at = HEADER_SIZE + 8 * recorded
+        # Only complete records are mapped, a record may be partially written if a run was cut short
+        count = (os.path.getsize(path) - records_at) // record.itemsize
+        if count > 0:
+            self.__records = np.memmap(path, dtype=record, mode='r', offset=records_at, shape=(count,))
+        else:
+            self.__records = np.zeros(0, dtype=record)
+
+    def get_num_agents(self):
+        """Return the number of agents on the process that wrote the file"""
+        return self.__num_agents
+
+    def get_agents(self):
+        """Return the indices of the recorded agents"""
+        return self.__agents
+
+    def get_steps(self):
+        """Return the steps that were written"""
+        return self.__records['step']
+
+    def get_states(self):
+        """Return the recorded states as a (steps, agents) array"""
+        return self.__records['states']
+
+
+def merge_state_output(agent_files, state_files, out_path, column_name):
+    """
+    Merge the per-process agent CSV files and state files into one CSV file.
+
+    Row i of each agent file (after its header line, if any) describes agent i of that process;
+    each output row is the agent row followed by the agent's recorded states. The header is taken
+    from the first agent file that has one, with a column_name_<step> column added for each step.
+    Agents that were not sampled are left out.
+    """
+    with open(out_path, 'w') as out:
+        header_written = False
+        for agent_path, state_path in zip(agent_files, state_files):
+            reader = StateReader(state_path)
+            states = reader.get_states()
+            with open(agent_path, 'r') as f:
+                lines = [line.rstrip('\r\n') for line in f]
+
+            # Files may start with a header line, agent rows follow
+            extra = len(lines) - reader.get_num_agents()
+            if extra > 0 and not header_written:
+                out.write(lines[0] + ''.join(', ' + column_name + '_' + str(step)
+                                             for step in reader.get_steps()) + '\n')
+                header_written = True
+            rows = lines[extra:] if extra > 0 else lines
+
+            # Write the rows one block of agents at a time
+            agents = reader.get_agents()
+            for start in xrange(0, len(agents), 65536):
+                block = np.asarray(states[:, start:start+65536]).T
+                values = block.astype(str)
+                out.write(''.join(rows[agent] + ''.join(',' + v for v in values[i]) + '\n'
+                                  for i, agent in enumerate(agents[start:start+65536])))
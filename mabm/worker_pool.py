@@ -0,0 +1,86 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import mmap
+import itertools
+import multiprocessing
+import multiprocessing.pool
+import numpy as np
+
+# Kernels of all pools by (pool number, name). Forked workers inherit the kernels registered
+# before they were started, so only their names and arguments are sent with each task.
+_kernels = {}
+_pool_numbers = itertools.count()
+
+
+def _run(task):
+    """Run a kernel in a worker"""
+    key, arguments = task
+    return _kernels[key](*arguments)
+
+
+def shared_array(length, dtype):
+    """
+    Return a 1-d array in anonymous shared memory. Worker processes forked after it was created
+    see the values the parent writes into it, and the parent sees theirs.
+    """
+    dtype = np.dtype(dtype)
+    buffer = mmap.mmap(-1, max(length * dtype.itemsize, 1))
+    return np.frombuffer(buffer, dtype=dtype, count=length)
+
+
+def split_chunks(values, chunk_size):
+    """Return a list of consecutive chunks of at most chunk_size values"""
+    return [values[start:start+chunk_size] for start in xrange(0, len(values), chunk_size)]
+
+
+class WorkerPool:
+    """
+    A pool of workers that updates the agents of one process in chunks, so a process can use
+    several cores.
+
+    A kernel is a function of a chunk of work, typically the slots of the agents to update, that
+    reads agent columns and returns the changes to make. It must not change the model itself: with
+    synchronous updates (see mabm.StateBuffer) the agents of a time step are independent, so the
+    chunks can be run in any order and their changes are merged back by the process before the
+    agents are synchronized.
+
+    By default the workers are forked processes. They inherit the model as it was when the pool
+    was created, so the columns a kernel reads and that change later must be in shared memory, see
+    shared_array(). With threads, the workers are threads of the process and see everything, which
+    only pays off for kernels spending their time in NumPy operations that release the GIL. Use
+    threads with MPI implementations that do not support fork().
+    """
+    __number = None
+    __pool = None
+    __workers = None
+
+    def __init__(self, kernels, workers, threads=False):
+        """Register the kernels, a dictionary of name -> function, and start workers workers"""
+        self.__number = next(_pool_numbers)
+        for name, function in kernels.iteritems():
+            _kernels[(self.__number, name)] = function
+        self.__workers = workers
+        if threads:
+            self.__pool = multiprocessing.pool.ThreadPool(workers)
+        else:
+            self.__pool = multiprocessing.Pool(workers)
+
+    def get_num_workers(self):
+        """Return the number of workers"""
+        return self.__workers
+
+    def map(self, name, arguments):
+        """Run a kernel once for each tuple of arguments, returns the results in order"""
+        if not arguments:
+            return []
+        return self.__pool.map(_run, [((self.__number, name), a) for a in arguments], chunksize=1)
+
+    def close(self):
+        """Stop the workers"""
+        if self.__pool is None:
+            return
+        self.__pool.close()
+        self.__pool.join()
+        self.__pool = None
+        for key in [key for key in _kernels if key[0] == self.__number]:
+            del _kernels[key]
@@ -0,0 +1,33 @@
+__author__ = 'jgentile', 'ceharvey'
+
+'''
+Run Instructions
+python network_convert.py network_data/smallworld_1000 network_data/smallworld_1000.csr
+
+Converts a CSV adjacency list, as written by network_generation.py, to the binary
+network format read by mabm.NetworkFile. The tax model detects binary network files
+automatically, pass the converted file as its network_file argument.
+'''
+
+import argparse
+import numpy as np
+import mabm
+
+
+if __name__ == '__main__':
+
+    # Necessary Command Line Arguments
+    parser = argparse.ArgumentParser(description='Convert a CSV adjacency list to a binary network file.')
+    parser.add_argument('csv_file', help="CSV adjacency list, line i holds the neighbors of node i", type=str)
+    parser.add_argument('network_file', help="Binary network file to write", type=str)
+
+    # Option Flags
+    parser.add_argument('-L', '--long', help="Store neighbors as 64 bit integers (default: chosen from the "
+                                             "number of nodes)", action="store_true")
+    args = parser.parse_args()
+
+    mabm.convert_adjacency_csv(args.csv_file, args.network_file, np.int64 if args.long else None)
+
+    network = mabm.NetworkFile(args.network_file)
+    print "Wrote %d nodes and %d edges to %s" % (network.get_num_nodes(), network.get_num_edges(),
+                                                 args.network_file)
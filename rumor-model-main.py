@@ -5,7 +5,7 @@ __author__ = 'jgentile', 'ceharvey'
 Run Instructions
 mpiexec -np num_processors python rumor-model-main.py people_per_processor rumor_prob [options]
 
-mpiexec -np 2 python main.py [-h] [-w] [-l] [-W] [-P] [-a [APPEND]] [-c [CROSS]] [-z [ZIPF]]
+mpiexec -np 2 python main.py [-h] [-w] [-P] [-a [APPEND]] [-c [CROSS]] [-z [ZIPF]]
     number_of_persons rumor_prob
 
 '''
@@ -14,7 +14,6 @@ import rumor_model
 import os
 import psutil
 import sys
-from subprocess import call
 import argparse
 import cProfile
 import numpy.random as npr
@@ -33,7 +32,12 @@ def main():
     Generate a new Rumor model using the command line parameters
     """
     m = rumor_model.Model(args.number_of_persons, args.zipf, args.rumor_prob,
-                          args.cross, args.write, args.notify, args.requests)
+                          args.cross, args.write, args.notify, args.requests, 10 if args.seed else None,
+                          args.write_every, args.collective, args.report_every,
+                          args.probes, args.probe_every, args.scratch, args.resident_blocks, args.adaptive,
+                          args.sync_stats, args.hub_threshold, args.synchronous, args.workers, args.worker_threads,
+                          hierarchical=args.hierarchical, compression=args.compression,
+                          compression_threshold=args.compression_threshold)
 
     # Print out command line arguments
     if m.get_rank == 0:
@@ -46,23 +50,16 @@ def main():
     # Build the model's agents
     m.build_agents(args.notify, args.cross, args.rumor_prob)
 
-    # Write experiment settings to an output file
-    my_file = open('o.txt', 'a')
+    # Write experiment settings to an output file, on the model's output writer thread
     if m.get_rank() == 0:
-        my_file.write(str(sys.argv[1])+','+str(m.get_world_size())+'\n')
+        m.get_output_writer().append('o.txt', str(sys.argv[1])+','+str(m.get_world_size())+'\n')
 
-    my_file.close()
-
-    # Run the model!
-    m.run()
-
-    # If file writing is turned on, have the root node run the appropriate scripts to
-    # concatenate the files if option is on.
-    if m.get_rank() == 0 and args.write:
-        if args.Linux:
-            call(['./fix_output.sh'])
-        if args.Windows:
-            call(['fix_output.bat'])
+    # Run the model! With file writing on, the output is merged into final_agents.csv at the end of the run.
+    if args.conservative:
+        m.run_conservative(args.conservative)
+    else:
+        m.run()
+    m.get_output_writer().close()
 
 # TODO: Remove this method if unnecessary
 def run_model(model):
@@ -79,11 +76,30 @@ if __name__ == '__main__':
     # Option Flags
     parser.add_argument('-w', '--write', help="Write output files for agent knowledge and values",
                         action="store_true")
-    parser.add_argument('-l', '--Linux', help="Concatenate output files using Shell Script",
+    parser.add_argument('-r', '--requests', help="Use requests System",
                         action="store_true")
-    parser.add_argument('-W', '--Windows', help="Concatenate output files using Batch Script",
+
+    parser.add_argument('--adaptive', help="Switch each agent between requests and watches, whichever sends "
+                                           "fewer bytes", action="store_true")
+    parser.add_argument('--hub-threshold', help="Replicate the agents with at least HUB_THRESHOLD neighbors on "
+                                                "every processor", type=int, default=None)
+    parser.add_argument('--synchronous', help="Update the agents synchronously, every agent sees its neighbors' "
+                                              "states of the previous time step", action="store_true")
+    parser.add_argument('--workers', help="With --synchronous, update the agents of each processor in chunks in "
+                                          "WORKERS worker processes", type=int, default=0)
+    parser.add_argument('--worker-threads', help="Use threads rather than processes as workers",
                         action="store_true")
-    parser.add_argument('-r', '--requests', help="Use requests System",
+    parser.add_argument('--conservative', help="Run up to time step CONSERVATIVE without global synchronization, "
+                                               "as a conservative parallel discrete-event simulation (watches only)",
+                        type=int, default=None)
+    parser.add_argument('--hierarchical', help="Combine the synchronization messages on each node before sending "
+                                               "them between nodes, simulating nodes of HIERARCHICAL processors "
+                                               "if given", nargs='?', const=0, type=int, default=None)
+    parser.add_argument('--compression', help="Compress large synchronization messages with this codec",
+                        choices=['zlib', 'varint', 'delta', 'delta-zlib'], default=None)
+    parser.add_argument('--compression-threshold', help="With --compression, compress the messages of at least "
+                                                        "COMPRESSION_THRESHOLD bytes", type=int, default=4096)
+    parser.add_argument('--sync-stats', help="Report the bytes sent to synchronize agents at the end of the run",
                         action="store_true")
 
     parser.add_argument('-s', '--seed', help="Use a seed for random numbers for the model",
@@ -97,10 +113,33 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--notify', help="Give notifications after a certain number of agents"
                                                "have been created on the processor",
                         nargs='?', const=500000, type=int, default=500000)
-    parser.add_argument('-z', '--zipf', help="Parameter for the zipf distribution to determine the number"
-                                             "of neighbors a person will have",
-                        nargs='?', const=3, type=float, default=3)
+    parser.add_argument('--collective', help="Write output into files shared by all processors with MPI-IO",
+                        action="store_true")
+    parser.add_argument('--write-every', help="Write the agent states every WRITE_EVERY time steps",
+                        nargs='?', const=1, type=int, default=1)
+    parser.add_argument('--scratch', help="Keep the agents' states and neighbors out of core in memory-mapped "
+                                          "files in this local scratch directory (the agents themselves stay "
+                                          "in memory)", type=str, default=None)
+    parser.add_argument('--resident-blocks', help="With --scratch, the number of blocks of 65536 agent states "
+                                                  "kept in memory", type=int, default=64)
+    parser.add_argument('--probes', help="Write the model's probes to this CSV time series file",
+                        nargs='?', const='probes.csv', type=str, default=None)
+    parser.add_argument('--probe-every', help="Evaluate the probes every PROBE_EVERY time steps",
+                        nargs='?', const=1, type=int, default=1)
+    parser.add_argument('--report-every', help="Report the rumor saturation every REPORT_EVERY time steps",
+                        nargs='?', const=1, type=int, default=1)
+    parser.add_argument('-z', '--zipf', help="Parameter for the zipf distribution to determine the number "
+                                             "of neighbors a person will have, every person has 2 neighbors "
+                                             "if not given",
+                        nargs='?', const=3, type=float, default=None)
 
     args = parser.parse_args()
 
+    # The conservative mode exchanges the states of watched agents point to point
+    if args.conservative is not None:
+        if args.requests or args.adaptive:
+            parser.error("--conservative requires watches, it can not be used with -r or --adaptive")
+        if args.hub_threshold:
+            parser.error("--conservative can not be used with --hub-threshold")
+
     main()
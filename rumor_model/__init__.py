@@ -3,4 +3,5 @@ __author__ = 'jgentile'
 from model import Model
 from person_list import PersonList
 from person import Person
+from stored_person import StoredPerson
 from person_form import PersonForm
\ No newline at end of file
@@ -2,11 +2,13 @@ __author__ = 'jgentile', 'ceharvey'
 
 import rumor_model
 import mabm
+import numpy as np
 import numpy.random as npr
 from numpy import arange
-import shutil
 from mpi4py import MPI
 import sys
+import cStringIO
+import os
 
 
 class Model(mabm.Model):
@@ -21,13 +23,18 @@ class Model(mabm.Model):
     __container = None
 
     def __init__(self, number_of_persons, zipf_param, p_knowledge, p_cross_processes, write_file=False,
-                 notify=False, requests=False):
+                 notify=False, requests=False, seed=None, write_every=1,
+                 collective_output=False, report_every=1, probe_file=None, probe_every=1, scratch=None,
+                 resident_blocks=64, adaptive=False, sync_stats=False, hub_threshold=None, synchronous=False,
+                 workers=0, worker_threads=False, chunk_size=4096, hierarchical=None,
+                 compression=None, compression_threshold=4096):
         """
         Initialize the Rumor Model.
 
         Parameters:
             number_of_persons: number of agents per processor
-            zipf_param: parameter that determines number of neighbors per person. (NOT IN USE)
+            zipf_param: parameter of the Zipf distribution that determines the number of neighbors
+                per person, each person has 2 neighbors if not set
             p_knowledge: probability that an agent knows the rumor at the initalization
                 of the model
             p_cross_processes: probability of an "neighbor" agent being located on a foreign
@@ -35,16 +42,56 @@ class Model(mabm.Model):
             write_file: write agent state and connection output to a file
             notify: print notifications about the number of steps completed
             requests: use the requests method for communication
+            seed: seed for the network generation, drawn by the root processor if not set
+            write_every: with write_file, write the agent states every write_every time steps
+            collective_output: with write_file, all processors write into shared files
+                (agents.csv, network.csv and states.bin) with MPI-IO instead of per-processor files
+            report_every: report the saturation every report_every time steps
+            probe_file: if set, write the degree-weighted saturation to this CSV time series
+            probe_every: evaluate the probes every probe_every time steps
+            scratch: if set, keep the persons' states and neighbors out of core in memory-mapped files
+                in this (local scratch) directory, and update the persons in storage order. The persons
+                themselves remain in memory as small rumor_model.StoredPerson objects
+            resident_blocks: with scratch, number of blocks of states kept in memory
+            adaptive: switch each person between requests and watches, whichever costs fewer bytes
+            sync_stats: count the bytes of the synchronization messages and report them at the end of the run
+            hub_threshold: if set, persons with at least hub_threshold neighbors are replicated on every
+                processor instead of being watched or requested, see mabm.Model.replicate_elements()
+            synchronous: update the persons synchronously, every person sees the states of all its neighbors
+                as of the previous time step (see mabm.StateBuffer), so the results do not depend on the
+                activation order or on the placement of the persons. The initial knowledge and the hearing of
+                the rumor are drawn from streams seeded by (seed, person), and with pxp < 0 so is the network,
+                so the run is the same for any number of processors and workers. Not available with scratch.
+            workers: with synchronous, update the persons of each time step in chunks of chunk_size in a
+                pool of this many worker processes, see mabm.WorkerPool
+            worker_threads: use threads rather than processes as workers
+            chunk_size: number of persons updated by a worker at a time
+            hierarchical: if set, combine the synchronization messages on each node before exchanging them
+                between nodes (see mabm.HierarchicalComm). Nodes are the processors sharing memory if 0,
+                otherwise groups of this many consecutive processors.
+            compression: if set, compress the synchronization messages of at least compression_threshold bytes
+                with this codec of mabm.Compressor ('zlib', 'varint', 'delta' or 'delta-zlib')
         """
 
         # Call the MABM module to initiate the model
-        self.initialize_model(not requests)
+        self.initialize_model(not requests, adaptive, hierarchical=hierarchical is not None,
+                              ranks_per_node=hierarchical)
+        if sync_stats:
+            self.set_sync_instrumentation()
+        if compression:
+            self.set_compression(compression, compression_threshold)
 
         # Create the container for persons
         self.__container = rumor_model.PersonList()
 
-        # Create the element ID dictionary
-        eid_gen_dict = {0: [rumor_model.Person, rumor_model.PersonForm]}
+        if scratch and synchronous:
+            raise ValueError('Synchronous updates are not available for out of core persons.')
+        if workers and not synchronous:
+            raise ValueError('Workers require synchronous updates.')
+
+        # Create the element ID dictionary, out of core and synchronously updated persons are StoredPersons
+        self.person_class = rumor_model.StoredPerson if scratch or synchronous else rumor_model.Person
+        eid_gen_dict = {0: [self.person_class, rumor_model.PersonForm]}
         self.set_element_id_generator(eid_gen_dict)
 
         # Compile a list of processes and of other processes
@@ -55,134 +102,265 @@ class Model(mabm.Model):
         self.pxp = p_cross_processes
         self.notify = notify
         self.p_knowledge = p_knowledge
-        self.watches = not requests
+        self.watches = not requests and not adaptive
+        self.sync_stats = sync_stats
+        self.hub_threshold = hub_threshold
         self.number_of_persons = number_of_persons
         self.write_file = write_file
-        self.knowledge_total = 0
+        self.write_every = write_every
+        self.collective_output = collective_output
+        self.zipf_param = zipf_param
+        self.scratch = scratch
+        self.synchronous = synchronous
+        self.workers = workers
+        self.worker_threads = worker_threads
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.persons = None
+        self.resident_blocks = resident_blocks
+        self.store = None
+        self.neighbor_file = None
+
+        # All processors must generate the network from the same seed
+        if seed is None:
+            seed = npr.randint(2**31) if self.get_rank() == 0 else None
+            seed = self.__mabm_comm.bcast(seed, root=0)
+        self.seed = seed
+
+        # The number of persons knowing the rumor is kept up to date as persons hear it,
+        # and only reduced across processors when the saturation is reported
+        self.register_aggregate(0, 'knowledge_total', mabm.SumAggregate())
+        self.set_report_interval(report_every)
+
+        # A person hearing the rumor affects its neighbors from the next time step on
+        self.set_lookahead(0, 1)
+
+        # Probe of the saturation weighted by the number of neighbors
+        if probe_file:
+            self.add_probe(mabm.WeightedMeanProbe(
+                'degree_weighted_saturation', lambda model: model.__container.get_states(),
+                lambda model: model.__container.get_column(lambda person: len(person.get_neighbors())),
+                probe_every))
+            self.set_probe_file(probe_file)
+
+    def create_persons(self, offsets, neighbors):
+        """
+        Create all of the agents on this processor in one batch. Agent i gets the neighbors
+        neighbors[offsets[i]:offsets[i+1]], given as global agent numbers.
+        """
 
-    def create_agent(self, my_id):
+        # Generate random probabilities which determine rumor knowledge, with synchronous updates from the
+        # persons' own streams so the initial knowledge does not depend on the number of processors
+        if self.synchronous:
+            first = self.get_rank()*self.number_of_persons
+            draws = mabm.hash_uniform(self.seed, np.arange(first, first + self.number_of_persons, dtype=np.int64), 7)
+        else:
+            draws = npr.random(self.number_of_persons)
+        knowledge = (draws < self.p_knowledge).astype(int)
+
+        # Create the persons. Only those who do not know the rumor yet are scheduled.
+        if self.person_class is rumor_model.StoredPerson:
+            # Stored persons find their states and neighbors in the store and the neighbor file by slot. The
+            # store is out of core, or double-buffered for synchronous updates.
+            if self.scratch:
+                self.store = mabm.ColumnStore(self.scratch, 'persons' + str(self.get_rank()), self.number_of_persons,
+                                              self.resident_blocks)
+            else:
+                self.store = mabm.StateBuffer(self.number_of_persons,
+                                              shared=self.workers > 0 and not self.worker_threads)
+                self.add_state_buffer(self.store)
+            self.store.add_column('state', np.int8, knowledge)
+            persons = self.create_agents(rumor_model.StoredPerson, self.number_of_persons, schedule=False,
+                                         slot=np.arange(self.number_of_persons))
+            self.set_activation_order(rumor_model.StoredPerson.get_slot)
+        else:
+            persons = self.create_agents(rumor_model.Person, self.number_of_persons, schedule=False, state=knowledge)
+        self.add_events(0, [p for p, k in zip(persons, knowledge.tolist()) if k == 0])
+        if self.workers:
+            self.persons = persons
+
+        # Add the persons to the container and the aggregates
+        self.__container.add_elements(persons)
+        self.add_states_to_aggregates(0, knowledge)
+
+        # Add neighbors to each person, stored persons read them from the neighbor file
+        if self.person_class is rumor_model.Person:
+            # Compute the neighbors' numbers and processors from their global numbers
+            numbers = (neighbors % self.number_of_persons).tolist()
+            processes = (neighbors // self.number_of_persons).tolist()
+            offsets = offsets.tolist()
+            for i, p in enumerate(persons):
+                for j in xrange(offsets[i], offsets[i+1]):
+                    p.add_neighbor(mabm.ElementID(0, numbers[j], processes[j]))
+
+        # Write information out to the files, one block of persons at a time
+        if self.write_file:
+            output = self.get_output_writer()
+            rank = str(self.get_rank())
+            knowledge = knowledge.tolist()
+            for start in xrange(0, len(persons), 65536):
+                block = persons[start:start+65536]
+                output.write(self.neighbors_file, ''.join(str(p.get_element_id()) + ';' + str(neighbor) + '\n'
+                                                          for p in block for neighbor in p.get_neighbors()))
+                output.write(self.agents_file, ''.join(str(p.get_element_id()) + ',' + str(p.get_element_id()) + ',' +
+                                                       rank + ',' + str(k) + '\n'
+                                                       for p, k in zip(block, knowledge[start:start+65536])))
+
+    def start_workers(self, network):
         """
-        Function to create a single agent in the model
+        Start the pool of workers updating the persons in chunks, see update_persons(). The neighbors of
+        the persons index one column of states: the states of this processor's persons followed by those
+        of the copies of their foreign neighbors.
         """
+        n = self.number_of_persons
+        offsets, neighbors = network.get_csr()
+        neighbors = np.asarray(neighbors, dtype=np.int64)
+        ghosts = network.get_ghosts()
+        first = network.get_first()
+        local = (neighbors >= first) & (neighbors < first + n)
+        self.neighbor_index = np.where(local, neighbors - first, n + np.searchsorted(ghosts, neighbors))
+        self.neighbor_offsets = np.asarray(offsets, dtype=np.int64)
+        self.ghost_ids = [mabm.ElementID(0, number, process).serialize()
+                          for number, process in zip((ghosts % n).tolist(), (ghosts // n).tolist())]
+
+        # Forked workers read the states from shared memory
+        if self.worker_threads:
+            self.neighbor_states = np.zeros(n + len(ghosts))
+        else:
+            self.neighbor_states = mabm.shared_array(n + len(ghosts), np.float64)
+        self.pool = mabm.WorkerPool({'hear': self.hear_rumor}, self.workers, self.worker_threads)
+        self.set_bucket_update(self.update_persons)
 
-        # Generate the eid of this agent
-        eid = self.get_new_element_id(rumor_model.Person)
+    def update_persons(self, time, persons):
+        """
+        Update the persons scheduled at a time step in chunks in the pool of workers, and merge the
+        persons who heard the rumor back into the model.
+        """
+        n = self.number_of_persons
+        directory = self.__mabm_element_directory
+        self.neighbor_states[:n] = self.store.get_column('state')
+        self.neighbor_states[n:] = [directory.get_element(eid).get_state() if directory.has_id(eid) else 0
+                                    for eid in self.ghost_ids]
+
+        slots = np.sort(np.array([p.get_slot() for p in persons], dtype=np.int64))
+        results = self.pool.map('hear', [(time, chunk) for chunk in mabm.split_chunks(slots, self.chunk_size)])
+        if not results:
+            return
+
+        # Merge the changes back before the persons are synchronized
+        heard = np.concatenate([result[0] for result in results])
+        waiting = np.concatenate([result[1] for result in results])
+        self.store.set_many('state', heard, 1)
+        for slot in heard.tolist():
+            eid = self.persons[slot].get_element_id()
+            self.element_state_change(eid)
+            self.update_aggregates(eid, 0, 1)
+        self.add_events(time + 1, [self.persons[slot] for slot in waiting.tolist()])
+
+    def hear_rumor(self, time, slots):
+        """
+        Kernel of the workers: returns the slots of the persons of a chunk who hear the rumor and of
+        those who will try again at the next time step, as rumor_model.StoredPerson.update() decides.
+        """
+        states = self.neighbor_states
+        starts = self.neighbor_offsets[slots]
+        degrees = self.neighbor_offsets[slots + 1] - starts
+
+        # Count the neighbors knowing the rumor from the positions of the chunk's neighbors
+        ends = np.cumsum(degrees)
+        positions = np.arange(ends[-1]) - np.repeat(ends - degrees, degrees) + np.repeat(starts, degrees)
+        knows = np.bincount(np.repeat(np.arange(len(slots)), degrees), states[self.neighbor_index[positions]],
+                            len(slots))
+        probability = knows / np.maximum(degrees, 1)
+
+        # Every person draws from its own stream, so the results do not depend on the chunks or the workers
+        hears = self.draw_hearing(time, slots) <= probability
+        waiting = (states[slots] == 0) & (degrees > 0)
+        return slots[waiting & hears], slots[waiting & ~hears]
+
+    def draw_hearing(self, time, slots):
+        """
+        Return the uniform draws deciding if the persons at slots hear the rumor at a time step, with
+        synchronous updates. The draws are seeded by (seed, person, time) like the network, so they are the
+        same for any chunks, workers or number of processors.
+        """
+        persons = self.get_rank()*self.number_of_persons + np.asarray(slots, dtype=np.int64)
+        return mabm.hash_uniform(self.seed, np.atleast_1d(persons), 6, time)
 
-        # Generate a random probability which determines rumor knowledge
-        if npr.random() < self.p_knowledge:
-            knowledge = 1
-            self.knowledge_total += 1
+    def max_zipf_degree(self):
+        """
+        Return the largest number of neighbors drawn from the Zipf distribution. Neighbors are drawn on this
+        processor with probability 1 - pxp and on the others with probability pxp, and repeated neighbors are
+        drawn again. Degrees are capped so each of these groups is expected to receive at most half of its
+        agents, otherwise drawing the last distinct neighbors would take about as many draws as there are
+        agents, or never end when a group is too small.
+        """
+        size = self.get_world_size()
+        local = self.number_of_persons - 1
+        foreign = self.number_of_persons*(size - 1)
+
+        # The agents a neighbor can be drawn from, and the probability of drawing from them
+        if size == 1 or self.pxp == 0:
+            groups = [(local, 1.0)]
+        elif self.pxp < 0:
+            groups = [(local + foreign, 1.0)]
+        elif self.pxp >= 1:
+            groups = [(foreign, 1.0)]
         else:
-            knowledge = 0
+            groups = [(local, 1.0 - self.pxp), (foreign, self.pxp)]
 
-        # Create the person and randomly select a number of neighbors
-        p = rumor_model.Person(eid, knowledge, self)
-        # TODO: Implement social networks
-        num_of_neighbors = 2
+        # Keep at least one neighbor if there is anyone to draw
+        limit = int(min(agents / probability for agents, probability in groups) / 2)
+        return max(limit, min(1, sum(agents for agents, probability in groups)))
 
-        # Error checking to make sure no one has more neighbors than people available
-        possible_neighbors = self.number_of_persons*self.get_world_size() - 1
-        if num_of_neighbors > possible_neighbors:
-            num_of_neighbors = possible_neighbors
+    def generate_neighbors(self):
+        """
+        Generate the neighbors of the agents on this processor, as (degrees, neighbors) where neighbors
+        holds the global agent numbers (process * number_of_persons + number) of all agents' neighbors.
 
-        # Create empty trackers for the neighbors to be added to the agent
-        my_neighbor_list = set()
-        neighbors_list = ""
+        The number of neighbors is drawn from a Zipf distribution with parameter zipf_param, capped by
+        max_zipf_degree(), or is 2 if zipf_param is not set. All draws come from streams seeded by
+        (seed, agent), so no processor needs the random numbers of another. If pxp < 0 every agent is
+        equally likely to be a neighbor and the network is the same for any number of processors.
+        """
+        size = self.get_world_size()
+        first = self.get_rank()*self.number_of_persons
+        nodes = np.arange(first, first + self.number_of_persons, dtype=np.int64)
+
+        # Error checking to make sure no one has more neighbors than people available
+        possible_neighbors = self.number_of_persons*size - 1
+        if self.pxp >= 0 and size == 1:
+            possible_neighbors = self.number_of_persons - 1
+        if self.zipf_param:
+            degrees = mabm.zipf_degrees(self.seed, nodes, self.zipf_param, self.max_zipf_degree())
+        else:
+            degrees = np.repeat(min(2, possible_neighbors), len(nodes))
 
         # If pxp < 0, all agents in system have equal probability of becoming a neighbor.
         if self.pxp < 0:
-            # Compute the agent's number: rank * persons_per_processor + id
-            me = self.get_rank()*self.number_of_persons + my_id
-
-            # While the length of my_neighbor_list < the number of neighbord desired, continue to
-            # add neighbors to the list.
-            while len(my_neighbor_list) < num_of_neighbors:
-                # Generate a random number from all possible neighbors
-                new_neighbor = npr.randint(possible_neighbors)
-
-                # If this new number is >= the me number, increment by 1 to avoid choosing
-                # oneself as the neighbor
-                if new_neighbor >= me:
-                    new_neighbor += 1
-
-                # Compute the neighbor number by finding the id on the processor
-                neighbor_number = new_neighbor % self.number_of_persons
-
-                # Compute the processor by dividing by the number of persons
-                # Integer division helps to compute this number
-                neighbor_process = new_neighbor / self.number_of_persons
-
-                # Generate the element_id of the new neighbor
-                new_neighbor_eid = mabm.ElementID(0, neighbor_number, neighbor_process)
-
-                # If the neighbor is on a foreign processor, add watches or requests as necessary
-                if neighbor_process != self.get_rank():
-                    if self.watches:
-                        # Add element watch to the neighbor
-                        self.request_element_watch(new_neighbor_eid)
-                        self.add_watching(new_neighbor_eid)
-                    else:
-                        # Requests Version
-                        self.request_element(new_neighbor_eid)
-                # Add the neighbor to the list
-                my_neighbor_list.add(new_neighbor_eid)
+            return degrees, mabm.random_neighbors(self.seed, nodes, degrees, possible_neighbors + 1)
 
         # For simulations with a specific pxp assigned
-        else:
-            # While the length of my_neighbor_list < the number of neighbord desired, continue to
-            # add neighbors to the list.
-            while len(my_neighbor_list) < num_of_neighbors:
-                # Determine if the neighbor will be on a foreign process
-                if npr.random() <= self.pxp:
-                    # Create a neighbor on a foreign process
-
-                    # Select a processor from the available other processors
-                    value = npr.randint(0, self.get_world_size()-1)
-                    neighbor_process = self.other_processes[value]
-                    # Randomly generate the birth order of the neighbor
-                    neighbor_number = npr.randint(0, self.number_of_persons)
-                    foreign_neighbor = True
-                else:
-                    # Neighbor is local
-                    neighbor_process = self.get_rank()
-
-                    # Randomly pick a birth order number for the new neighbor
-                    neighbor_number = npr.randint(0, self.number_of_persons - 1)
-                    foreign_neighbor = False
-
-                    # Error-checking code so you can't pick yourself as a neighbor
-                    if neighbor_number >= my_id:
-                        neighbor_number += 1
-
-                # Compute the eid of the new neighbor
-                new_neighbor_eid = mabm.ElementID(0, neighbor_number, neighbor_process)
-
-                # If the neighbor is on a foreign process, add appropriate requests or watches
-                if foreign_neighbor:
-                    if self.watches:
-                        # Add element watch to the neighbor
-                        self.request_element_watch(new_neighbor_eid)
-                        self.add_watching(new_neighbor_eid)
-                    else:
-                        # Requests Version
-                        self.request_element(new_neighbor_eid)
-                # Add the neighbor to the lis
-                my_neighbor_list.add(new_neighbor_eid)
-
-        # Add neighbors from list to person's neighbors
-        for neighbor in my_neighbor_list:
-            p.add_neighbor(neighbor)
-            if self.write_file:
-                neighbors_list += str(eid) + ';' + neighbor + '\n'
-
-        # Write information out to the file
-        if self.write_file:
-            self.neighbors_file.write(neighbors_list)
-            self.agents_file.write(str(eid)+','+str(eid)+','+str(self.get_rank())+','+str(knowledge)+'\n')
-
-        # Add element to directory and the container.
-        self.add_element_to_directory(p)
-        self.__container.add_element(p)
+        def draw(owners, slots, attempt):
+            # Determine if the neighbor will be on a foreign process
+            foreign = mabm.hash_uniform(self.seed, owners, 3, slots, attempt) <= self.pxp
+            if size == 1:
+                foreign[:] = False
+            u = mabm.hash_uniform(self.seed, owners, 4, slots, attempt)
+
+            # Foreign neighbors: select one of the other processors and a birth order number on it
+            other = (u * (size - 1)).astype(np.int64)
+            process = other + (other >= self.get_rank())
+            number = (mabm.hash_uniform(self.seed, owners, 5, slots, attempt) * self.number_of_persons).astype(np.int64)
+            targets = process * self.number_of_persons + number
+
+            # Local neighbors: randomly pick another birth order number on this processor
+            local = first + (u * (self.number_of_persons - 1)).astype(np.int64)
+            local[local >= owners] += 1
+            targets[~foreign] = local[~foreign]
+            return targets
+
+        return degrees, mabm.random_neighbors(self.seed, nodes, degrees, possible_neighbors + 1, draw)
 
     def build_agents(self, notify, pxp, p_knowledge):
         """
@@ -191,61 +369,139 @@ class Model(mabm.Model):
 
         # File setup if write command is turned on
         if self.write_file:
-            filename = 'node_network'+str(self.get_rank())+'.csv'
-            self.neighbors_file = open(filename,'w')
-            filename = 'node_agents'+str(self.get_rank())+'.csv'
-            self.agents_file = open(filename,'w')
+            if self.collective_output:
+                # Rows are kept in memory and written to the shared files once all agents are built
+                self.neighbors_file = cStringIO.StringIO()
+                self.agents_file = cStringIO.StringIO()
+            else:
+                filename = 'node_network'+str(self.get_rank())+'.csv'
+                self.neighbors_file = open(filename,'w')
+                filename = 'node_agents'+str(self.get_rank())+'.csv'
+                self.agents_file = open(filename,'w')
             if self.get_rank() == 0:
                 self.agents_file.write('ID, Label, Process, Knows_Rumor_Init\n')
                 self.neighbors_file.write('Source;Target\n')
 
-        # Create each agent that is needed per processor
-        for i in arange(0, self.number_of_persons):
-            self.create_agent(i)
-
-        # File close and clean-up
-        if self.write_file:
-            self.neighbors_file.close()
-            self.agents_file.close()
-
-        # Reduce the calculations from all processors to a single number
-        KNOWLEDGE_TOTAL = self.__mabm_comm.reduce(self.knowledge_total, MPI.SUM, root=0)
+        # Every processor generates the neighbors of its own agents, see generate_neighbors()
+        degrees, neighbors = self.generate_neighbors()
+        offsets = np.zeros(self.number_of_persons + 1, dtype=np.int64)
+        np.cumsum(degrees, out=offsets[1:])
+
+        # Out of core, the neighbors are moved to a memory-mapped network file on scratch
+        if self.scratch:
+            if not os.path.isdir(self.scratch):
+                os.makedirs(self.scratch)
+            filename = os.path.join(self.scratch, 'neighbors' + str(self.get_rank()) + '.csr')
+            with mabm.NetworkWriter(filename, np.int64) as writer:
+                writer.add_nodes(degrees, neighbors)
+            del degrees, neighbors
+            self.neighbor_file = mabm.NetworkFile(filename)
+            offsets, neighbors = self.neighbor_file.get_slice(0, self.number_of_persons)
+
+        # Synchronously updated persons find their neighbors in the in-memory network instead
+        network = None
+        if self.watches or self.hub_threshold or self.synchronous:
+            network = mabm.DistributedNetwork(self.__mabm_comm, self.number_of_persons, offsets, neighbors)
+        if self.synchronous:
+            self.neighbor_file = network
+
+        # Create all agents that are needed per processor
+        self.create_persons(offsets, neighbors)
+
+        # Watch the neighbors located on foreign processors. The requests version requests
+        # them from the scheduled agents at every time step instead. Persons with at least
+        # hub_threshold neighbors are replicated on every processor, neither watched nor requested.
+        if network is not None:
+            if self.hub_threshold:
+                hubs = self.add_network_hubs(0, network, self.hub_threshold)
+                if self.get_rank() == 0:
+                    print "Replicated hubs: \t", hubs
+            if self.watches:
+                self.add_network_watches(0, network)
+
+        # Start the workers once the columns they read exist
+        if self.workers:
+            self.start_workers(network)
+
+        # Write the shared files, each processor writes its rows at an offset from an exclusive scan
+        if self.write_file and self.collective_output:
+            self.flush_output()
+            mabm.write_shared_text(self.__mabm_comm, 'network.csv', self.neighbors_file.getvalue())
+            mabm.write_shared_text(self.__mabm_comm, 'agents.csv', self.agents_file.getvalue())
+            self.state_writer = mabm.SharedStateWriter(self.__mabm_comm, 'states.bin', self.number_of_persons,
+                                                       np.int8, self.write_every)
+
+        # File close and clean-up, once the queued output is written
+        elif self.write_file:
+            self.get_output_writer().call(self.neighbors_file.close)
+            self.get_output_writer().call(self.agents_file.close)
+
+            # Agent states are appended as one binary column per time step
+            filename = 'node_states'+str(self.get_rank())+'.bin'
+            self.state_writer = mabm.StateWriter(filename, self.number_of_persons, np.int8, self.write_every,
+                                                 output_writer=self.get_output_writer())
+
+        # Reduce the aggregates from all processors
+        totals = self.reduce_aggregates()
         POPULATION = self.number_of_persons*self.get_world_size()
         if self.get_rank() == 0:
+            KNOWLEDGE_TOTAL = int(totals['knowledge_total'])
             saturation = KNOWLEDGE_TOTAL/float(POPULATION)
             print "Initial Saturation: \t %d/%d \t = %0.4f" %\
                   (KNOWLEDGE_TOTAL, POPULATION, saturation)
     
     def post_update_model(self):
         """
-        Update the model and report the current saturation rate of the rumor on this process.
+        Update the model and report the current saturation rate of the rumor every report_every time steps.
         """
-        if self.write_file:
-            self.knowledge_total = 0
-            filename_old = 'node_agents'+str(self.get_rank())+'.csv'
-            original_agents_file = open(filename_old, 'r')
-            filename_new = 'final_agents'+str(self.get_rank())+'.csv'
-            agents_new_file = open(filename_new, 'w')
-            if self.get_rank() == 0:
-                line = next(original_agents_file)
-                agents_new_file.write(line.rstrip()+', Knows_Rumor_'+str(self.__mabm_time)+'\n')
-
-            i = 0
-            for line in original_agents_file:
-                eid = mabm.ElementID(0, i, self.get_rank())
-                knowledge = self.__container.send_element_state(eid)
-                agents_new_file.write(line.rstrip()+','+str(knowledge)+'\n')
-                self.knowledge_total += knowledge
-                i += 1
-
-            agents_new_file.close()
-            original_agents_file.close()
-            shutil.move(filename_new, filename_old)
-
-        # Reduce the calculations from all processors to a single number
-        # Reduce the calculation to a single point
-        KNOWLEDGE_TOTAL = self.__mabm_comm.reduce(self.knowledge_total, MPI.SUM, root=0)
+        if self.write_file and self.state_writer.is_due(self.__mabm_time):
+            # Append this step's column of agent states, out of core they are read from the store
+            if self.store is not None:
+                self.state_writer.append(self.__mabm_time, self.store.get_column('state'))
+            else:
+                self.state_writer.append(self.__mabm_time, self.__container.get_states(int))
+
+        if not self.is_report_due():
+            return
+
+        # Reduce the aggregates from all processors to the root
+        totals = self.reduce_aggregates()
         POPULATION = self.number_of_persons*self.get_world_size()
         if self.get_rank() == 0:
+            KNOWLEDGE_TOTAL = int(totals['knowledge_total'])
             saturation = KNOWLEDGE_TOTAL/float(POPULATION)
             print "Time %d Saturation: \t %d/%d \t = %0.4f"%(self.__mabm_time, KNOWLEDGE_TOTAL, POPULATION, saturation)
+
+    def finalize_model(self):
+        """
+        Close the output files and have the root processor merge them into final_agents.csv. Shared
+        output files are complete once closed and are not merged. Out of core files are removed.
+        """
+        if self.write_file and self.collective_output:
+            self.state_writer.close()
+        elif self.write_file:
+            self.state_writer.close()
+            self.__mabm_comm.Barrier()
+            if self.get_rank() == 0:
+                size = self.get_world_size()
+                mabm.merge_state_output(['node_agents'+str(i)+'.csv' for i in range(size)],
+                                        ['node_states'+str(i)+'.bin' for i in range(size)],
+                                        'final_agents.csv', 'Knows_Rumor')
+
+        # Report the bytes sent to synchronize the persons
+        if self.sync_stats:
+            statistics = self.reduce_sync_statistics()
+            if self.get_rank() == 0:
+                print "Synchronization: \t " + ", ".join(key + " = " + str(statistics[key])
+                                                         for key in sorted(statistics))
+                if statistics.get('raw_bytes'):
+                    print "Compression ratio: \t " + str(float(statistics['compressed_bytes']) /
+                                                         statistics['raw_bytes'])
+
+        # Remove the out of core files from scratch
+        if self.pool is not None:
+            self.pool.close()
+        if self.store is not None:
+            self.store.close()
+        if self.scratch:
+            os.remove(self.neighbor_file.get_path())
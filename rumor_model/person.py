@@ -15,14 +15,16 @@ class Person(mabm.Agent):
 
     __slots__ = ['__state', '__neighbors']
 
-    def __init__(self, eid, state, model):
+    def __init__(self, eid, state, model, schedule=True):
 
         mabm.Agent.__init__(self, model, None, eid)
         self.__state = state
         self.__neighbors = []
 
-        #Adds an event (time step) to the model for every person added
-        self.add_event(0)
+        #Adds an event (time step) to the model for every person added, unless the
+        # model schedules the persons in a batch
+        if schedule:
+            self.add_event(0)
 
     def add_event(self, time):
         """
@@ -50,6 +52,19 @@ class Person(mabm.Agent):
         Add a neighbor to a person
         """
         self.__neighbors.append(eid)
+        self.get_model().add_ghost_reference(eid)
+
+    def remove_neighbor(self, eid):
+        """
+        Remove a neighbor from a person, the model evicts its copy of a foreign neighbor
+        once no person on this processor has it as a neighbor
+        """
+        serialized = eid.serialize()
+        for i, neighbor in enumerate(self.__neighbors):
+            if neighbor.serialize() == serialized:
+                del self.__neighbors[i]
+                self.get_model().remove_ghost_reference(eid)
+                return
 
     def get_neighbors(self):
         """
@@ -105,7 +120,7 @@ class Person(mabm.Agent):
                 #  model checks to see if the element has an associated watch
                 # ... if so broadcast at next sync time step
                 model.element_state_change(eid)
-                model.knowledge_total += 1
+                model.update_aggregates(eid, 0, 1)
 
             # Person will repeat update process at the next timestep
             else:
@@ -0,0 +1,136 @@
+__author__ = 'jgentile', 'ceharvey'
+
+import mabm
+import numpy.random as npr
+
+
+class StoredPerson(mabm.Agent):
+    """
+    A Person whose state and neighbors are kept in columns, for models run with a scratch directory
+    or with synchronous updates.
+
+    A StoredPerson only holds its slot: its state is in the 'state' column of the model's store, and
+    its neighbors are those of node number slot in the model's neighbor file, given as global agent
+    numbers. Out of core, the store is a mabm.ColumnStore and the neighbor file a memory-mapped
+    mabm.NetworkFile. With synchronous updates, the store is a mabm.StateBuffer, so the person reads
+    the states of the previous time step, and the neighbor file the mabm.DistributedNetwork.
+    It behaves like rumor_model.Person. Its neighbors and state take no memory, but the person itself,
+    its ElementID and its entries in the model's directory, container and scheduler do.
+    """
+
+    __slots__ = ['__slot']
+
+    def __init__(self, eid, slot, model, schedule=True):
+
+        mabm.Agent.__init__(self, model, None, eid)
+        self.__slot = slot
+
+        #Adds an event (time step) to the model for every person added, unless the
+        # model schedules the persons in a batch
+        if schedule:
+            self.add_event(0)
+
+    def add_event(self, time):
+        """
+        Add an event for the agent at a certain time.
+
+        This event is added to the scheduler.
+        """
+        if self.get_state() == 0:
+            self.get_model().add_event(time, self)
+
+    def __str__(self):
+        """
+        Put the person into string form for simple review
+        """
+        return ""
+
+    def serialize(self):
+        """
+        Serialize the person
+        """
+        return self.get_state()
+
+    def get_slot(self):
+        """
+        Return the slot of the person in the model's store and neighbor file
+        """
+        return self.__slot
+
+    def get_neighbors(self):
+        """
+        Return the list of neighbors in a human readable form
+        """
+        model = self.get_model()
+        return [mabm.ElementID(0, neighbor % model.number_of_persons, neighbor // model.number_of_persons)
+                for neighbor in model.neighbor_file.get_neighbors(self.__slot).tolist()]
+
+    def is_neighbor(self, eid):
+        """
+        Check if another person is in the list of neighbors
+        """
+        return eid.serialize() in [neighbor.serialize() for neighbor in self.get_neighbors()]
+
+    def get_state(self):
+        """
+        Return the state of the person
+        """
+        return self.get_model().store.get('state', self.__slot)
+
+    def update(self):
+        """
+        Update the person to determine if they have heard the rumor.  Calculation is based on
+        proportion of neighbors that know the rumor.
+        """
+        model = self.get_model()
+        state = self.get_state()
+        neighbors = model.neighbor_file.get_neighbors(self.__slot).tolist()
+
+        # Number of neighbors
+        neighbor_count = len(neighbors)
+
+        # Update iff state is 0 and the person has neighbors
+        if state == 0 and neighbor_count > 0:
+
+            # Counter for neighbors that know the rumor
+            neighbor_knows = 0
+            eid = self.get_element_id()
+
+            # Cycle through neighbors to gather state information, looking them up by serialized id
+            for neighbor in neighbors:
+                process = neighbor // model.number_of_persons
+                k = model.get_element('0|' + str(neighbor % model.number_of_persons) + '|' + str(process) + '|' +
+                                      str(process)).get_state()
+                neighbor_knows += k
+
+            # Compute the probability of hearing the rumor as the proportion of neighbors
+            # that have heard the rumor.
+            probability_of_hearing = neighbor_knows/float(neighbor_count)
+
+            # With synchronous updates the draw depends only on the person and the time step, so the results
+            # do not depend on the order of the updates or on the placement of the persons
+            if model.synchronous:
+                my_probability = model.draw_hearing(model.get_time(), self.__slot)[0]
+            else:
+                my_probability = npr.random()
+
+            # Person hears the rumor!
+            if my_probability <= probability_of_hearing:
+                state = 1
+                model.store.set('state', self.__slot, state)
+                # Send message to the model informing that the state has been changed,
+                #  model checks to see if the element has an associated watch
+                # ... if so broadcast at next sync time step
+                model.element_state_change(eid)
+                model.update_aggregates(eid, 0, 1)
+
+            # Person will repeat update process at the next timestep
+            else:
+                self.add_event(model.get_time()+1)
+
+        return state
+
+    def get_element_requests(self):
+        for i in self.get_neighbors():
+            self.get_model().request_element(i)
+        return
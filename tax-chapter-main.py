@@ -5,7 +5,7 @@ __author__ = 'jgentile', 'ceharvey'
 Run Instructions
 mpiexec -np 2 python tax-chapter-main.py 5 0.5 20 0.5 0.5 0.5 0.5 0.5 temp
 
-mpiexec -np 2 python tax-chapter-main.py [-h] [-w] [-l] [-W] [-P] [-s] [-n [NOTIFY]]
+mpiexec -np 2 python tax-chapter-main.py [-h] [-w] [-P] [-s] [-n [NOTIFY]]
                            [-a [APPEND]]
                            taxpayers tax_rate t_steps penalty_rate audit_prob
                            app_rate max_audit apprehension network_file
@@ -18,7 +18,6 @@ import tax_model
 import os
 import psutil
 import time
-from subprocess import call
 import argparse
 import cProfile
 import numpy.random as npr
@@ -73,7 +72,11 @@ def main():
 
     m = tax_model.Model(args.taxpayers, args.t_steps, args.tax_rate, args.penalty_rate, args.audit_prob,
                         args.app_rate, args.max_audit, args.apprehension, args.network_file, args.prop_honest,
-                        args.prop_dishonest, identifier, args.write, args.notify)
+                        args.prop_dishonest, identifier, args.write, args.notify, args.write_every,
+                        args.collective, args.report_every,
+                        args.probes, args.probe_every, args.population, args.tolerance,
+                        args.relative_tolerance, args.refresh_every, args.hub_threshold, args.sync_every,
+                        args.sync_threshold)
     # Print out command line arguments
     if m.get_rank() == 0:
         print '\nModel Running with:\n\tTaxpayers = \t\t{}\n\tTime Steps = \t\t{}\n\tTax Rate = \t\t{}\n\t' \
@@ -111,32 +114,22 @@ def main():
     else:
         vmtr_list = m.run()
 
-    # Record Memory
-    my_file = open('memory.csv', 'a')
+    # Record Memory, output files are appended on the model's output writer thread
+    output = m.get_output_writer()
     if m.get_rank() == 0:
         # Split to only use the second part of network file
         # Print: network, taxpayers, number processors, memory after build, memory final
-        my_file.write(args.network_file.split("/")[1]+','+str(args.taxpayers)+','+str(m.get_world_size())+','
-                      +str(build_mem)+','+str(memory_usage_psutil())+'\n')
+        output.append('memory.csv', args.network_file.split("/")[1]+','+str(args.taxpayers)+','
+                      +str(m.get_world_size())+','+str(build_mem)+','+str(memory_usage_psutil())+'\n')
 
     # When finished write output to results.txt
     # Results is of the format: Network File, Processors, Apprehension Rate, Rep #, Run Time, Output
-    my_file = open('results.txt', 'a')
     if m.get_rank() == 0:
         # Split to only use the second part of network file
-        my_file.write(args.network_file.split("/")[1]+','+str(args.taxpayers)+','+str(m.get_world_size())+','+str(args.app_rate)+','
-                      +str(args.repetition)+','+str(time.time()-start_time)+','+str(vmtr_list)+'\n')
-
-    # If file writing is turned on, have the root node run the appropriate scripts to
-    # concatenate the files if option is on
-    if m.get_rank() == 0 and args.write and m.get_world_size > 1:
-        if args.Linux:
-            identifier += '_np-' + str(m.get_world_size()) + '_'
-            my_call = 'sh fix_output.sh output/' + args.network_file.split("/")[1] + '_np-' + str(m.get_world_size()) + '_app_rate-' \
-                      + str(args.app_rate) + '_rep-' + str(args.repetition) + ' ' + identifier
-            call([my_call], shell=True)
-        if args.Windows:
-            call(['fix_output.bat'])
+        output.append('results.txt', args.network_file.split("/")[1]+','+str(args.taxpayers)+','
+                      +str(m.get_world_size())+','+str(args.app_rate)+','+str(args.repetition)+','
+                      +str(time.time()-start_time)+','+str(vmtr_list)+'\n')
+    output.close()
 
 def run_model(model):
     model.run()
@@ -160,11 +153,8 @@ if __name__ == '__main__':
 
 
     # Option Flags
-    parser.add_argument('-w', '--write', help="Write output files for agent knowledge and values",
-                        action="store_true")
-    parser.add_argument('-l', '--Linux', help="Concatenate output files using Shell Script",
-                        action="store_true")
-    parser.add_argument('-W', '--Windows', help="Concatenate output files using Batch Script",
+    parser.add_argument('-w', '--write', help="Write output files for agent knowledge and values, merged into "
+                                              "output/ at the end of the run",
                         action="store_true")
     parser.add_argument('-P', '--Profile', help="Option to include profiling for the program.  Profiling name has a "
                                                 "default with num agents, num processors, rumor prob and cross-process "
@@ -179,6 +169,32 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--notify', help="Give notifications after a certain number of agents"
                                                "have been created on the processor",
                         nargs='?', const=500000, type=int, default=500000)
+    parser.add_argument('--collective', help="Write output into files shared by all processors with MPI-IO",
+                        action="store_true")
+    parser.add_argument('--write-every', help="Write the agent states every WRITE_EVERY time steps",
+                        nargs='?', const=1, type=int, default=1)
+    parser.add_argument('--tolerance', help="Do not send changes of an agent's declared over actual income of at "
+                                            "most TOLERANCE to other processors", type=float, default=0.0)
+    parser.add_argument('--relative-tolerance', help="Do not send changes of an agent's declared over actual income "
+                                                     "of at most RELATIVE_TOLERANCE times its last sent value",
+                        type=float, default=0.0)
+    parser.add_argument('--refresh-every', help="Send the changes within the tolerance every REFRESH_EVERY time "
+                                                "steps", type=int, default=None)
+    parser.add_argument('--hub-threshold', help="Replicate the agents with at least HUB_THRESHOLD neighbors on every "
+                                                "processor instead of watching them", type=int, default=None)
+    parser.add_argument('--sync-every', help="Synchronize the agents on other processors only every SYNC_EVERY "
+                                             "time steps", type=int, default=1)
+    parser.add_argument('--sync-threshold', help="With --sync-every, synchronize earlier once SYNC_THRESHOLD agents "
+                                                 "changed since the last synchronization", type=int, default=None)
+    parser.add_argument('--population', help="Read the taxpayers' attributes from this population (a directory "
+                                             "of .npy files or an uncompressed .npz file)",
+                        type=str, default=None)
+    parser.add_argument('--probes', help="Write the model's probes to this CSV time series file",
+                        nargs='?', const='probes.csv', type=str, default=None)
+    parser.add_argument('--probe-every', help="Evaluate the probes every PROBE_EVERY time steps",
+                        nargs='?', const=1, type=int, default=1)
+    parser.add_argument('--report-every', help="Report the VMTR every REPORT_EVERY time steps",
+                        nargs='?', const=1, type=int, default=1)
     parser.add_argument('-a', '--append', help="Optional text to append to the profile output file name, avoids "
                                                "overwriting other files.", nargs='?', const=None, type=str, default=None)
     args = parser.parse_args()
@@ -0,0 +1,109 @@
+#!/home/ceharvey/local/python-2.7/bin/python
+__author__ = 'jgentile', 'ceharvey'
+
+'''
+Run Instructions
+mpiexec -np 8 python tax-ensemble-main.py 100 0.5 20 0.5 0.5 0.5 True network_data/smallworld_1000 0.5 0.2
+    --app-rates 0.1 0.5 0.9 --repetitions 10 --group-size 2
+
+mpiexec -np num_processors python tax-ensemble-main.py [-h] [-w] [-s] [--app-rates APP_RATES [APP_RATES ...]]
+                           [--repetitions REPETITIONS] [--group-size GROUP_SIZE]
+                           [--report-every [REPORT_EVERY]] [--results RESULTS]
+                           taxpayers tax_rate t_steps penalty_rate audit_prob
+                           max_audit apprehension network_file
+                           prop_honest prop_dishonest
+
+Runs the tax model once for every apprehension rate and repetition in one MPI job. The processors are split
+into groups of GROUP_SIZE, each group runs its share of the replications one after the other and reads the
+network only once. The results are collected on the root processor and written to the results file at the end.
+'''
+
+import mabm
+import tax_model
+import time
+import argparse
+import numpy.random as npr
+
+# This group's part of the network, loaded by its first replication
+network = None
+
+
+def run_replication(comm, replication):
+    """
+    Run the tax model for one (apprehension rate, repetition) on the processors of comm, returns the line of
+    the results file on the group's root processor
+    """
+    global network
+    app_rate, repetition = replication
+    start_time = time.time()
+
+    identifier = args.network_file.split("/")[1] + '_app_rate-' + str(app_rate) + '_rep-' + str(repetition)
+    m = tax_model.Model(args.taxpayers, args.t_steps, args.tax_rate, args.penalty_rate, args.audit_prob,
+                        app_rate, args.max_audit, args.apprehension, args.network_file, args.prop_honest,
+                        args.prop_dishonest, identifier, args.write, report_every=args.report_every, comm=comm)
+
+    # Use a random seed if specified in the command line, one per repetition so the repetitions differ. Every
+    # apprehension rate runs its repetitions with the same seeds.
+    if args.seed:
+        npr.seed(10 + repetition)
+
+    # Every replication of the group uses the same network
+    if network is None:
+        network = m.load_network()
+    m.build_agents(network)
+    vmtr_list = m.run()
+    m.get_output_writer().close()
+
+    # Results are of the format: Network File, Taxpayers, Processors, Apprehension Rate, Rep #, Run Time, Output
+    return args.network_file.split("/")[1]+','+str(args.taxpayers)+','+str(m.get_world_size())+','+str(app_rate) \
+        + ','+str(repetition)+','+str(time.time()-start_time)+','+str(vmtr_list)+'\n'
+
+
+def main():
+    """
+    Run the replications of the tax model in groups of processors and write their results
+    """
+    ensemble = mabm.Ensemble(args.group_size)
+    replications = [(app_rate, repetition) for app_rate in args.app_rates for repetition in range(args.repetitions)]
+    results = ensemble.run(replications, run_replication)
+
+    # Only the root processor has the results
+    if results is not None:
+        with open(args.results, 'a') as f:
+            f.write(''.join(results))
+        print "Ensemble: \t %d replications in %d groups" % (len(replications), ensemble.get_num_groups())
+
+
+if __name__ == '__main__':
+    global args
+
+    # Necessary Command Line Arguments
+    parser = argparse.ArgumentParser(description='Process command line options for the program.')
+    parser.add_argument('taxpayers', help="Number of taxpayers per processor", type=int)
+    parser.add_argument('tax_rate', help="Initial tax rate", type=float)
+    parser.add_argument('t_steps', help="Number of time steps in the model", type=int)
+    parser.add_argument('penalty_rate', help="Penalty rate", type=float)
+    parser.add_argument('audit_prob', help="Probability of auditing", type=float)
+    parser.add_argument('max_audit', help="Max Audit", type=float)
+    parser.add_argument('apprehension', help="True or False for apprehensions", type=bool)
+    parser.add_argument('network_file', help="Specify the network file to be read in", type=str)
+    parser.add_argument('prop_honest', help="Proportion of the population that is honest", type=float)
+    parser.add_argument('prop_dishonest', help="Proportion of the population that is dishonest", type=float)
+
+    # Replications
+    parser.add_argument('--app-rates', help="Apprehension rates to run", nargs='+', type=float, required=True)
+    parser.add_argument('--repetitions', help="Number of repetitions of each apprehension rate", type=int, default=1)
+    parser.add_argument('--group-size', help="Number of processors running each replication", type=int, default=1)
+    parser.add_argument('--results', help="File the results are appended to", type=str, default='results.txt')
+
+    # Option Flags
+    parser.add_argument('-w', '--write', help="Write output files for agent knowledge and values, merged into "
+                                              "output/ at the end of each replication",
+                        action="store_true")
+    parser.add_argument('-s', '--seed', help="Seed repetition R of every apprehension rate with 10 + R",
+                        action="store_true")
+    parser.add_argument('--report-every', help="Report the VMTR every REPORT_EVERY time steps",
+                        nargs='?', const=1, type=int, default=1)
+    args = parser.parse_args()
+
+    main()
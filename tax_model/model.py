@@ -2,14 +2,18 @@ __author__ = 'ceharvey', 'smichel'
 
 import tax_model
 import mabm
+import numpy as np
 import numpy.random as npr
 from numpy import arange
-import shutil
 from mpi4py import MPI
 import sys
-import linecache
+import os
+import cStringIO
 import time
 
+# Personalities of the persons, in the order used by the per-personality probe
+PERSONALITIES = ['Honest', 'Dishonest', 'Imitator']
+
 
 class Model(mabm.Model):
     """
@@ -20,7 +24,10 @@ class Model(mabm.Model):
     __container = None
 
     def __init__(self, total_taxpayers, time_steps, tax_rate, penalty_rate, audit_prob, app_rate, max_audit, apprehension,
-                 network_file, prop_honest, prop_dishonest, identifier, write_file=False, notify=False):
+                 network_file, prop_honest, prop_dishonest, identifier, write_file=False, notify=False,
+                 write_every=1, collective_output=False, report_every=1, probe_file=None, probe_every=1,
+                 population_file=None, tolerance=0.0, relative_tolerance=0.0, refresh_every=None,
+                 hub_threshold=None, sync_every=1, sync_threshold=None, comm=None):
         """
         :param taxpayers:   number of agents per processor
         :param time_steps:  The number of discrete steps of time (also called "ticks") that occur in a single run of
@@ -47,6 +54,27 @@ class Model(mabm.Model):
                             to evade paying taxes as much as possible.
         :param write_file:  write agent state and connection output to a file
         :param notify:      print notifications about the number of steps completed
+        :param write_every: with write_file, write the agent states every write_every time steps
+        :param collective_output: with write_file, all processors write into shared <identifier>_agents.csv and
+                            <identifier>_states.bin files with MPI-IO instead of per-processor files
+        :param report_every: report the VMTR every report_every time steps
+        :param probe_file:  if set, write a histogram of the declared over actual income and its mean for each
+                            personality to this CSV time series
+        :param probe_every: evaluate the probes every probe_every time steps
+        :param population_file: directory of .npy files or uncompressed .npz file with the personality,
+                            actual_income, ps_value and risk_aversion columns of all taxpayers, see
+                            mabm.Population. Missing columns are generated as without a population.
+        :param tolerance:   changes of declared over actual income of at most tolerance + relative_tolerance times
+                            the last published value are not sent to the neighbors on other processors
+        :param relative_tolerance: see tolerance
+        :param refresh_every: if set, changes within the tolerance are sent every refresh_every time steps
+        :param hub_threshold: if set, taxpayers with at least hub_threshold neighbors are replicated on every
+                            processor instead of being watched, see mabm.Model.replicate_elements()
+        :param sync_every:  synchronize the neighbors on other processors only every sync_every time steps, the
+                            persons use the last synchronized declared over actual income in between
+        :param sync_threshold: if set, synchronize earlier once this many persons on all processors changed
+                            their declared over actual income since the last synchronization
+        :param comm:        MPI communicator of the processors running the model, MPI.COMM_WORLD if not set
         :return:
         """
 
@@ -54,7 +82,7 @@ class Model(mabm.Model):
         self.__start_time = time.time()
 
         # Call the MABM module to initiate the model
-        self.initialize_model(True)
+        self.initialize_model(True, comm=comm)
 
         # Create the container for persons
         self.__container = tax_model.PersonList()
@@ -87,118 +115,176 @@ class Model(mabm.Model):
         self.prop_dishonest = prop_dishonest
 
         self.network_file = network_file
+        self.hub_threshold = hub_threshold
+        self.population_file = population_file
         self.notify = notify
         self.write_file = write_file
+        self.write_every = write_every
+        self.collective_output = collective_output
 
-        self.vmtr = 0
         self.vmtr_list = []
         self.temp_storage = identifier + '_np-' + str(self.get_world_size())
 
-    def create_agent(self, my_id):
-        """
-        Function to create a single agent in the model
+        # The sum of declared over actual income is kept up to date as persons declare, and
+        # only reduced across processors when the VMTR is reported
+        self.register_aggregate(0, 'vmtr', mabm.SumAggregate())
+        self.set_report_interval(report_every)
+
+        # Only send changes of declared over actual income that matter to the neighbors
+        self.set_change_tolerance(0, tolerance, relative_tolerance, refresh_every)
+        self.sync_window = sync_every > 1 or sync_threshold is not None
+        self.set_sync_window(sync_every, sync_threshold)
+
+        # Probes of the distribution of declared over actual income
+        if probe_file:
+            states = lambda model: model.__container.get_states()
+            personalities = lambda model: model.__container.get_column(
+                lambda person: PERSONALITIES.index(person.get_personality()), int)
+            self.add_probe(mabm.HistogramProbe('declared_over_actual_histogram', states,
+                                               np.linspace(0, 2, 21), probe_every))
+            self.add_probe(mabm.BreakdownProbe('declared_over_actual_by_personality', states, personalities,
+                                               len(PERSONALITIES), probe_every))
+            self.set_probe_file(probe_file)
+
+    def create_persons(self, network):
         """
+        Create all of the agents on this processor in one batch, with their neighbors taken from
+        the mabm.DistributedNetwork network.
 
-        # Generate the eid of this agent
-        eid = self.get_new_element_id(tax_model.Person)
-
-        # Assign Personal Attributes
+        The attributes are read from this processor's slice of the population file if one is given, see
+        mabm.Population. Attributes missing from it are drawn at random, and the actual income is 100.
+        """
 
-        # Set the personality
-        personality_random = npr.uniform()
-        if personality_random < self.prop_honest:
-          personality = "Honest"
-        elif personality_random < self.prop_honest + self.prop_dishonest:
-          personality = "Dishonest"
+        # Read this processor's agents from the population, the columns are memory-mapped views
+        columns = {}
+        if self.population_file:
+            population = mabm.Population(self.population_file)
+            if population.get_num_agents() != self.taxpayers*self.get_world_size():
+                raise ValueError('Population ' + self.population_file + ' has ' + str(population.get_num_agents()) +
+                                 ' agents, expected ' + str(self.taxpayers*self.get_world_size()) + '.')
+            first = self.get_rank()*self.taxpayers
+            columns = population.get_slice(first, first + self.taxpayers)
+
+        # Assign Personal Attributes. Draws are made in the order of one personality,
+        # ps_value and risk aversion per agent.
+        if not all(name in columns for name in ('personality', 'ps_value', 'risk_aversion')):
+            draws = npr.uniform(size=(self.taxpayers, 3))
+
+        # Set the personality, populations may give it as a name or as an index into PERSONALITIES
+        if 'personality' in columns:
+            personality = columns['personality']
+            if personality.dtype.kind in 'iu':
+                personality = np.take(PERSONALITIES, personality)
         else:
-          personality = "Imitator"
-        actual_income = 100.0
-        ps_value = npr.uniform(0, 1)
+            personality = np.where(draws[:, 0] < self.prop_honest, "Honest",
+                                   np.where(draws[:, 0] < self.prop_honest + self.prop_dishonest, "Dishonest",
+                                            "Imitator"))
+        actual_income = columns['actual_income'] if 'actual_income' in columns else np.repeat(100.0, self.taxpayers)
+        ps_value = columns['ps_value'] if 'ps_value' in columns else draws[:, 1]
         # This can not be 0.0, no dividing by 0
-        risk_aversion = npr.uniform(0, 1)
+        risk_aversion = columns['risk_aversion'] if 'risk_aversion' in columns else draws[:, 2]
 
-        # Create the person and randomly select a number of neighbors
-        p = tax_model.Person(eid, personality, actual_income, ps_value, risk_aversion, self)
+        # Create the persons
+        persons = self.create_agents(tax_model.Person, self.taxpayers, personality=personality,
+                                     actual_income=actual_income, ps_value=ps_value, risk_aversion=risk_aversion)
+
+        # Add the persons to the container and the aggregates
+        self.__container.add_elements(persons)
+        self.add_states_to_aggregates(0, [p.get_declared_over_actual() for p in persons])
 
         ##################################
-        # Add neighbors to the agent
+        # Add neighbors to the agents
         ##################################
 
-        # Create empty trackers for the neighbors to be added to the agent
-        my_neighbor_list = set()
-        neighbors_list = ""
-
-        me = self.get_rank()*self.taxpayers + my_id
-
-        neighbors_from_file = linecache.getline(self.network_file, me+1).strip().split(",")
-        #print neighbors_from_file
-        #neighbors_from_file = [n for (n, e) in enumerate(neighbors_from_file) if e == '1']
-        # Add neighbors to the agent's system
-        for new_neighbor in neighbors_from_file:
-            # Skip blank lines
-            if new_neighbor == '':
-                break
-
-            # Convert to integer
-            new_neighbor = int(new_neighbor)
+        # Compute the neighbors' numbers and processors from their global numbers
+        offsets, neighbors = network.get_csr()
+        numbers = (neighbors % self.taxpayers).tolist()
+        processes = (neighbors // self.taxpayers).tolist()
+        offsets = offsets.tolist()
+        for i, p in enumerate(persons):
+            for j in xrange(offsets[i], offsets[i+1]):
+                p.add_neighbor(mabm.ElementID(0, numbers[j], processes[j]))
 
-            # Compute the neighbor number by finding the id on the processor
-            neighbor_number = new_neighbor % self.taxpayers
-
-            # Compute the processor by dividing by the number of persons
-            # Integer division helps to compute this number
-            neighbor_process = new_neighbor / self.taxpayers
-
-            # Generate the element_id of the new neighbor
-            new_neighbor_eid = mabm.ElementID(0, neighbor_number, neighbor_process)
-
-            # If the neighbor is on a foreign processor, add watches or requests as necessary
-            if neighbor_process != self.get_rank():
-                # Add element watch to the neighbor
-                self.request_element_watch(new_neighbor_eid)
-                self.add_watching(new_neighbor_eid)
-
-            # Add the neighbor to the list
-            my_neighbor_list.add(new_neighbor_eid)
-
-        # Add neighbors from list to person's neighbors
-        for neighbor in my_neighbor_list:
-            p.add_neighbor(neighbor)
-
-        # Write information out to the file
+        # Write information out to the file, one block of persons at a time
         if self.write_file:
-            self.agents_file.write(str(eid) + ',' + str(eid) + ',' + str(self.get_rank()) + ',' + str(personality) +
-                                   ',0,' + str(actual_income) + ',' + str(ps_value) + ',' + str(risk_aversion)  + '\n')
-
-        # Add element to directory and the container.
-        self.add_element_to_directory(p)
-        self.__container.add_element(p)
-
-    def build_agents(self):
+            rank = str(self.get_rank())
+            for start in xrange(0, len(persons), 65536):
+                stop = start + 65536
+                rows = zip(persons[start:stop], personality[start:stop].tolist(), actual_income[start:stop].tolist(),
+                           ps_value[start:stop].tolist(), risk_aversion[start:stop].tolist())
+                self.get_output_writer().write(self.agents_file, ''.join(
+                    str(p.get_element_id()) + ',' + str(p.get_element_id()) + ',' + rank + ',' + str(name) +
+                    ',0,' + str(income) + ',' + str(ps) + ',' + str(risk) + '\n'
+                    for p, name, income, ps, risk in rows))
+
+    def load_network(self):
         """
-        Function to build the agents needed for the simulation
+        Load this processor's part of the network, returns a mabm.DistributedNetwork. Binary network files are
+        memory-mapped and only this processor's slice is read, CSV adjacency lists are parsed in parallel.
+        """
+        if mabm.NetworkFile.is_network_file(self.network_file):
+            network_file = mabm.NetworkFile(self.network_file)
+            if network_file.get_num_nodes() != self.taxpayers*self.get_world_size():
+                raise ValueError('Network ' + self.network_file + ' has ' + str(network_file.get_num_nodes()) +
+                                 ' nodes, expected ' + str(self.taxpayers*self.get_world_size()) + '.')
+            first = self.get_rank()*self.taxpayers
+            offsets, neighbors = network_file.get_slice(first, first + self.taxpayers)
+            return mabm.DistributedNetwork(self.__mabm_comm, self.taxpayers, offsets, neighbors)
+        return mabm.load_adjacency_list(self.__mabm_comm, self.network_file, self.taxpayers)
+
+    def build_agents(self, network=None):
+        """
+        Function to build the agents needed for the simulation. The network is loaded from the network file
+        unless it is given, as returned by load_network() for a model on the same processors.
         """
 
         # File setup if write command is turned on
         if self.write_file:
-            filename = self.temp_storage + '_node_agents'+str(self.get_rank())+'.csv'
-            self.agents_file = open(filename, 'w')
+            if self.collective_output:
+                # Rows are kept in memory and written to the shared file once all agents are built
+                self.agents_file = cStringIO.StringIO()
+            else:
+                filename = self.temp_storage + '_node_agents'+str(self.get_rank())+'.csv'
+                self.agents_file = open(filename, 'w')
             if self.get_rank() == 0:
                 self.agents_file.write('ID, Label, Process, Personality, Declared_Income, Actual_Income, '
                                        'ps_value, Risk_Aversion\n')
 
-        # Create each agent that is needed per processor
-        for i in arange(0, self.taxpayers):
-            self.create_agent(i)
+        # Load this processor's part of the network
+        if network is None:
+            network = self.load_network()
 
-        # File close and clean-up
-        if self.write_file:
-            self.agents_file.close()
+        # Create all agents that are needed per processor
+        self.create_persons(network)
+
+        # Replicate the hubs of skewed networks, and watch the other neighbors located on foreign processors
+        if self.hub_threshold:
+            hubs = self.add_network_hubs(0, network, self.hub_threshold)
+            if self.get_rank() == 0:
+                print "Replicated hubs: \t", hubs
+        self.add_network_watches(0, network)
+
+        # Write the shared file, each processor writes its rows at an offset from an exclusive scan
+        if self.write_file and self.collective_output:
+            self.flush_output()
+            mabm.write_shared_text(self.__mabm_comm, self.temp_storage + '_agents.csv', self.agents_file.getvalue())
+            self.state_writer = mabm.SharedStateWriter(self.__mabm_comm, self.temp_storage + '_states.bin',
+                                                       self.taxpayers, every=self.write_every)
+
+        # File close and clean-up, once the queued output is written
+        elif self.write_file:
+            self.get_output_writer().call(self.agents_file.close)
+
+            # Agent states are appended as one binary column per time step
+            filename = self.temp_storage + '_node_states'+str(self.get_rank())+'.bin'
+            self.state_writer = mabm.StateWriter(filename, self.taxpayers, every=self.write_every,
+                                                 output_writer=self.get_output_writer())
 
         # TODO: Rethink general outputs
-        # Reduce the calculations from all processors to a single number
-        TOTAL_VMTR = self.__mabm_comm.reduce(self.vmtr, MPI.SUM, root=0)
+        # Reduce the aggregates from all processors
+        totals = self.reduce_aggregates()
         if self.get_rank() == 0:
+            TOTAL_VMTR = totals['vmtr']
             print "Initial VMTR: \t %0.4f" % (TOTAL_VMTR)
 
     def run(self):
@@ -208,45 +294,53 @@ class Model(mabm.Model):
         """
         while self.__mabm_time < self.time_steps:
             self.update()
+        self.finalize_probes()
+        self.finalize_model()
+        self.flush_output()
 
         return self.vmtr_list
     
     def post_update_model(self):
         """
-        Update the model and report the current saturation rate of the rumor on this process.
+        Update the model and report the mean VMTR of all persons every report_every time steps.
         """
+        if self.write_file and self.state_writer.is_due(self.__mabm_time):
+            # Append this step's column of agent states, None is recorded as nan
+            self.state_writer.append(self.__mabm_time, self.__container.get_states())
 
-        # Keep out for now until we figure out what we want to report.
-        if self.write_file:
-            self.vmtr = 0
-            filename_old = self.temp_storage + '_node_agents'+str(self.get_rank())+'.csv'
-            original_agents_file = open(filename_old, 'r')
-            filename_new = self.temp_storage + '_final_agents'+str(self.get_rank())+'.csv'
-            agents_new_file = open(filename_new, 'w')
-            if self.get_rank() == 0:
-                line = next(original_agents_file)
-                agents_new_file.write(line.rstrip()+', Declared_Over_Actual_'+str(self.__mabm_time)+'\n')
-
-            i = 0
-            for line in original_agents_file:
-                eid = mabm.ElementID(0, i, self.get_rank())
-                declared_over_actual = self.__container.send_element_state(eid)
-                agents_new_file.write(line.rstrip()+','+str(declared_over_actual)+'\n')
-                try:
-                    self.vmtr += declared_over_actual
-                except TypeError:
-                    # Exception to account for None Types in declared_over_actual
-                    self.vmtr += 0
-                i += 1
-            agents_new_file.close()
-            original_agents_file.close()
-            shutil.move(filename_new, filename_old)
-
-        # Reduce the calculations from all processors to a single number
-        # Reduce the calculation to a single point
-        TOTAL_VMTR = self.__mabm_comm.reduce(self.vmtr, MPI.SUM, root=0)
+        if not self.is_report_due():
+            return
+
+        # Reduce the aggregates from all processors to the root
+        totals = self.reduce_aggregates()
         POPULATION = self.taxpayers*self.get_world_size()
         if self.get_rank() == 0:
+            TOTAL_VMTR = totals['vmtr']
             mean_vmtr = TOTAL_VMTR/float(POPULATION)
             print "Time %d VMTR: \t = %0.4f" % (self.__mabm_time, mean_vmtr)
             self.vmtr_list.append(mean_vmtr)
+
+    def finalize_model(self):
+        """
+        Close the output files and have the root processor merge them into output/<temp_storage>.csv. Shared
+        output files are complete once closed and are not merged.
+        """
+        # The synchronization window's statistics are the same on every processor
+        if self.sync_window and self.get_rank() == 0:
+            statistics = self.get_window_statistics()
+            print "Synchronization window: \t %d synchronized, %d skipped, mean staleness %0.2f, max staleness %d" % \
+                  (statistics['sync_rounds'], statistics['skipped_rounds'], statistics['mean_staleness'],
+                   statistics['max_staleness'])
+
+        if self.write_file and self.collective_output:
+            self.state_writer.close()
+        elif self.write_file:
+            self.state_writer.close()
+            self.__mabm_comm.Barrier()
+            if self.get_rank() == 0:
+                if not os.path.isdir('output'):
+                    os.mkdir('output')
+                size = self.get_world_size()
+                mabm.merge_state_output([self.temp_storage + '_node_agents'+str(i)+'.csv' for i in range(size)],
+                                        [self.temp_storage + '_node_states'+str(i)+'.bin' for i in range(size)],
+                                        'output/' + self.temp_storage + '.csv', 'Declared_Over_Actual')
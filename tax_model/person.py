@@ -24,7 +24,7 @@ class Person(mabm.Agent):
     """
 
     def __init__(self, eid, personality, actual_income,
-                 ps_value, risk_aversion, model):
+                 ps_value, risk_aversion, model, schedule=True):
 
         mabm.Agent.__init__(self, model, None, eid)
         self.__state = personality
@@ -39,8 +39,10 @@ class Person(mabm.Agent):
         self.__declared_over_actual = None
         self.__lower_bound = None
         
-        # Adds an event (time step) to the model for every person added
-        self.add_event(0)
+        # Adds an event (time step) to the model for every person added, unless the
+        # model schedules the persons in a batch
+        if schedule:
+            self.add_event(0)
 
     def add_event(self, time):
         """
@@ -67,6 +69,19 @@ class Person(mabm.Agent):
         Add a neighbor to a person
         """
         self.__neighbors.append(eid)
+        self.get_model().add_ghost_reference(eid)
+
+    def remove_neighbor(self, eid):
+        """
+        Remove a neighbor from a person, the model evicts its copy of a foreign neighbor
+        once no person on this processor has it as a neighbor
+        """
+        serialized = eid.serialize()
+        for i, neighbor in enumerate(self.__neighbors):
+            if neighbor.serialize() == serialized:
+                del self.__neighbors[i]
+                self.get_model().remove_ghost_reference(eid)
+                return
 
     def get_neighbors(self):
         """
@@ -87,6 +102,12 @@ class Person(mabm.Agent):
         """
         return self.get_declared_over_actual()
 
+    def get_personality(self):
+        """
+        Return the personality of the person: Honest, Dishonest or Imitator
+        """
+        return self.__state
+
     def get_declared_over_actual(self):
         """
         Return the state of the person
@@ -217,14 +238,19 @@ class Person(mabm.Agent):
         audited, resulting in possible apprehension. 
         """
         model = self.get_model()
+        eid = self.get_element_id()
 
         old_declared_income = self.__declared_income
+        old_declared_over_actual = self.get_declared_over_actual()
         self.update_declared_income()
         self.audit_check()
         self.add_event(model.get_time()+1)
-        if old_declared_income == self.__declared_income:
-            eid = self.get_element_id()
-            model.element_state_change(eid)
+        # Publish the new state if it changed, the model ignores changes within its tolerance
+        if old_declared_income != self.__declared_income:
+            model.element_state_change(eid, self.get_declared_over_actual())
+
+        # Apply the change to the model's aggregates
+        model.update_aggregates(eid, old_declared_over_actual, self.get_declared_over_actual())
 
         return self.__declared_over_actual
 
@@ -1,30 +1,42 @@
 __author__ = 'jgentile', 'ceharvey'
 
 import mabm
+import numpy as np
 
 class PersonList(mabm.Container):
     """
     Container of people for the model
     """
     __dict = None
+    __list = None
 
     def __init__(self):
         """
-        Initialize an empty dictionary as a container.
+        Initialize an empty dictionary as a container, and a list keeping
+        the elements in the order they were added.
         """
         self.__dict = {}
+        self.__list = []
 
     def add_element(self,element):
         """
         Add an element to the container
         """
         self.__dict[element.get_element_id().serialize()] = element
+        self.__list.append(element)
+
+    def add_elements(self, elements):
+        """
+        Add a list of elements to the container
+        """
+        self.__dict.update((element.get_element_id().serialize(), element) for element in elements)
+        self.__list.extend(elements)
 
     def remove_element(self,eid):
         """
         Remove an element from the container
         """
-        del self.__dict[eid]
+        self.__list.remove(self.__dict.pop(eid))
 
     def send_element_state(self, eid):
         """
@@ -32,6 +44,18 @@ class PersonList(mabm.Container):
         """
         return self.__dict[eid.serialize()].get_state()
 
+    def get_states(self, dtype=float):
+        """
+        Return the states of all elements, in the order they were added, as an array
+        """
+        return np.array([element.get_state() for element in self.__list], dtype=dtype)
+
+    def get_column(self, function, dtype=float):
+        """
+        Return function(element) for all elements, in the order they were added, as an array
+        """
+        return np.array([function(element) for element in self.__list], dtype=dtype)
+
     def update(self):
         """
         Update each element in the dictionary